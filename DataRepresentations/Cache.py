@@ -0,0 +1,181 @@
+# This file contains the content addressed on disk cache of built seasons.
+# Path: DataRepresentations\Cache.py
+# An entry is keyed by the sha256 of the games (dates, teams and stats), the Season configuration and FEATURE_VERSION,
+# so a season is only ever built once for the same input, whichever job or notebook asks for it.
+# FEATURE_VERSION is a hash of the source of the feature code, so any change to it makes new entries (and snapshots).
+# Every entry is a directory with one .npy file per array of the GameStore and a meta.json, written into a temporary
+# directory and renamed into place, so readers never see a half written entry. Loads are memory maps.
+# The cache is bounded in size, the least recently used entries are evicted (a hit touches the entry's meta.json).
+# Publishing and evicting take an exclusive lock on the cache directory (fcntl, where available), loads a shared one.
+#   cache = SeasonCache("~/.cache/hockeypred", max_bytes=2**30)
+#   columns = cache.build(team_list, games, average=True, last_n=5) # Built the first time, memory mapped after that
+import os
+import json
+import shutil
+import hashlib
+import inspect
+import tempfile
+from contextlib import contextmanager
+from typing import List, Dict, Tuple, Union, Optional, Iterable, Any
+import numpy as np
+try:
+    import fcntl
+except ImportError: # Windows, no locking between processes
+    fcntl = None
+from .Representations import Game
+from .Teams import TeamList
+from .Storage import date_to_ordinal
+from .Season import Season, _at_date
+from .Sweep import FeatureSweep
+from .Parallel import ColumnarSeason, to_columnar
+from . import Representations, Teams, Storage, Derived, Schedule, Normalization
+
+def source_tag(*parts:Any)->str:
+    """Short hash of the source of functions, classes and modules (and any extra strings)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update((part if isinstance(part, str) else inspect.getsource(part)).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+# The code the built arrays come from: the stats and their arithmetic, the team averages and totals,
+# how the games become rows of the store and the derived, schedule and normalised features.
+FEATURE_VERSION = source_tag(Representations, Teams, Storage, _at_date, Season._get_stats, Season._add_game, Derived, Schedule, Normalization)
+ARRAYS = ["ordinals", "teams", "features", "present", "records", "results", "game_stats", "game_present"]
+META = "meta.json"
+
+def games_digest(games:Iterable[Game])->"hashlib._Hash":
+    """sha256 of the games in the order Season.add_games adds them (stable by date)."""
+    digest = hashlib.sha256()
+    for game in sorted(games, key=lambda game: game.date):
+        home, away = game.teams
+        digest.update(repr((date_to_ordinal(game.date), str(home.name), str(away.name),
+                            sorted(game.home_stats.stats.items()), sorted(game.away_stats.stats.items()))).encode("utf-8"))
+    return digest
+
+def season_key(games:Iterable[Game], season_kwargs:Dict[str,Any]=None, version:str=FEATURE_VERSION)->str:
+    """The key of the season built from the games with the configuration."""
+    digest = games_digest(games)
+    digest.update(json.dumps({"config":season_kwargs or {}, "version":version}, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+class SeasonCache:
+    def __init__(self, root:str, max_bytes:int=2**30) -> None:
+        self.root = os.path.abspath(os.path.expanduser(root))
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+    # ---- Locking ----
+    @contextmanager
+    def _lock(self, shared:bool=False):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.root, ".lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+    def path(self, key:str)->str:
+        return os.path.join(self.root, key[:2], key)
+    # ---- Reading ----
+    def _read(self, key:str)->Optional[ColumnarSeason]:
+        # Only with the lock held, the memory maps stay valid even if the entry is evicted later.
+        path = self.path(key)
+        try:
+            with open(os.path.join(path, META)) as f:
+                meta = json.load(f)
+            arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in ARRAYS}
+            os.utime(os.path.join(path, META)) # Most recently used
+        except FileNotFoundError:
+            return None
+        return ColumnarSeason(name=key, blocks=meta["blocks"], keys=meta["keys"], team_names=meta["team_names"], **arrays)
+    def _load(self, key:str)->Optional[ColumnarSeason]:
+        with self._lock(shared=True):
+            return self._read(key)
+    def get(self, key:str)->Optional[ColumnarSeason]:
+        """The memory mapped entry, None on a miss."""
+        columns = self._load(key)
+        if columns is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return columns
+    def __contains__(self, key:str)->bool:
+        return os.path.exists(os.path.join(self.path(key), META))
+    # ---- Writing ----
+    def put(self, key:str, columns:ColumnarSeason)->ColumnarSeason:
+        """Store the arrays under the key and return the memory mapped entry."""
+        os.makedirs(os.path.dirname(self.path(key)), exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=".tmp-", dir=self.root) # Same file system, so the rename is atomic
+        try:
+            size = 0
+            for name in ARRAYS:
+                file = os.path.join(tmp, f"{name}.npy")
+                np.save(file, np.ascontiguousarray(getattr(columns, name)))
+                size += os.path.getsize(file)
+            with open(os.path.join(tmp, META), "w") as f:
+                json.dump({"blocks":list(columns.blocks), "keys":list(columns.keys), "team_names":list(columns.team_names),
+                           "size":size, "version":FEATURE_VERSION}, f)
+            with self._lock():
+                try:
+                    os.rename(tmp, self.path(key))
+                except OSError: # Another process published the same entry first, they are identical.
+                    pass
+                self._evict(keep=key)
+                return self._read(key) # Before another writer can evict it
+        finally:
+            if os.path.exists(tmp):
+                shutil.rmtree(tmp, ignore_errors=True)
+    def entries(self)->List[Tuple[float,int,str]]:
+        """(last use, bytes, key) of every entry."""
+        entries = []
+        for prefix in os.listdir(self.root):
+            directory = os.path.join(self.root, prefix)
+            if prefix.startswith(".") or not os.path.isdir(directory):
+                continue
+            for key in os.listdir(directory):
+                meta = os.path.join(directory, key, META)
+                try:
+                    with open(meta) as f:
+                        size = json.load(f)["size"]
+                    entries.append((os.path.getmtime(meta), size, key))
+                except (FileNotFoundError, ValueError, KeyError):
+                    continue
+        return entries
+    @property
+    def size(self)->int:
+        return sum(size for _, size, _ in self.entries())
+    def _evict(self, keep:str=None)->List[str]:
+        # Called with the exclusive lock held. Entries are renamed away before they are removed, so a reader
+        # either gets the whole entry or a miss. Open memory maps stay valid after the files are removed.
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        evicted = []
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            trash = tempfile.mkdtemp(prefix=".evict-", dir=self.root)
+            os.rename(self.path(key), os.path.join(trash, key))
+            shutil.rmtree(trash, ignore_errors=True)
+            total -= size
+            evicted.append(key)
+        return evicted
+    def clear(self)->None:
+        with self._lock():
+            for _, _, key in self.entries():
+                shutil.rmtree(self.path(key), ignore_errors=True)
+    # ---- Building ----
+    def build(self, team_list:TeamList, games:Iterable[Game], **season_kwargs)->ColumnarSeason:
+        """The season built from the games, from the cache if it was built before. windows builds a FeatureSweep."""
+        games = list(games)
+        key = season_key(games, season_kwargs)
+        columns = self.get(key)
+        if columns is not None:
+            return columns
+        season = (FeatureSweep if "windows" in season_kwargs else Season)(team_list, **season_kwargs)
+        season.add_games(games)
+        return self.put(key, to_columnar(key, season))
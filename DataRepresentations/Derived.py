@@ -0,0 +1,308 @@
+# This file contains the derived features, e.g. PP%, SV% and HWvsW from the catalogue in Teams.py.
+# Path: DataRepresentations\Derived.py
+# A derived feature is declared as an expression over the base stats of the games, split in total/home/away:
+#   REGISTRY.register("PP%", Stat("Powerplay Goals") / Stat("Powerplay Opportunities"))
+# Division is safe, a zero denominator gives 0 instead of inf/NaN.
+# The expressions are compiled into NumPy column operations. They are evaluated either for all teams and
+# dates at once from the game stats of a GameStore (CompiledFeatures.evaluate, and pregame for the features before
+# every game, used by schedule_to_season) or incrementally while a Season is built (DerivedState, used by Season(derived=...)).
+from typing import List, Dict, Tuple, Union, Optional, Callable, NamedTuple, Iterable
+import numpy as np
+from .Representations import TeamID
+from .Storage import GameStore, HOME, AWAY
+
+SPLITS = ["total", "home", "away"]
+# Base stats which are not game stats but counted from the results.
+COUNTS = ["Games", "Wins", "Losses", "Ties"]
+
+def safe_divide(numerator:np.ndarray, denominator:np.ndarray, fill:float=0.0)->np.ndarray:
+    numerator, denominator = np.broadcast_arrays(np.asarray(numerator, dtype=float), np.asarray(denominator, dtype=float))
+    out = np.full(numerator.shape, fill)
+    np.divide(numerator, denominator, out=out, where=denominator != 0)
+    return out
+
+class Expr:
+    """Node of a derived feature expression."""
+    def stats(self)->List[Tuple[str,str]]:
+        """The (stat, split) columns the expression reads."""
+        raise NotImplementedError
+    def compile(self, columns:Dict[Tuple[str,str],int])->Callable[[np.ndarray],np.ndarray]:
+        """Returns a function of env (..., teams, columns) -> (..., teams)."""
+        raise NotImplementedError
+    def __add__(self, other): return BinOp("+", self, _expr(other))
+    def __radd__(self, other): return BinOp("+", _expr(other), self)
+    def __sub__(self, other): return BinOp("-", self, _expr(other))
+    def __rsub__(self, other): return BinOp("-", _expr(other), self)
+    def __mul__(self, other): return BinOp("*", self, _expr(other))
+    def __rmul__(self, other): return BinOp("*", _expr(other), self)
+    def __truediv__(self, other): return BinOp("/", self, _expr(other))
+    def __rtruediv__(self, other): return BinOp("/", _expr(other), self)
+
+class Stat(Expr):
+    """A base stat summed over the games of the team, split is 'total', 'home' or 'away'."""
+    def __init__(self, name:str, split:str="total") -> None:
+        assert split in SPLITS, f"Split must be one of {SPLITS}, not {split}"
+        self.name = name
+        self.split = split
+    def stats(self)->List[Tuple[str,str]]:
+        return [(self.name, self.split)]
+    def compile(self, columns:Dict[Tuple[str,str],int])->Callable[[np.ndarray],np.ndarray]:
+        column = columns[(self.name, self.split)]
+        return lambda env: env[..., column]
+    def __repr__(self)->str:
+        return f"Stat({self.name!r})" if self.split == "total" else f"Stat({self.name!r}, {self.split!r})"
+
+class Const(Expr):
+    def __init__(self, value:float) -> None:
+        self.value = float(value)
+    def stats(self)->List[Tuple[str,str]]:
+        return []
+    def compile(self, columns:Dict[Tuple[str,str],int])->Callable[[np.ndarray],np.ndarray]:
+        value = self.value
+        return lambda env: np.full(env.shape[:-1], value)
+    def __repr__(self)->str:
+        return repr(self.value)
+
+class BinOp(Expr):
+    def __init__(self, op:str, left:Expr, right:Expr) -> None:
+        assert op in "+-*/", f"Unknown operator {op}"
+        self.op = op
+        self.left = left
+        self.right = right
+    def stats(self)->List[Tuple[str,str]]:
+        return self.left.stats() + self.right.stats()
+    def compile(self, columns:Dict[Tuple[str,str],int])->Callable[[np.ndarray],np.ndarray]:
+        left, right = self.left.compile(columns), self.right.compile(columns)
+        if self.op == "+":
+            return lambda env: left(env) + right(env)
+        if self.op == "-":
+            return lambda env: left(env) - right(env)
+        if self.op == "*":
+            return lambda env: left(env) * right(env)
+        return lambda env: safe_divide(left(env), right(env))
+    def __repr__(self)->str:
+        return f"({self.left!r} {self.op} {self.right!r})"
+
+class Rank(Expr):
+    """The rank (1 for the lowest value) of the expression among the teams divided by the number of teams."""
+    def __init__(self, expr:Expr) -> None:
+        self.expr = _expr(expr)
+    def stats(self)->List[Tuple[str,str]]:
+        return self.expr.stats()
+    def compile(self, columns:Dict[Tuple[str,str],int])->Callable[[np.ndarray],np.ndarray]:
+        inner = self.expr.compile(columns)
+        def rank(env:np.ndarray)->np.ndarray:
+            values = inner(env)
+            ranks = np.argsort(np.argsort(values, axis=-1, kind="stable"), axis=-1, kind="stable") + 1
+            return ranks / values.shape[-1]
+        return rank
+    def __repr__(self)->str:
+        return f"Rank({self.expr!r})"
+
+def _expr(value:Union[Expr,int,float])->Expr:
+    return value if isinstance(value, Expr) else Const(value)
+
+class DerivedFeature(NamedTuple):
+    name:str
+    expr:Expr
+    description:str = ""
+
+class DerivedTable(NamedTuple):
+    """Derived features of every team after the games of every date, values has shape (dates, teams, features)."""
+    ordinals:np.ndarray
+    team_ids:List[TeamID]
+    names:List[str]
+    values:np.ndarray
+
+class CompiledFeatures:
+    """A set of derived features compiled into one function over the needed base stat columns."""
+    def __init__(self, features:List[DerivedFeature]) -> None:
+        self.features = list(features)
+        self.names = [feature.name for feature in self.features]
+        columns = []
+        for feature in self.features:
+            for column in feature.expr.stats():
+                if column not in columns:
+                    columns.append(column)
+        self.columns:List[Tuple[str,str]] = columns
+        self.stats:List[str] = list(dict.fromkeys(stat for stat, _ in columns)) # Base stats in order of first use
+        self._stat_index = {stat: i for i, stat in enumerate(self.stats)}
+        # env column -> (split, stat) position in the totals arrays
+        self._splits = np.array([SPLITS.index(split) for _, split in columns], dtype=np.intp)
+        self._stat_columns = np.array([self._stat_index[stat] for stat, _ in columns], dtype=np.intp)
+        index = {column: i for i, column in enumerate(columns)}
+        self._functions = [feature.expr.compile(index) for feature in self.features]
+    def __call__(self, totals:np.ndarray)->np.ndarray:
+        """totals (..., teams, 3, stats) summed base stats per split -> (..., teams, features)."""
+        env = totals[..., self._splits, self._stat_columns]
+        if not self._functions:
+            return np.zeros(env.shape[:-1] + (0,))
+        return np.stack([function(env) for function in self._functions], axis=-1)
+    def unsupported(self, keys:Iterable[str])->Dict[str,List[str]]:
+        """The features which need base stats that are neither in keys nor COUNTS, with those stats."""
+        available = set(keys) | set(COUNTS)
+        unsupported = {}
+        for feature in self.features:
+            missing = [stat for stat in dict.fromkeys(stat for stat, _ in feature.expr.stats()) if stat not in available]
+            if missing:
+                unsupported[feature.name] = missing
+        return unsupported
+    def base_values(self, store:GameStore, rows:slice=slice(None))->np.ndarray:
+        """
+        The base stats of the games (games, side, stats), missing game stats count as 0.\n
+        ValueError if a base stat is not a key of the store, the features would be constants otherwise.
+        """
+        game_stats = store.game_stats[rows]
+        game_present = store.game_present[rows]
+        if len(game_stats) and any(stat not in store._key_index and stat not in COUNTS for stat in self.stats):
+            raise ValueError(f"The games have no stats for the derived features {self.unsupported(store.keys)}")
+        results = store.results[rows].astype(int)
+        values = np.zeros(game_stats.shape[:2] + (len(self.stats),))
+        sign = np.array([1, -1])
+        for i, stat in enumerate(self.stats):
+            if stat == "Games":
+                values[..., i] = 1.0
+            elif stat == "Wins":
+                values[..., i] = results[:, None] * sign > 0
+            elif stat == "Losses":
+                values[..., i] = results[:, None] * sign < 0
+            elif stat == "Ties":
+                values[..., i] = (results == 0)[:, None]
+            else:
+                key = store._key_index[stat]
+                values[..., i] = np.where(game_present[..., key], game_stats[..., key], 0.0)
+        return values
+    def totals(self, store:GameStore, n_teams:int=None)->Tuple[np.ndarray,np.ndarray]:
+        """The unique dates and the base stats summed per split up to and including every date, (dates, teams, 3, stats)."""
+        store.sort()
+        n_teams = len(store.team_ids) if n_teams is None else n_teams
+        ordinals, day = np.unique(store.ordinals, return_inverse=True)
+        values = self.base_values(store)
+        teams = store.teams
+        increments = np.zeros((len(ordinals), n_teams, len(SPLITS), len(self.stats)))
+        for side, split in ((HOME, 1), (AWAY, 2)):
+            np.add.at(increments, (day, teams[:, side], 0), values[:, side])
+            np.add.at(increments, (day, teams[:, side], split), values[:, side])
+        return ordinals, np.cumsum(increments, axis=0)
+    def evaluate(self, store:GameStore)->DerivedTable:
+        """All the features of all the teams after every date in one pass."""
+        ordinals, totals = self.totals(store)
+        return DerivedTable(ordinals, list(store.team_ids), list(self.names), self(totals))
+    def pregame(self, store:GameStore)->np.ndarray:
+        """The features of both teams before every game (games, side, features), from the games on earlier dates."""
+        table = self.evaluate(store)
+        # Prepend the features without games so that date index d-1 = -1 maps to "no games yet".
+        empty = self(np.zeros((1, len(table.team_ids), len(SPLITS), len(self.stats))))
+        values = np.concatenate([empty, table.values])
+        day = np.searchsorted(table.ordinals, store.ordinals)
+        return values[day[:, None], store.teams]
+
+class FeatureRegistry:
+    """Named derived features, the catalogue of Teams.py is registered in REGISTRY."""
+    def __init__(self) -> None:
+        self._features:Dict[str,DerivedFeature] = {}
+    def register(self, name:str, expr:Expr, description:str="")->DerivedFeature:
+        assert isinstance(expr, Expr), f"The feature must be an expression, got {type(expr)}"
+        self._features[name] = DerivedFeature(name, expr, description)
+        return self._features[name]
+    def __getitem__(self, name:str)->DerivedFeature:
+        return self._features[name]
+    def __contains__(self, name:str)->bool:
+        return name in self._features
+    def __iter__(self):
+        return iter(self._features.values())
+    def __len__(self)->int:
+        return len(self._features)
+    @property
+    def names(self)->List[str]:
+        return list(self._features.keys())
+    def available(self, keys:Iterable[str])->List[str]:
+        """The names of the features which only need the base stats in keys and COUNTS."""
+        keys = set(keys) | set(COUNTS)
+        return [name for name, feature in self._features.items() if all(stat in keys for stat, _ in feature.expr.stats())]
+    def compile(self, names:Iterable[str]=None)->CompiledFeatures:
+        names = self.names if names is None else list(names)
+        missing = [name for name in names if name not in self._features]
+        if missing:
+            raise ValueError(f"Unknown derived features: {missing}")
+        return CompiledFeatures([self._features[name] for name in names])
+
+class DerivedState:
+    """
+    Running totals of the base stats per team and split, used to compute the derived features while games are added.\n
+    The features before a game only use the games of earlier dates, the same as CompiledFeatures.pregame.
+    They are computed for all teams once per date.
+    """
+    def __init__(self, compiled:CompiledFeatures, store:GameStore, team_ids:Iterable[TeamID]=()) -> None:
+        self.compiled = compiled
+        for team in team_ids: # Register the teams up front so that ranks are taken over the whole league.
+            store.team_index(team)
+        self.reset(store)
+    def reset(self, store:GameStore)->None:
+        """Recompute the totals from the games in the store, e.g. after it was truncated."""
+        n_teams = len(store.team_ids)
+        self.totals = np.zeros((n_teams, len(SPLITS), len(self.compiled.stats)))
+        if store.size:
+            values = self.compiled.base_values(store)
+            for side, split in ((HOME, 1), (AWAY, 2)):
+                np.add.at(self.totals, (store.teams[:, side], 0), values[:, side])
+                np.add.at(self.totals, (store.teams[:, side], split), values[:, side])
+        self._ordinal = None
+        self._values = None
+    def _grow(self, n_teams:int)->None:
+        if n_teams > len(self.totals):
+            self.totals = np.concatenate([self.totals, np.zeros((n_teams - len(self.totals),) + self.totals.shape[1:])])
+            self._ordinal = None
+    def features(self, ordinal:int, teams:Tuple[int,int])->Tuple[Dict[str,float],Dict[str,float]]:
+        """The derived features of the (home, away) teams before a game on the date, empty if a team has not played."""
+        self._grow(max(teams) + 1)
+        if ordinal != self._ordinal:
+            self._ordinal = ordinal
+            self._values = self.compiled(self.totals)
+            self._played = self.totals[:, 0].any(axis=-1)
+        return tuple(dict(zip(self.compiled.names, self._values[team].tolist())) if self._played[team] else {} for team in teams)
+    def add(self, store:GameStore, row:int)->None:
+        """Add the game in the row of the store to the totals."""
+        values = self.compiled.base_values(store, slice(row, row + 1))[0]
+        teams = store.teams[row]
+        self._grow(int(teams.max()) + 1)
+        for side, split in ((HOME, 1), (AWAY, 2)):
+            self.totals[teams[side], 0] += values[side]
+            self.totals[teams[side], split] += values[side]
+
+# ---- The catalogue from Teams.py ----
+REGISTRY = FeatureRegistry()
+_ratios = [
+    # name, stat, description
+    ("HGvsG", "Goals", "Ratio home goals scored to total goals scored"),
+    ("HGAvsGA", "Goals Against", "Ratio home goals against to total goals against"),
+    ("HSPGvsSPG", "Shots", "Ratio home shots to total shots"),
+    ("HHPGvsHPG", "Hits", "Ratio home hits to total hits"),
+    ("HBPGvsBPG", "Blocks", "Ratio home blocks to total blocks"),
+    ("HFOWvsFOW", "Faceoffs Won", "Ratio home faceoffs won to total faceoffs won"),
+    ("HPPGvsPPG", "Powerplay Goals", "Ratio home powerplay goals to total powerplay goals"),
+    ("HPPGAvsPPGA", "Powerplay Goals Against", "Ratio home powerplay goals against to total powerplay goals against"),
+    # Named HBPGvsBPG in the catalogue as well, renamed so it does not clash with the blocks.
+    ("HBXGvsBXG", "Boxplay Goals", "Ratio home boxplay goals to total boxplay goals"),
+    ("HBPGAvsBPGA", "Boxplay Goals Against", "Ratio home boxplay goals against to total boxplay goals against"),
+    ("HPPvsAPP", "Powerplay Opportunities", "Ratio home powerplay opportunities to total powerplay opportunities"),
+]
+REGISTRY.register("PP%", Stat("Powerplay Goals") / Stat("Powerplay Opportunities"), "Powerplay percentage")
+REGISTRY.register("BP%", 1 - Stat("Boxplay Goals Against") / Stat("Boxplay Opportunities"), "Boxplay (penalty kill) percentage")
+REGISTRY.register("AG", Stat("Goals") / Stat("Games"), "Goals per game")
+REGISTRY.register("AGA", Stat("Goals Against") / Stat("Games"), "Goals against per game")
+REGISTRY.register("SPG", Stat("Shots") / Stat("Games"), "Shots per game")
+REGISTRY.register("SV%", 1 - Stat("Goals Against") / Stat("Shots againts"), "Save percentage")
+REGISTRY.register("HPG", Stat("Hits") / Stat("Games"), "Hits per game")
+REGISTRY.register("BPG", Stat("Blocks") / Stat("Games"), "Blocks per game")
+REGISTRY.register("FOW%", Stat("Faceoffs Won") / (Stat("Faceoffs Won") + Stat("Faceoffs Lost")), "Faceoff win percentage")
+REGISTRY.register("GvsGA", Stat("Goals") / Stat("Goals Against"), "Ratio of goals scored to goals against")
+REGISTRY.register("GvsPPG", (Stat("Goals") - Stat("Powerplay Goals")) / Stat("Powerplay Goals"), "Ratio of even strength goals to powerplay goals")
+REGISTRY.register("GAvsBPA", (Stat("Goals Against") - Stat("Boxplay Goals Against")) / Stat("Boxplay Goals Against"), "Ratio of even strength goals against to boxplay goals against")
+REGISTRY.register("PIM", Rank(Stat("Penalty Minutes")), "Ranking of penalty minutes taken")
+REGISTRY.register("PIMD", Rank(Stat("Penalty Minutes Drawn")), "Ranking of penalty minutes drawn")
+REGISTRY.register("HWvsW", Stat("Wins", "home") / Stat("Wins"), "Ratio home wins to total wins")
+REGISTRY.register("HLvsL", Stat("Losses", "home") / Stat("Losses"), "Ratio home losses to total losses")
+REGISTRY.register("HTvsT", Stat("Ties", "home") / Stat("Ties"), "Ratio home ties to total ties")
+for _name, _stat, _description in _ratios:
+    REGISTRY.register(_name, Stat(_stat, "home") / Stat(_stat), _description)
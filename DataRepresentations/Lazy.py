@@ -0,0 +1,40 @@
+# This file contains the lazy imports of the heavy optional dependencies (matplotlib, pandas, tqdm).
+# Path: DataRepresentations\Lazy.py
+# Importing matplotlib.pyplot and pandas takes most of the startup time of a worker which never plots.
+# The modules keep their usual names (plt, pd, ...) but the import only happens on the first attribute access:
+#   plt = lazy_import("matplotlib.pyplot")
+#   plt.subplots() # matplotlib.pyplot is imported here
+import sys
+import importlib
+from types import ModuleType
+
+class LazyModule(ModuleType):
+    """Stand-in for a module which is imported the first time one of its attributes is used."""
+    def __init__(self, name:str) -> None:
+        super().__init__(name)
+        self.__dict__["_lazy_module"] = None
+    def _load(self)->ModuleType:
+        module = self.__dict__["_lazy_module"]
+        if module is None:
+            module = importlib.import_module(self.__name__)
+            self.__dict__["_lazy_module"] = module
+        return module
+    def __getattr__(self, attr:str):
+        # Only called for attributes not set on the stand-in itself.
+        value = getattr(self._load(), attr)
+        if not attr.startswith("__"):
+            self.__dict__[attr] = value # Later accesses are plain attribute lookups.
+        return value
+    def __dir__(self):
+        return dir(self._load())
+    def __repr__(self)->str:
+        state = "loaded" if self.__dict__["_lazy_module"] is not None else "not loaded"
+        return f"<lazy module {self.__name__!r} ({state})>"
+
+def lazy_import(name:str)->ModuleType:
+    """The module if it is already imported, otherwise a LazyModule which imports it on first use."""
+    module = sys.modules.get(name)
+    return module if module is not None else LazyModule(name)
+
+def is_loaded(name:str)->bool:
+    return name in sys.modules
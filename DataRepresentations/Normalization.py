@@ -0,0 +1,215 @@
+# This file contains the league wide normalisation of the features of a Season.
+# Path: DataRepresentations\Normalization.py
+# Every team's latest feature vector is part of the league distribution. The mean and variance of every stat
+# are kept with Welford's algorithm, with removal, so when a team plays only its old vector is swapped for the new one,
+# O(stats) per game. The games of a date are normalised against the league as of the start of that date.
+# The output is either the z-score or the rank of the value among the teams divided by the number of teams.
+# The moments and the QUANTILES of the league are kept as of the start of every date, see moments and quantile.
+import bisect
+import warnings
+import datetime as dt
+from typing import List, Dict, Tuple, Union, Optional
+import numpy as np
+from .Representations import Date
+from .Storage import GameStore, HOME, AWAY, date_to_ordinal
+
+METHODS = ["z", "rank"]
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95) # Kept for every date
+TOLERANCE = 1e-6 # A std this small relative to the mean is the rounding left by removing values, taken as 0
+
+def _ordinal(date:Union[Date,dt.date,int])->int:
+    return date_to_ordinal(date) if isinstance(date, Date) else date.toordinal() if isinstance(date, dt.date) else int(date)
+
+class LeagueNormalizer:
+    """
+    Running league moments per block and stat, and the normalised features of every game.\n
+    normalized: (games, side, block, stat) in the layout of GameStore.features, 0 where the stat is missing.
+    quantiles:  the levels of the quantiles kept for every date.
+    """
+    def __init__(self, n_blocks:int, method:str="z", capacity:int=256, quantiles:Tuple[float,...]=QUANTILES) -> None:
+        assert method in METHODS, f"Method must be one of {METHODS}, not {method}"
+        self.method = method
+        self.n_blocks = n_blocks
+        self.quantiles = tuple(quantiles)
+        self.size = 0
+        self._normalized = np.zeros((max(capacity,1), 2, n_blocks, 0))
+        # The vector every game replaced in the league, so truncate can undo the games from a row.
+        self._previous = np.zeros_like(self._normalized)
+        self._previous_present = np.zeros(self._normalized.shape, dtype=bool)
+        self._teams = np.zeros((max(capacity,1), 2), dtype=np.int64)
+        self._ordinals = np.zeros(max(capacity,1), dtype=np.int64)
+        self.reset_state(0, 0)
+    def reset_state(self, n_teams:int, n_stats:int)->None:
+        shape = (self.n_blocks, n_stats)
+        self.count = np.zeros(shape)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.values = np.zeros((n_teams,) + shape) # Latest vector of every team
+        self.present = np.zeros((n_teams,) + shape, dtype=bool)
+        self._ordinal = None
+        self._snapshot = None
+        # The league at the start of every date: ordinals, (mean, std, count) and the quantiles, (block, stat) each.
+        self._dates:List[int] = []
+        self._date_moments:List[np.ndarray] = []
+        self._date_quantiles:List[np.ndarray] = []
+    def _grow(self, n_teams:int, n_stats:int)->None:
+        teams, stats = self.values.shape[0], self.values.shape[-1]
+        if n_stats > stats:
+            pad = [(0, 0), (0, n_stats - stats)]
+            self.count, self.mean, self.m2 = (np.pad(a, pad) for a in (self.count, self.mean, self.m2))
+            self.values = np.pad(self.values, [(0, 0)] + pad)
+            self.present = np.pad(self.present, [(0, 0)] + pad)
+            self._normalized = np.pad(self._normalized, [(0, 0)] * 3 + [(0, n_stats - stats)])
+            self._previous = np.pad(self._previous, [(0, 0)] * 3 + [(0, n_stats - stats)])
+            self._previous_present = np.pad(self._previous_present, [(0, 0)] * 3 + [(0, n_stats - stats)])
+        if n_teams > teams:
+            self.values = np.pad(self.values, [(0, n_teams - teams), (0, 0), (0, 0)])
+            self.present = np.pad(self.present, [(0, n_teams - teams), (0, 0), (0, 0)])
+        if self._snapshot is not None and (n_stats > stats or n_teams > teams):
+            # New teams and stats are not in the league at the start of the date.
+            stat_pad = [(0, 0), (0, max(n_stats - stats, 0))]
+            team_pad = [(0, max(n_teams - teams, 0))] + stat_pad
+            mean, std, values, present, count = self._snapshot
+            self._snapshot = (np.pad(mean, stat_pad), np.pad(std, stat_pad), np.pad(values, team_pad), np.pad(present, team_pad), np.pad(count, stat_pad))
+        if self.size + 1 > len(self._normalized):
+            self._normalized, self._previous, self._previous_present, self._teams, self._ordinals = (
+                np.concatenate([a, np.zeros_like(a)]) for a in (self._normalized, self._previous, self._previous_present, self._teams, self._ordinals))
+    # ---- Welford with removal, masked per stat ----
+    def _add(self, x:np.ndarray, mask:np.ndarray)->None:
+        count = self.count + mask
+        delta = np.where(mask, x - self.mean, 0.0)
+        mean = self.mean + np.divide(delta, count, out=np.zeros_like(delta), where=count > 0)
+        self.m2 = self.m2 + delta * np.where(mask, x - mean, 0.0)
+        self.count, self.mean = count, mean
+    def _remove(self, x:np.ndarray, mask:np.ndarray)->None:
+        count = self.count - mask
+        delta = np.where(mask, x - self.mean, 0.0)
+        mean = self.mean - np.divide(delta, count, out=np.zeros_like(delta), where=count > 0)
+        self.m2 = np.where(count > 0, self.m2 - delta * np.where(mask, x - mean, 0.0), 0.0)
+        self.count, self.mean = count, np.where(count > 0, mean, 0.0)
+    def update(self, team:int, values:np.ndarray, present:np.ndarray)->None:
+        """Replace the latest vector (block, stat) of the team in the league distribution."""
+        self._remove(self.values[team], self.present[team])
+        self._add(values, present)
+        self.values[team] = np.where(present, values, 0.0)
+        self.present[team] = present
+    @property
+    def variance(self)->np.ndarray:
+        return np.divide(self.m2, self.count, out=np.zeros_like(self.m2), where=self.count > 0)
+    @property
+    def std(self)->np.ndarray:
+        std = np.sqrt(np.maximum(self.variance, 0.0))
+        return np.where(std > TOLERANCE * np.abs(self.mean), std, 0.0)
+    def _quantile(self, q:Union[float,List[float]])->np.ndarray:
+        values = np.where(self.present, self.values, np.nan)
+        if not len(values):
+            return np.full(np.shape(q) + self.mean.shape, np.nan)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning) # All-NaN columns
+            return np.nanquantile(values, q, axis=0)
+    def _date_state(self, date:Union[Date,dt.date,int])->Optional[int]:
+        # The league at the start of a date is the one at the start of the first played date on or after it,
+        # None when the date is after the last played date (the current state).
+        i = bisect.bisect_left(self._dates, _ordinal(date))
+        return i if i < len(self._dates) else None
+    def _pad(self, array:np.ndarray)->np.ndarray:
+        # Stats seen after the date was recorded are missing at that date.
+        missing = self.mean.shape[-1] - array.shape[-1]
+        return np.pad(array, [(0, 0)] * (array.ndim - 1) + [(0, missing)], constant_values=np.nan) if missing else array
+    def moments(self, date:Union[Date,dt.date,int]=None)->Tuple[np.ndarray,np.ndarray,np.ndarray]:
+        """(mean, std, count) per block and stat of the league at the start of the date, by default the current state."""
+        i = None if date is None else self._date_state(date)
+        if i is None:
+            return self.mean.copy(), self.std, self.count.copy()
+        mean, std, count = self._pad(self._date_moments[i])
+        return mean, std, np.nan_to_num(count)
+    def quantile(self, q:Union[float,List[float]], date:Union[Date,dt.date,int]=None)->np.ndarray:
+        """
+        The quantiles of the team values per block and stat, NaN where no team has the stat.\n
+        By default of the current state, with a date of the league at the start of it, then q must be among self.quantiles.
+        """
+        i = None if date is None else self._date_state(date)
+        if i is None:
+            return self._quantile(q)
+        levels = np.atleast_1d(q)
+        for level in levels:
+            if level not in self.quantiles:
+                raise ValueError(f"Only the quantiles {self.quantiles} are kept per date, not {level}")
+        out = self._pad(self._date_quantiles[i])[[self.quantiles.index(level) for level in levels]]
+        return out if np.ndim(q) else out[0]
+    # ---- Normalising ----
+    def _league(self, ordinal:int)->Tuple[np.ndarray,...]:
+        # The league as of the start of the date, copied once per date.
+        if ordinal != self._ordinal or self._snapshot is None:
+            self._ordinal = ordinal
+            self._snapshot = (self.mean.copy(), self.std, self.values.copy(), self.present.copy(), self.count.copy())
+            if not self._dates or ordinal > self._dates[-1]:
+                self._dates.append(ordinal)
+                self._date_moments.append(np.stack([self._snapshot[0], self._snapshot[1], self._snapshot[4]]))
+                self._date_quantiles.append(self._quantile(list(self.quantiles)))
+        return self._snapshot
+    def normalize(self, values:np.ndarray, present:np.ndarray, ordinal:int, team:int=None)->np.ndarray:
+        """
+        Normalise a (block, stat) vector against the league at the start of the date.\n
+        team: index of the team in the store, its own previous vector is then left out of the ranks.
+        """
+        mean, std, league, league_present, count = self._league(ordinal)
+        if self.method == "z":
+            out = np.divide(values - mean, std, out=np.zeros_like(mean), where=(std > 0) & (count > 1))
+        else:
+            below = ((league < values) & league_present).sum(axis=0)
+            equal = ((league == values) & league_present).sum(axis=0)
+            if team is not None and team < len(league):
+                own = league_present[team]
+                below = below - ((league[team] < values) & own)
+                equal = equal - ((league[team] == values) & own)
+                count = count - own
+            # Mid rank in (0, 1], the value itself is counted as part of the league.
+            out = np.divide(below + 0.5 * equal + 0.5, count + 1)
+        return np.where(present, out, 0.0)
+    def add_row(self, store:GameStore, row:int)->None:
+        """Normalise both teams of a game of the store, then update the league with their vectors."""
+        assert row == self.size, f"Rows must be added in order, expected {self.size} got {row}"
+        self._grow(len(store.team_ids), len(store.keys))
+        ordinal = int(store._ordinals[row])
+        features, present = store._features[row], store._present[row]
+        for side in range(2):
+            self._normalized[row, side] = self.normalize(features[side], present[side], ordinal, int(store._teams[row, side]))
+        for side, team in enumerate(store._teams[row]):
+            self._previous[row, side] = self.values[team]
+            self._previous_present[row, side] = self.present[team]
+            self.update(int(team), features[side], present[side])
+        self._teams[row] = store._teams[row]
+        self._ordinals[row] = ordinal
+        self.size += 1
+    def truncate(self, row:int)->None:
+        """Undo the games from the row on, newest first, O(stats) per undone game."""
+        for r in range(self.size - 1, row - 1, -1):
+            for side in (AWAY, HOME):
+                team = int(self._teams[r, side])
+                self.values[team] = self._previous[r, side]
+                self.present[team] = self._previous_present[r, side]
+        # The moments of the restored vectors, removing the values one by one would leave rounding behind.
+        self.count = self.present.sum(axis=0).astype(float)
+        self.mean = np.divide(np.where(self.present, self.values, 0.0).sum(axis=0), self.count, out=np.zeros_like(self.count), where=self.count > 0)
+        self.m2 = np.where(self.present, (self.values - self.mean) ** 2, 0.0).sum(axis=0)
+        # The league at the start of the date stays valid while games of that date are kept.
+        if not (0 < row < self.size and self._ordinals[row - 1] == self._ordinal):
+            self._ordinal = None
+            self._snapshot = None
+        # As is the state at the start of the dates up to the last kept game.
+        kept = bisect.bisect_right(self._dates, int(self._ordinals[row - 1])) if 0 < row <= self.size else 0
+        del self._dates[kept:], self._date_moments[kept:], self._date_quantiles[kept:]
+        self.size = min(self.size, row)
+    def reset(self, store:GameStore)->None:
+        """Rebuild from the games of the store, e.g. after it was truncated."""
+        self.size = 0
+        self._normalized = np.zeros(self._normalized.shape[:3] + (len(store.keys),))
+        self._previous = np.zeros_like(self._normalized)
+        self._previous_present = np.zeros(self._normalized.shape, dtype=bool)
+        self.reset_state(len(store.team_ids), len(store.keys))
+        for row in range(store.size):
+            self.add_row(store, row)
+    @property
+    def normalized(self)->np.ndarray:
+        return self._normalized[:self.size]
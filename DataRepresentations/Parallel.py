@@ -0,0 +1,208 @@
+# This file contains the parallel build of many seasons, e.g. a backfill of every season since 1980.
+# Path: DataRepresentations\Parallel.py
+# Every season is built in a worker process of a pool. The workers only send back the columnar arrays of the
+# season's GameStore (no Season/Team/Stats objects are pickled) with the team names and stat keys, the driver maps
+# the teams onto their league registry index and the stats by key onto one dataset. The merge follows the order of the
+# jobs, so the result does not depend on which worker finished first. The workers start from the driver's registry,
+# so the TeamIDs they create get the same indices as in the driver.
+#   jobs = [SeasonJob(f"synthetic-{seed}", synthetic_source, (32, None, seed)) for seed in range(40)]
+#   dataset = build_seasons(jobs, season_kwargs=dict(average=True, home=True, last_n=5))
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Tuple, Union, Optional, Callable, NamedTuple, Iterable, Any
+import numpy as np
+from .Representations import Game, TeamRegistry, LEAGUE
+from .Teams import TeamList
+from .Season import Season
+from .Sweep import FeatureSweep, SeasonConfig, Projection, project_arrays
+from .Storage import NO_RECORD
+
+class SeasonJob(NamedTuple):
+    """
+    A season to build.\n
+    source(*args, **kwargs) runs in the worker and returns either a built Season or (TeamList, games),
+    it has to be a module level function so it can be sent to the worker.
+    """
+    name:str
+    source:Callable[..., Any]
+    args:tuple = ()
+    kwargs:dict = {}
+
+class ColumnarSeason(NamedTuple):
+    """The arrays of a built season in the layout of GameStore, teams index into team_names and stats into keys."""
+    name:str
+    blocks:List[str]
+    keys:List[str]
+    team_names:List[str]
+    ordinals:np.ndarray
+    teams:np.ndarray
+    features:np.ndarray
+    present:np.ndarray
+    records:np.ndarray
+    results:np.ndarray
+    game_stats:np.ndarray
+    game_present:np.ndarray
+
+class SeasonDataset(NamedTuple):
+    """
+    Several seasons merged into one set of arrays.\n
+    season: (games,) index into seasons, teams are registry indices and team_names the names of the registry,
+    so the same team has the same index in every season. The stat axis follows keys, seasons without a stat have it marked as not present.
+    """
+    seasons:List[str]
+    blocks:List[str]
+    keys:List[str]
+    team_names:List[str]
+    season:np.ndarray
+    ordinals:np.ndarray
+    teams:np.ndarray
+    features:np.ndarray
+    present:np.ndarray
+    records:np.ndarray
+    results:np.ndarray
+    game_stats:np.ndarray
+    game_present:np.ndarray
+    def rows(self, season:Union[int,str])->slice:
+        """The rows of a season, the seasons are stored one after the other."""
+        index = self.seasons.index(season) if isinstance(season, str) else season
+        rows = np.flatnonzero(self.season == index)
+        return slice(int(rows[0]), int(rows[-1]) + 1) if len(rows) else slice(0, 0)
+    def __len__(self)->int:
+        return len(self.season)
+    def project(self, config:SeasonConfig)->Projection:
+        """The columns of a configuration, for datasets built with windows (see Sweep.FeatureSweep)."""
+        return project_arrays(self.blocks, self.keys, config, self.features, self.present, self.game_stats, self.game_present,
+                              records=self.records, results=self.results, teams=self.teams, ordinals=self.ordinals)
+
+def to_columnar(name:str, season:Season)->ColumnarSeason:
+    """Copy the used part of the season's store, the copies are all that is sent back from a worker."""
+    store = season.store
+    store.sort()
+    return ColumnarSeason(
+        name=name,
+        blocks=list(store.blocks),
+        keys=list(store.keys),
+        team_names=[str(team.name) for team in store.team_ids],
+        ordinals=store.ordinals.copy(),
+        teams=store.teams.copy(),
+        features=store.features.copy(),
+        present=store.present.copy(),
+        records=store.records.copy(),
+        results=store.results.copy(),
+        game_stats=store.game_stats.copy(),
+        game_present=store.game_present.copy(),
+    )
+
+def build_season(job:SeasonJob, season_kwargs:Dict[str,Any]=None, registry:TeamRegistry=None, cache_dir:str=None)->ColumnarSeason:
+    """Build a single season, this is what runs in the workers. With a cache_dir the season is only built if it is not in the Cache.SeasonCache."""
+    if registry is not None and registry is not LEAGUE:
+        LEAGUE.update(registry) # A fresh worker gets the driver's indices
+    source = job.source(*job.args, **job.kwargs)
+    if isinstance(source, Season):
+        season = source
+    else:
+        team_list, games = source
+        season_kwargs = season_kwargs or {}
+        if cache_dir is not None:
+            from .Cache import SeasonCache
+            return SeasonCache(cache_dir).build(team_list, games, **season_kwargs)._replace(name=job.name)
+        # With windows every configuration is built at once, project the dataset afterwards.
+        season = (FeatureSweep if "windows" in season_kwargs else Season)(team_list, **season_kwargs)
+        season.add_games(games)
+    return to_columnar(job.name, season)
+
+def _build(args:Tuple[SeasonJob, Dict[str,Any], TeamRegistry, Optional[str]])->ColumnarSeason:
+    return build_season(*args)
+
+def merge(parts:List[ColumnarSeason], registry:TeamRegistry=None)->SeasonDataset:
+    """Merge the seasons in the given order, the teams are interned by name in the registry (LEAGUE by default) and the stats matched by key."""
+    registry = registry if registry is not None else LEAGUE
+    assert len(parts), "Nothing to merge"
+    blocks = parts[0].blocks
+    assert all(part.blocks == blocks for part in parts), "All seasons must be built with the same blocks (Season options)"
+    keys:Dict[str,int] = {}
+    for part in parts:
+        for key in part.keys:
+            keys.setdefault(key, len(keys))
+    n = sum(len(part.ordinals) for part in parts)
+    n_keys = len(keys)
+    features = np.zeros((n, 2, len(blocks), n_keys))
+    present = np.zeros((n, 2, len(blocks), n_keys), dtype=bool)
+    game_stats = np.zeros((n, 2, n_keys))
+    game_present = np.zeros((n, 2, n_keys), dtype=bool)
+    records = np.full((n, 2, 3), NO_RECORD, dtype=np.int32)
+    results = np.zeros(n, dtype=np.int8)
+    ordinals = np.zeros(n, dtype=np.int32)
+    teams = np.zeros((n, 2), dtype=np.int32)
+    season = np.zeros(n, dtype=np.int32)
+    start = 0
+    for i, part in enumerate(parts):
+        rows = slice(start, start + len(part.ordinals))
+        columns = np.array([keys[key] for key in part.keys], dtype=np.intp)
+        team_map = registry.indices(part.team_names)
+        features[rows][..., columns] = part.features
+        present[rows][..., columns] = part.present
+        game_stats[rows][..., columns] = part.game_stats
+        game_present[rows][..., columns] = part.game_present
+        records[rows] = part.records
+        results[rows] = part.results
+        ordinals[rows] = part.ordinals
+        teams[rows] = team_map[part.teams] if len(team_map) else part.teams
+        season[rows] = i
+        start = rows.stop
+    return SeasonDataset(
+        seasons=[part.name for part in parts],
+        blocks=list(blocks),
+        keys=list(keys),
+        team_names=registry.names,
+        season=season,
+        ordinals=ordinals,
+        teams=teams,
+        features=features,
+        present=present,
+        records=records,
+        results=results,
+        game_stats=game_stats,
+        game_present=game_present,
+    )
+
+def build_seasons(jobs:Iterable[SeasonJob],
+                  season_kwargs:Dict[str,Any]=None,
+                  processes:int=None,
+                  mp_context:str=None,
+                  registry:TeamRegistry=None,
+                  cache_dir:str=None,
+                  )->SeasonDataset:
+    """
+    Build the seasons in a process pool and merge them into one dataset.\n
+    season_kwargs are passed to every Season (average, home, away, total, last_n, ...),
+    or to a FeatureSweep if they contain windows (windows, derived), then SeasonDataset.project gives each configuration.
+    processes defaults to the number of cores (capped at the number of jobs), 1 builds in this process.
+    mp_context is the multiprocessing start method, by default the platform's.
+    registry is sent to the workers and used for the merge, LEAGUE by default.
+    cache_dir is a Cache.SeasonCache shared by the workers, seasons built before are loaded from it.
+    """
+    registry = registry if registry is not None else LEAGUE
+    jobs = list(jobs)
+    processes = min(processes or os.cpu_count() or 1, max(len(jobs), 1))
+    work = [(job, season_kwargs, registry, cache_dir) for job in jobs]
+    if processes == 1:
+        parts = [_build(item) for item in work]
+    else:
+        context = multiprocessing.get_context(mp_context) if mp_context else None
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context) as pool:
+            parts = list(pool.map(_build, work)) # In job order
+    return merge(parts, registry)
+
+# ---- Sources ----
+def synthetic_source(n_teams:int=32, n_games:int=None, seed:int=None, **kwargs)->Tuple[TeamList, Iterable[Game]]:
+    """A generated league (see Synthetic.generate_league)."""
+    from .Synthetic import generate_league
+    league = generate_league(n_teams, n_games=n_games, seed=seed, **kwargs)
+    return league.team_list, list(league.games())
+
+def schedule_source(season_url:str)->Season:
+    """The results-only Season of a schedule table (see DataScraping.schedule)."""
+    from DataScraping.schedule import load_schedule_season
+    return load_schedule_season(season_url)
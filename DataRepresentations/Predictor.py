@@ -0,0 +1,294 @@
+# This file contains a long lived predictor which keeps the latest features of every team in memory.
+# Path: DataRepresentations\Predictor.py
+# Instead of replaying a whole Season for every matchup the predictor keeps running sums per team,
+# so a prediction is a couple of dictionary lookups and an update only touches the two teams of the game.
+from collections import deque
+from typing import List, Dict, Tuple, Union, Optional, Callable, Iterable, NamedTuple
+import json
+import numpy as np
+from .Representations import TeamID, Game, GameStats, Date, Stats
+from .Season import index_desc_for
+
+
+class TeamState:
+    """The warm state of a single team.\n
+    Holds running totals of all, home and away games, the last n games and the record,
+    the feature blocks are recomputed once per update and then served as is."""
+    def __init__(self, team:TeamID, keys:List[str], last_n:int=None):
+        self.team = team
+        self.keys = keys # Shared with the predictor, new keys are appended there.
+        self.last_n = last_n
+        self.games = 0
+        self.home_games = 0
+        self.away_games = 0
+        self.totals = np.zeros(len(keys))
+        self.home_totals = np.zeros(len(keys))
+        self.away_totals = np.zeros(len(keys))
+        self.window = deque(maxlen=last_n) if last_n else None
+        self.home_window = deque(maxlen=last_n) if last_n else None
+        self.away_window = deque(maxlen=last_n) if last_n else None
+        self.w_l_t = (0,0,0)
+        self.streak = 0
+        self.last_date:Date = None
+        self.features:np.ndarray = None
+    def _grow(self, size:int)->None:
+        # New stat keys were found, pad all running sums with zeros.
+        pad = size - len(self.totals)
+        if pad <= 0:
+            return
+        self.totals = np.pad(self.totals, (0,pad))
+        self.home_totals = np.pad(self.home_totals, (0,pad))
+        self.away_totals = np.pad(self.away_totals, (0,pad))
+        for window in (self.window, self.home_window, self.away_window):
+            if window is not None:
+                for i in range(len(window)):
+                    window[i] = np.pad(window[i], (0,pad))
+    def add(self, values:np.ndarray, home:bool, result:int, date:Date)->None:
+        """Add the stat vector of one game, result is 1 for win, 0 for tie and -1 for loss."""
+        self._grow(len(values))
+        self.games += 1
+        self.totals += values
+        if home:
+            self.home_games += 1
+            self.home_totals += values
+        else:
+            self.away_games += 1
+            self.away_totals += values
+        if self.window is not None:
+            self.window.append(values)
+            (self.home_window if home else self.away_window).append(values)
+        w,l,t = self.w_l_t
+        if result == 1:
+            self.w_l_t = (w+1,l,t)
+            self.streak = self.streak+1 if self.streak >= 0 else 1
+        elif result == -1:
+            self.w_l_t = (w,l+1,t)
+            self.streak = self.streak-1 if self.streak <= 0 else -1
+        else:
+            self.w_l_t = (w,l,t+1)
+            self.streak = 0
+        self.last_date = date
+    def blocks(self, average:bool=True, home:bool=False, away:bool=False, total:bool=False)->np.ndarray:
+        """Returns the feature blocks in the same order as Season.index_desc, shape (blocks, stats).\n
+        Every team's H/A blocks are its own home/away games, the same split as Season._get_stats."""
+        size = len(self.keys)
+        self._grow(size)
+        rows = []
+        if average:
+            rows.append(self.totals / max(self.games,1))
+            if self.last_n:
+                rows.append(_window_sum(self.window, size) / max(len(self.window),1))
+        if home:
+            rows.append(self.home_totals / max(self.home_games,1))
+            if self.last_n:
+                rows.append(_window_sum(self.home_window, size) / max(len(self.home_window),1))
+        if away:
+            rows.append(self.away_totals / max(self.away_games,1))
+            if self.last_n:
+                rows.append(_window_sum(self.away_window, size) / max(len(self.away_window),1))
+        if total:
+            rows.append(self.totals.copy())
+            if self.last_n:
+                rows.append(_window_sum(self.window, size))
+        return np.vstack(rows) if rows else np.zeros((0,size))
+    @property
+    def win_percentage(self)->float:
+        return self.w_l_t[0] / max(sum(self.w_l_t),1)
+    def __repr__(self) -> str:
+        return f"TeamState({self.team.name}, games={self.games}, record={self.w_l_t})"
+
+def _window_sum(window:deque, size:int)->np.ndarray:
+    total = np.zeros(size)
+    for values in window:
+        total[:len(values)] += values
+    return total
+
+class Prediction(NamedTuple):
+    home_team:TeamID
+    away_team:TeamID
+    date:Date
+    home_features:np.ndarray # (blocks, stats)
+    away_features:np.ndarray # (blocks, stats)
+    home_record:Tuple[int,int,int]
+    away_record:Tuple[int,int,int]
+    probabilities:Optional[np.ndarray] # [home win, tie, away win] if a model is given.
+    def to_dict(self)->Dict:
+        return {
+            "home_team": self.home_team.name,
+            "away_team": self.away_team.name,
+            "date": str(self.date),
+            "home_features": self.home_features.tolist(),
+            "away_features": self.away_features.tolist(),
+            "home_record": list(self.home_record),
+            "away_record": list(self.away_record),
+            "probabilities": None if self.probabilities is None else np.asarray(self.probabilities).tolist(),
+        }
+
+class MatchupPredictor:
+    """
+    Long lived predictor holding the latest pre-computed features of every team.\n
+    The configuration mirrors Season(average, home, away, total, last_n) so the features
+    returned by predict line up with Season.index_desc. Seasons with several windows, Derived or Schedule
+    blocks or normalised features are not supported (from_season raises NotImplementedError).\n
+    model is an optional callable taking the flattened [home features, away features, home record, away record]
+    vector and returning the probabilities [home win, tie, away win].
+    """
+    def __init__(self,
+                average:bool=True,
+                home:bool=False,
+                away:bool=False,
+                total:bool=False,
+                last_n:int=None,
+                keys:List[str]=None,
+                model:Callable[[np.ndarray],np.ndarray]=None,
+                ) -> None:
+        self.average = average
+        self.home = home
+        self.away = away
+        self.total = total
+        self.last_n = last_n
+        self.model = model
+        self.keys:List[str] = list(keys) if keys is not None else []
+        self._key_index:Dict[str,int] = {key:i for i,key in enumerate(self.keys)}
+        self._states:Dict[TeamID,TeamState] = {}
+        self._names:Dict[str,TeamID] = {}
+    def _vector(self, stats:Stats)->np.ndarray:
+        # Missing values are treated as 0, the same way Stats.__add__ and __truediv__ does.
+        for key in stats.stats.keys():
+            if key not in self._key_index:
+                self._key_index[key] = len(self.keys)
+                self.keys.append(key)
+        values = np.zeros(len(self.keys))
+        for key, value in stats.stats.items():
+            values[self._key_index[key]] = float(value or 0)
+        return values
+    def _state(self, team:TeamID)->TeamState:
+        state = self._states.get(team)
+        if state is None:
+            state = TeamState(team, self.keys, self.last_n)
+            self._states[team] = state
+            self._names[team.name] = team
+        return state
+    def _refresh(self, state:TeamState)->None:
+        state.features = state.blocks(self.average, self.home, self.away, self.total)
+    def update(self, game:Game)->None:
+        """Add a played game, only the two teams involved are refreshed."""
+        home_state = self._state(game.home_team_id)
+        away_state = self._state(game.away_team_id)
+        for state in (home_state, away_state):
+            if state.last_date is not None and game.date < state.last_date:
+                raise ValueError(f"Games must be added in order, {game.date} is before {state.last_date}")
+        result = game.result.result
+        home_state.add(self._vector(game.home_stats), True, result, game.date)
+        away_state.add(self._vector(game.away_stats), False, -result, game.date)
+        self._refresh(home_state)
+        self._refresh(away_state)
+    def update_many(self, games:Iterable[Game])->None:
+        for game in games:
+            self.update(game)
+    def team(self, team:Union[TeamID,str])->TeamState:
+        if isinstance(team, str):
+            if team not in self._names:
+                raise KeyError(f"Unknown team {team}")
+            team = self._names[team]
+        elif hasattr(team, "team_id"): # Team objects
+            team = team.team_id
+        state = self._states.get(team)
+        if state is None:
+            raise KeyError(f"Unknown team {team}")
+        if state.features is None or state.features.shape[1] != len(self.keys):
+            self._refresh(state)
+        return state
+    def predict(self, home_team:Union[TeamID,str], away_team:Union[TeamID,str], date:Date=None)->Prediction:
+        """Returns the features of both teams as of the date and the model probabilities if a model is set."""
+        home_state = self.team(home_team)
+        away_state = self.team(away_team)
+        if date is not None:
+            for state in (home_state, away_state):
+                if state.last_date is not None and date < state.last_date:
+                    raise ValueError(f"The predictor only holds the latest state, {date} is before {state.last_date}")
+        probabilities = None
+        if self.model is not None:
+            probabilities = self.model(self.feature_vector(home_state, away_state))
+        return Prediction(home_state.team, away_state.team, date,
+                          home_state.features, away_state.features,
+                          home_state.w_l_t, away_state.w_l_t, probabilities)
+    def feature_vector(self, home_state:TeamState, away_state:TeamState)->np.ndarray:
+        return np.concatenate([home_state.features.ravel(), away_state.features.ravel(), home_state.w_l_t, away_state.w_l_t])
+    @property
+    def index_desc(self)->List[str]:
+        return index_desc_for(self.average, self.home, self.away, self.total, [self.last_n] if self.last_n else [], derived=False)
+    @property
+    def teams(self)->List[TeamID]:
+        return list(self._states.keys())
+    def __len__(self)->int:
+        return len(self._states)
+    def __contains__(self, team)->bool:
+        return team in self._states or team in self._names
+    @classmethod
+    def from_season(cls, season, model:Callable[[np.ndarray],np.ndarray]=None)->"MatchupPredictor":
+        """Warm up a predictor from the teams of an already built Season, no features are recomputed per game."""
+        if season.windows != ([season.last_n] if season.last_n else []) or season.derived or season.schedule or season.normalizer is not None:
+            blocks = index_desc_for(season.average, season.home, season.away, season.total, [season.last_n] if season.last_n else [], derived=False)
+            raise NotImplementedError(f"The predictor only serves the {blocks} blocks, not {season.index_desc}")
+        predictor = cls(average=season.average, home=season.home, away=season.away,
+                        total=season.total, last_n=season.last_n, model=model)
+        for team in season.team_list:
+            state = predictor._state(team.id)
+            calendar = team.team_stats.stats_calendar
+            calendar.sort()
+            for date, stats in calendar:
+                result = 0
+                game_result = team.record.result_by_date(date)
+                if game_result is not None:
+                    result = 1 if game_result.winner == team.id else (-1 if game_result.loser == team.id else 0)
+                state.add(predictor._vector(stats), stats.home, result, date)
+            state.streak = team.record.streak
+            state.w_l_t = team.record.w_l_t
+        for state in predictor._states.values():
+            predictor._refresh(state)
+        return predictor
+
+def _parse_date(date:str)->Date:
+    year, month, day = (int(part) for part in date.split("-"))
+    return Date(year, month, day)
+
+def serve(predictor:MatchupPredictor, host:str="127.0.0.1", port:int=8080)->None:
+    """
+    Serve the predictor over a small local HTTP api.\n
+    GET /predict?home=<team name>&away=<team name>&date=YYYY-MM-DD returns the Prediction as json.
+    GET /teams returns the known team names.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import urlparse, parse_qs
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, code:int, body:Dict)->None:
+            payload = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {k:v[0] for k,v in parse_qs(url.query).items()}
+            if url.path == "/teams":
+                return self._send(200, {"teams": [team.name for team in predictor.teams]})
+            if url.path != "/predict":
+                return self._send(404, {"error": f"Unknown path {url.path}"})
+            try:
+                date = _parse_date(query["date"]) if "date" in query else None
+                prediction = predictor.predict(query["home"], query["away"], date)
+            except (KeyError, ValueError) as e:
+                return self._send(400, {"error": str(e)})
+            self._send(200, prediction.to_dict())
+        def log_message(self, format, *args):
+            pass # Keep the console quiet
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f"Serving predictions on http://{host}:{port}/predict")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
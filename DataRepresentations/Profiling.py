@@ -0,0 +1,130 @@
+# This file contains the opt-in instrumentation of the hot paths (Season, Team, StatList, DateList, Stats).
+# Path: DataRepresentations\Profiling.py
+# Enable it by setting the environment variable HOCKEYPRED_PROFILE=1 before the package is imported.
+# When it is not set the decorators return the functions untouched and the counters sit behind
+# the PROFILING constant, so the instrumentation costs nothing.
+#
+# Usage:
+#   season = Season(team_list)
+#   for game in games: season.add_game(game)   # Timings are aggregated in season.profiler
+#   print(season.profiler.report())
+#   season.profiler.to_chrome_trace("season.trace.json") # Open in chrome://tracing or Perfetto
+import os
+import json
+import time
+import threading
+from functools import wraps
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+PROFILING = os.environ.get("HOCKEYPRED_PROFILE", "0").lower() not in ("", "0", "false", "no")
+
+class Profiler:
+    """Aggregates call counts and timings per instrumented function and free form counters."""
+    def __init__(self, name:str="profiler", max_events:int=1_000_000) -> None:
+        self.name = name
+        self.max_events = max_events # Bound on the events kept for the chrome trace, the aggregates are always complete.
+        self.reset()
+    def reset(self)->None:
+        self.counters:Dict[str,int] = {}
+        self.calls:Dict[str,int] = {}
+        self.total:Dict[str,float] = {}
+        self.max:Dict[str,float] = {}
+        self.events:List[tuple] = []
+        self._origin = time.perf_counter()
+    def count(self, name:str, n:int=1)->None:
+        self.counters[name] = self.counters.get(name, 0) + n
+    def record(self, name:str, start:float, end:float)->None:
+        duration = end - start
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.total[name] = self.total.get(name, 0.0) + duration
+        if duration > self.max.get(name, 0.0):
+            self.max[name] = duration
+        if len(self.events) < self.max_events:
+            self.events.append((name, start, duration, threading.get_ident()))
+    @contextmanager
+    def timer(self, name:str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter())
+    def summary(self)->Dict[str,Dict[str,float]]:
+        return {name: {"calls": self.calls[name], "total_s": self.total[name],
+                       "mean_s": self.total[name] / self.calls[name], "max_s": self.max[name]}
+                for name in sorted(self.total, key=self.total.get, reverse=True)}
+    def report(self)->str:
+        """A plain text table of the timings (inclusive of nested calls) and the counters."""
+        lines = [f"Profile of {self.name}", f"{'function':<40} {'calls':>10} {'total ms':>12} {'mean us':>10} {'max us':>10}"]
+        for name, row in self.summary().items():
+            lines.append(f"{name:<40} {row['calls']:>10} {row['total_s']*1e3:>12.3f} {row['mean_s']*1e6:>10.2f} {row['max_s']*1e6:>10.2f}")
+        if self.counters:
+            lines.append(f"{'counter':<40} {'value':>10}")
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"{name:<40} {value:>10}")
+        return "\n".join(lines)
+    def to_dict(self)->Dict:
+        return {"name": self.name, "timers": self.summary(), "counters": dict(self.counters)}
+    def to_chrome_trace(self, path:str)->None:
+        """Write the recorded calls in the Chrome trace event format."""
+        events = [{"name": name, "ph": "X", "ts": (start - self._origin) * 1e6, "dur": duration * 1e6, "pid": os.getpid(), "tid": tid}
+                  for name, start, duration, tid in self.events]
+        events += [{"name": name, "ph": "C", "ts": 0, "pid": os.getpid(), "args": {name: value}} for name, value in self.counters.items()]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"profiler": self.name}}, f)
+    def __repr__(self)->str:
+        return f"Profiler({self.name}, {sum(self.calls.values())} calls)"
+
+# The profiler which currently receives the measurements, set by the Season being built.
+_current:Optional[Profiler] = None
+
+def current()->Optional[Profiler]:
+    return _current
+
+@contextmanager
+def activate(profiler:Profiler):
+    """Send all measurements made inside the block to the profiler."""
+    global _current
+    previous = _current
+    _current = profiler
+    try:
+        yield profiler
+    finally:
+        _current = previous
+
+def instrument(name:str=None)->Callable:
+    """Time every call of the decorated function, a no-op when profiling is disabled."""
+    def decorator(func:Callable)->Callable:
+        if not PROFILING:
+            return func
+        label = name or func.__qualname__
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = _current
+            if profiler is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.record(label, start, time.perf_counter())
+        return wrapper
+    return decorator
+
+def profiled(func:Callable)->Callable:
+    """Method decorator which activates self.profiler for the duration of the call, a no-op when profiling is disabled."""
+    if not PROFILING:
+        return func
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if _current is self.profiler:
+            return func(self, *args, **kwargs)
+        with activate(self.profiler):
+            return func(self, *args, **kwargs)
+    return wrapper
+
+def count(name:str, n:int=1)->None:
+    """Add n to a counter of the active profiler. Call sites guard it with `if PROFILING:`."""
+    profiler = _current
+    if profiler is not None:
+        profiler.count(name, n)
@@ -0,0 +1,139 @@
+# This file contains the indexed queries over the games of a Season.
+# Path: DataRepresentations\Query.py
+# GameIndex keeps the rows of every team in the GameStore (in date order, as the store is), updated by Season.add_game.
+# A query starts from the rows of the team (or a date slice of the whole store) and filters them with NumPy:
+#   season.query("Boston Bruins", opponent=rivals, start=Date(2023,2,1), end=Date(2023,2,28), venue="away")
+# The result holds the rows and the side the team played on, features()/records()/... give the team's point of view.
+# Queries without a team are a slice of the store, so their arrays are views.
+import datetime as dt
+from typing import List, Dict, Tuple, Union, Optional, Iterable, NamedTuple
+import numpy as np
+from .Representations import TeamID, Date
+from .Storage import GameStore, HOME, AWAY, date_to_ordinal
+
+VENUES = ["home", "away"]
+TeamLike = Union[TeamID, str, "Team"]
+DateLike = Union[Date, dt.date, int]
+
+def _ordinal(date:DateLike)->int:
+    if isinstance(date, Date):
+        return date_to_ordinal(date)
+    if isinstance(date, dt.date):
+        return date.toordinal()
+    return int(date)
+
+class GameIndex:
+    """The rows of the store per team, appended while games are added and cut when the season is rewound."""
+    def __init__(self) -> None:
+        self._rows:List[np.ndarray] = []
+        self._counts:List[int] = []
+        self.size = 0 # Number of store rows indexed
+    def _team(self, team:int)->None:
+        while len(self._rows) <= team:
+            self._rows.append(np.zeros(16, dtype=np.int64))
+            self._counts.append(0)
+    def add(self, row:int, teams:Tuple[int,int])->None:
+        assert row == self.size, f"Rows must be indexed in order, expected {self.size} got {row}"
+        for team in set(int(t) for t in teams):
+            self._team(team)
+            count = self._counts[team]
+            if count == len(self._rows[team]):
+                self._rows[team] = np.concatenate([self._rows[team], np.zeros(max(count, 16), dtype=np.int64)]) # rebuild leaves them full
+            self._rows[team][count] = row
+            self._counts[team] = count + 1
+        self.size += 1
+    def truncate(self, row:int)->None:
+        for team, rows in enumerate(self._rows):
+            self._counts[team] = int(np.searchsorted(rows[:self._counts[team]], row, side="left"))
+        self.size = min(self.size, row)
+    def rebuild(self, store:GameStore)->None:
+        """Index every row of the store again, e.g. after it was filled with GameStore.extend or sorted."""
+        store.sort()
+        self._rows, self._counts, self.size = [], [], 0
+        teams = store.teams
+        for team in range(len(store.team_ids)):
+            rows = np.flatnonzero((teams == team).any(axis=1))
+            self._rows.append(rows)
+            self._counts.append(len(rows))
+        self.size = store.size
+    def rows(self, team:int)->np.ndarray:
+        """The rows of the team, in date order."""
+        if team < 0 or team >= len(self._rows):
+            return np.zeros(0, dtype=np.int64)
+        return self._rows[team][:self._counts[team]]
+
+class GameQuery(NamedTuple):
+    """
+    The games matching a query.\n
+    rows: index array into the store, or a slice when no team was given.
+    side: the side (HOME/AWAY) of the queried team in every row, None without a team.
+    """
+    store:GameStore
+    rows:Union[np.ndarray,slice]
+    side:Optional[np.ndarray]
+    def __len__(self)->int:
+        return len(range(*self.rows.indices(self.store.size))) if isinstance(self.rows, slice) else len(self.rows)
+    def _team_view(self, array:np.ndarray, opponent:bool=False)->np.ndarray:
+        # (games, side, ...) -> the queried team's (or its opponent's) (games, ...)
+        if self.side is None:
+            return array[self.rows]
+        side = 1 - self.side if opponent else self.side
+        return array[self.rows, side]
+    def features(self, opponent:bool=False)->np.ndarray:
+        """(games, block, stat) for a team query, (games, side, block, stat) otherwise."""
+        return self._team_view(self.store.features, opponent)
+    def present(self, opponent:bool=False)->np.ndarray:
+        return self._team_view(self.store.present, opponent)
+    def records(self, opponent:bool=False)->np.ndarray:
+        return self._team_view(self.store.records, opponent)
+    def game_stats(self, opponent:bool=False)->np.ndarray:
+        return self._team_view(self.store.game_stats, opponent)
+    def game_present(self, opponent:bool=False)->np.ndarray:
+        return self._team_view(self.store.game_present, opponent)
+    def results(self)->np.ndarray:
+        """1 for a win of the queried team (of the home team without one), -1 for a loss and 0 for a tie."""
+        results = self.store.results[self.rows].astype(np.int8)
+        return results if self.side is None else np.where(self.side == HOME, results, -results)
+    def ordinals(self)->np.ndarray:
+        return self.store.ordinals[self.rows]
+    def dates(self)->List[Date]:
+        return [self.store.date(ordinal) for ordinal in self.ordinals().tolist()]
+    def opponents(self)->np.ndarray:
+        """Store team index of the opponent in every row, only for team queries."""
+        assert self.side is not None, "Only a team query has opponents"
+        return self.store.teams[self.rows, 1 - self.side]
+    def games(self)->list:
+        """The (date, [Stats...], record, [Stats...], record, result) tuples, built from the store."""
+        from .Storage import GameList
+        games = GameList(self.store)
+        rows = range(*self.rows.indices(self.store.size)) if isinstance(self.rows, slice) else self.rows.tolist()
+        return [games[row] for row in rows]
+
+def query(index:GameIndex, store:GameStore, team:Optional[int]=None, opponents:Optional[List[int]]=None,
+          start:DateLike=None, end:DateLike=None, venue:str=None)->GameQuery:
+    """The games of the store matching every given filter, teams as store team indices. opponents=[] matches nothing."""
+    assert venue is None or venue in VENUES, f"Venue must be one of {VENUES} or None, not {venue}"
+    if venue is not None and team is None:
+        raise ValueError("A venue needs a team")
+    ordinals = store.ordinals
+    lo = 0 if start is None else int(np.searchsorted(ordinals, _ordinal(start), side="left"))
+    hi = store.size if end is None else int(np.searchsorted(ordinals, _ordinal(end), side="right"))
+    if team is None:
+        if opponents is None and venue is None:
+            return GameQuery(store, slice(lo, hi), None)
+        rows = np.arange(lo, hi)
+        teams = store.teams[lo:hi]
+        if opponents is not None: # Either team is one of them
+            rows = rows[np.isin(teams, opponents).any(axis=1)]
+        return GameQuery(store, rows, None)
+    rows = index.rows(team)
+    rows = rows[np.searchsorted(ordinals[rows], _ordinal(start), side="left"):] if start is not None else rows
+    rows = rows[:np.searchsorted(ordinals[rows], _ordinal(end), side="right")] if end is not None else rows
+    teams = store.teams[rows]
+    side = np.where(teams[:, HOME] == team, HOME, AWAY).astype(np.intp)
+    mask = np.ones(len(rows), dtype=bool)
+    if venue is not None:
+        mask &= side == (HOME if venue == "home" else AWAY)
+    if opponents is not None:
+        mask &= np.isin(teams[np.arange(len(rows)), 1 - side], opponents)
+    return GameQuery(store, rows[mask], side[mask])
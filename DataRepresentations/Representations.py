@@ -3,14 +3,16 @@
 # Such as; Record, ...
 from dataclasses import dataclass
 import numpy as np
-import pandas as pd
-import uuid
 import os
 import sys
 import re
 import datetime as dt
-import matplotlib.pyplot as plt
-import matplotlib.ticker as mticker
+from .Lazy import lazy_import
+# Only imported when a plot or a pandas conversion is made.
+pd = lazy_import("pandas")
+plt = lazy_import("matplotlib.pyplot")
+mticker = lazy_import("matplotlib.ticker")
+uuid = lazy_import("uuid")
 # Custom name for typing
 from typing import List, Dict, Tuple, Union, Optional,Any
 # Create custom typing given a string
@@ -21,6 +23,7 @@ import datetime as dt
 from typing import NamedTuple
 # Ordered dictionary
 from collections import OrderedDict
+from .Profiling import PROFILING, instrument, count as profile_count
 
 @dataclass # This should be sortable
 class Date:
@@ -76,7 +79,10 @@ class DateList:
         self.dates = dates if dates is not None else []
     def add_date(self, date: Date):
         self.dates.append(date)
+    @instrument("DateList.get_closest_date")
     def get_closest_date(self, date: Date, direction: str="below"):
+        if PROFILING:
+            profile_count("DateList.dates_scanned", len(self.dates))
         if direction == "below":
             seq = [d for d in self.dates if d <= date]
             if len(seq) == 0:
@@ -89,7 +95,10 @@ class DateList:
             return min(seq)
         else:
             raise ValueError("Invalid direction")
+    @instrument("DateList.get_n_closest_dates")
     def get_n_closest_dates(self, date: Date, n: int=1, direction: str="below")->"DateList":
+        if PROFILING:
+            profile_count("DateList.dates_scanned", len(self.dates))
         assert n > 0, "n must be greater than 0"
         if direction == "below":
             return DateList(sorted([d for d in self.dates if d <= date], reverse=True)[:n])
@@ -114,6 +123,9 @@ class DateList:
         return date in self.dates
     def __add__(self, other):
         return DateList(self.dates + other.dates)
+    def truncate(self, date: Date)->None:
+        """Removes all the dates on or after the given date."""
+        self.dates = [d for d in self.dates if d < date]
             
 
         
@@ -162,11 +174,21 @@ class TeamID:
         self._team_abbreviation = team_abbreviation
         self._team_city = team_city
         if self._team_id is None: # If the id is not given, then create it
-            self._team_id = id(self)
+            # Interned in the league registry so the same name gets the same id, id(self) only for nameless teams,
+            # which are never registered.
+            self._team_id = LEAGUE.index(team_name, team_abbreviation, team_city) if team_name is not None else id(self)
+    @classmethod
+    def from_name(cls, team_name:str, team_abbreviation:str=None, team_city:str=None)->"TeamID":
+        """The TeamID of the name in the league registry, the same as TeamID(team_name)."""
+        return LEAGUE.intern(team_name, team_abbreviation, team_city)
     @property
     def id(self):
         return self._team_id
     @property
+    def named(self)->bool:
+        """False for the teams created without a name, their id is id(self) and they are not in the registry."""
+        return self._team_name is not None
+    @property
     def name(self):
         return self._team_name if self._team_name is not None else self.id # Fall back to id
     @property
@@ -207,6 +229,96 @@ class TeamID:
     
     
 
+class TeamRegistry:
+    """
+    League wide interning of the teams.\n
+    Every team name gets a dense index 0, 1, 2, ... in order of registration which never changes, so the index can be
+    used directly as the offset of the team in arrays over the teams (TeamList, ConfusionMatrix, GameStore, exports).
+    Teams are matched by name or abbreviation. The registry is plain data, it pickles by value and can be saved and loaded
+    to keep the indices between runs and processes.
+    """
+    def __init__(self, names:List[str]=None) -> None:
+        self.teams:List[TeamID] = []
+        self._by_name:Dict[str,int] = {}
+        self._by_abbreviation:Dict[str,int] = {}
+        for name in names or []:
+            self.intern(name)
+    def intern(self, team_name:str, team_abbreviation:str=None, team_city:str=None)->TeamID:
+        """The registered TeamID of the team, registering it if it is new."""
+        return self.teams[self.index(team_name, team_abbreviation, team_city)]
+    def index(self, team:Union["TeamID",str,int], team_abbreviation:str=None, team_city:str=None)->int:
+        """The dense index of a TeamID, name or index, registering new names."""
+        if isinstance(team, (int, np.integer)) and not isinstance(team, bool):
+            assert 0 <= team < len(self.teams), f"No team with index {team}, {len(self.teams)} teams are registered"
+            return int(team)
+        if isinstance(team, TeamID):
+            team_name, team_abbreviation, team_city = team._team_name, team._team_abbreviation, team._team_city
+        else:
+            team_name = team
+        index = self.find(team_name, team_abbreviation) if team_name is not None else None
+        if index is None:
+            if team_name is None:
+                raise ValueError("Only named teams can be registered")
+            index = len(self.teams)
+            self.teams.append(TeamID(team_name, index, team_abbreviation, team_city))
+            self._by_name[team_name] = index
+        if team_abbreviation is not None:
+            self._by_abbreviation.setdefault(team_abbreviation, index)
+        return index
+    def find(self, team_name:Union["TeamID",str], team_abbreviation:str=None)->Optional[int]:
+        """The index of the team without registering it, None if it is unknown."""
+        if isinstance(team_name, TeamID):
+            if not team_name.named:
+                return None
+            team_name, team_abbreviation = team_name._team_name, team_name._team_abbreviation
+        index = self._by_name.get(team_name)
+        if index is None:
+            index = self._by_abbreviation.get(team_abbreviation if team_abbreviation is not None else team_name)
+        return index
+    def indices(self, teams:List[Union["TeamID",str]])->np.ndarray:
+        return np.array([self.index(team) for team in teams], dtype=np.int32)
+    def update(self, other:Union["TeamRegistry",List[str]])->None:
+        """Register the teams of another registry (or names) in its order, e.g. a registry sent to a worker process."""
+        for team in (other.teams if isinstance(other, TeamRegistry) else other):
+            self.index(team)
+    @property
+    def names(self)->List[str]:
+        return [team.name for team in self.teams]
+    def __getitem__(self, item:Union[int,str])->"TeamID":
+        if isinstance(item, str):
+            index = self.find(item)
+            if index is None:
+                raise KeyError(item)
+            return self.teams[index]
+        return self.teams[item]
+    def __contains__(self, item:Union["TeamID",str])->bool:
+        return self.find(item) is not None
+    def __len__(self)->int:
+        return len(self.teams)
+    def __iter__(self):
+        return iter(self.teams)
+    def __repr__(self)->str:
+        return f"TeamRegistry({len(self.teams)} teams)"
+    def to_dict(self)->Dict[str,Any]:
+        return {"teams":[[team.name, team._team_abbreviation, team._team_city] for team in self.teams]}
+    @classmethod
+    def from_dict(cls, data:Dict[str,Any])->"TeamRegistry":
+        registry = cls()
+        for name, abbreviation, city in data["teams"]:
+            registry.intern(name, abbreviation, city)
+        return registry
+    def save(self, path:str)->None:
+        import json
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=1)
+    @classmethod
+    def load(cls, path:str)->"TeamRegistry":
+        import json
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+LEAGUE = TeamRegistry() # The default registry of the process.
+
 # Each team has a record of wins, losses and ties.
 # This class is used to represent that record.
 
@@ -226,8 +338,9 @@ class Stats:
         return list(self.stats.keys())
     def __str__(self):
         return f"---Date: {self.date}---\nStats: {dict_to_print_string(self.stats)},\n Home: {self.home}"
+    @instrument("Stats.__add__")
     def __add__(self, other:"Stats"):
-        if other==0:
+        if isinstance(other, (int, float)) and other==0: # sum() starts from 0, Stats itself can not be compared
             return Stats(self.stats, self.date, self.home)
         new_stats = self.stats.copy() # Copy the stats dictionary
         assert issubclass(type(other), Stats), f"Can only add Stats objects to Stats objects. Got {type(other)}" 
@@ -317,7 +430,7 @@ class Stats:
         stats.index = [f"{name}_{key}" for key in stats.index] 
         return stats
         # return pd.Series(self.stats, name=name)
-    def plot(self, ax: plt.Axes=None, title: str=None, xlabel: str=None, ylabel: str=None, **kwargs):
+    def plot(self, ax: "plt.Axes"=None, title: str=None, xlabel: str=None, ylabel: str=None, **kwargs):
         keys = self.stats.keys()
         values = self.stats.values()
         fig = None
@@ -377,7 +490,7 @@ class StatList:
             else:
                 assert issubclass(type(stats), Stats), "All elements in the list must be Stats objects"
                 self._stats[stats.date] = stats
-    def plot(self, ax:plt.Axes=None,date=None,title: str=None, xlabel: str=None, ylabel: str=None, **kwargs):
+    def plot(self, ax:"plt.Axes"=None,date=None,title: str=None, xlabel: str=None, ylabel: str=None, **kwargs):
         # Create a subplot for each stat
         game_stats = self.total_to_date(date)
         ax = game_stats.plot(ax=ax,title=title, xlabel=xlabel, ylabel=ylabel, **kwargs)
@@ -406,8 +519,12 @@ class StatList:
         return date in self._stats.keys()
     def __eq__(self, other):
         raise NotImplementedError("Cannot compare StatLists")
+    @instrument("StatList.total_to_date")
     def total_to_date(self, final_date:Date=None,return_length=False)->Stats:
         cumulative = [stats for date, stats in self if final_date is None or date <= final_date]
+        if PROFILING:
+            profile_count("StatList.elements_scanned", len(self._stats))
+            profile_count("StatList.elements_summed", len(cumulative))
         if len(cumulative):
             if return_length:
                 return sum(cumulative), len(cumulative)
@@ -430,6 +547,10 @@ class StatList:
         return StatList(list(self._stats.values())[-n:])
     def clear(self):
         self._stats = OrderedDict() # Clear the stats
+    def truncate(self, date:Date)->None:
+        """Removes all the stats on or after the given date."""
+        self._stats = OrderedDict([(d, stats) for d, stats in self._stats.items() if d < date])
+        self._added_dates.truncate(date)
     @property
     def stats(self):
         return self._stats
@@ -538,6 +659,7 @@ class TeamStats:
         return self.last_n_away(n).average()
     def last_n_total(self, n:int):
         return self.last_n(n).total()
+    @instrument("TeamStats.dates_to_statlist")
     def dates_to_statlist(self, dates:DateList,home:bool=False,away:bool=False)->StatList:
         if home:
             return StatList([self.home_stats_calendar[d] for d in dates])
@@ -547,7 +669,7 @@ class TeamStats:
             return StatList([self.stats_calendar[d] for d in dates])
 
     
-    def plot(self, metric="total",date:Date=None, title:str=None, xlabel:str=None, ylabel:str=None, **kwargs)->Tuple[plt.Figure, plt.Axes]:
+    def plot(self, metric="total",date:Date=None, title:str=None, xlabel:str=None, ylabel:str=None, **kwargs)->Tuple["plt.Figure", "plt.Axes"]:
         assert metric is None or metric.lower() in ["total","average"], "Metric must be either 'Total' or 'Average'"
         calenders = [self.stats_calendar, self.home_stats_calendar, self.away_stats_calendar]
         # Set first letter of metric to uppercase rest to lowercase
@@ -578,6 +700,11 @@ class TeamStats:
         self.home_stats_calendar.clear()
         self.away_stats_calendar.clear()
         self.stats_calendar.clear()
+    def truncate(self, date:Date):
+        """Removes all the stats on or after the given date."""
+        self.home_stats_calendar.truncate(date)
+        self.away_stats_calendar.truncate(date)
+        self.stats_calendar.truncate(date)
     @property
     def available_stats(self):
         return self.stats_calendar.available_stats
@@ -761,6 +888,13 @@ class Record:
         self._ties = 0
         self.streak = 0
         self._history = OrderedDict()
+    def truncate(self, date:Date):
+        """Removes all the games on or after the given date, the record is restored to what it was before that date"""
+        self._history = OrderedDict([(d, entry) for d, entry in self._history.items() if d < date])
+        if len(self._history):
+            _, (self._wins, self._losses, self._ties), self.streak = next(reversed(self._history.values()))
+        else:
+            self._wins, self._losses, self._ties, self.streak = 0, 0, 0, 0
     def last_n(self, n:int):
         """Returns the last n games in the record"""
         # First check if n is valid:
@@ -784,6 +918,10 @@ class Record:
         """Returns the streak up to and including the given date"""
         _,_,streak = self._history.get(date, (None,None,None))
         return streak
+    def result_by_date(self, date:Date)->Optional[GameResult]:
+        """Returns the result of the game on the given date, None if the team did not play"""
+        result,*_ = self._history.get(date, (None,None,None))
+        return result
 
 
     def __getitem__(self, key)->Tuple[GameResult,Tuple[int,int,int],int]:
@@ -0,0 +1,114 @@
+# This file contains the schedule context features of the games: rest, back to backs, busy weeks and home stands/road trips.
+# Path: DataRepresentations\Schedule.py
+# The features only depend on when and where the teams played, so they are known before the game:
+#   Rest Days          days since the team's previous game (missing for its first game)
+#   Back To Back       1 if the team also played the day before
+#   Games Last 7       games the team played in the 7 days before
+#   Venue Run          length of the run of home (+) or away (-) games the game is part of, itself included
+#   Rest Differential  the team's rest days minus the opponent's (missing unless both have played)
+# schedule_features computes them for all the games of a store at once (schedule_to_season, ScheduleState.reset),
+# ScheduleState keeps the running state for Season.add_game.
+import bisect
+from typing import List, Dict, Tuple, Union, Optional
+import numpy as np
+from .Storage import GameStore, HOME, AWAY
+
+BLOCK = "Schedule"
+FEATURES = ["Rest Days", "Back To Back", "Games Last 7", "Venue Run", "Rest Differential"]
+WINDOW = 7 # Days counted by "Games Last 7"
+
+def schedule_features(ordinals:np.ndarray, teams:np.ndarray)->Tuple[np.ndarray,np.ndarray]:
+    """
+    The schedule features of every game, ordinals (games,) sorted and teams (games, side).\n
+    Returns values and present, both (games, side, feature) in the order of FEATURES.
+    """
+    n = len(ordinals)
+    values = np.zeros((n, 2, len(FEATURES)))
+    present = np.ones((n, 2, len(FEATURES)), dtype=bool)
+    if not n:
+        return values, present
+    # One entry per team and game, grouped per team in game order.
+    team = teams.reshape(-1).astype(np.int64)
+    ordinal = np.repeat(ordinals.astype(np.int64), 2)
+    venue = np.tile(np.array([1, -1]), n) # Home +1, away -1
+    order = np.lexsort((np.arange(2 * n), team))
+    team, ordinal, venue = team[order], ordinal[order], venue[order]
+    first = np.ones(2 * n, dtype=bool)
+    first[1:] = team[1:] != team[:-1]
+    previous = np.concatenate([[0], ordinal[:-1]])
+    rest = np.where(first, 0, ordinal - previous)
+    # Games of the team in [ordinal - WINDOW, ordinal - 1], the keys are sorted per team and ordinal.
+    key = team * (int(ordinal.max()) + WINDOW + 1) + ordinal
+    last_week = np.searchsorted(key, key, side="left") - np.searchsorted(key, key - WINDOW, side="left")
+    # Runs of the same venue, restarted at every new team.
+    start = first.copy()
+    start[1:] |= venue[1:] != venue[:-1]
+    run_start = np.maximum.accumulate(np.where(start, np.arange(2 * n), 0))
+    run = venue * (np.arange(2 * n) - run_start + 1)
+    per_team = np.zeros((2 * n, 4))
+    per_team[order] = np.stack([rest, (rest == 1) & ~first, last_week, run], axis=1)
+    played = np.zeros(2 * n, dtype=bool)
+    played[order] = ~first
+    per_team, played = per_team.reshape(n, 2, 4), played.reshape(n, 2)
+    values[..., :4] = per_team
+    present[..., 0] = played
+    both = played.all(axis=1)
+    values[:, HOME, 4] = np.where(both, per_team[:, HOME, 0] - per_team[:, AWAY, 0], 0.0)
+    values[:, AWAY, 4] = np.where(both, per_team[:, AWAY, 0] - per_team[:, HOME, 0], 0.0)
+    present[..., 4] = both[:, None]
+    values[~present] = 0.0
+    return values, present
+
+class ScheduleState:
+    """The dates and venue runs of every store team, the same features as schedule_features, one game at a time."""
+    def __init__(self) -> None:
+        self.dates:List[List[int]] = []   # Ordinals of every team's games, sorted
+        self.runs:List[int] = []          # Signed venue run of every team's last game
+    def _grow(self, n_teams:int)->None:
+        while len(self.dates) < n_teams:
+            self.dates.append([])
+            self.runs.append(0)
+    def features(self, ordinal:int, teams:Tuple[int,int])->Tuple[Dict[str,Optional[float]],Dict[str,Optional[float]]]:
+        """The features of the (home, away) teams before a game on the date."""
+        self._grow(max(teams) + 1)
+        rests = []
+        out = []
+        for side, team in enumerate(teams):
+            dates = self.dates[team]
+            rest = ordinal - dates[-1] if dates else None
+            last_week = bisect.bisect_left(dates, ordinal) - bisect.bisect_left(dates, ordinal - WINDOW)
+            venue = 1 if side == HOME else -1
+            run = self.runs[team] + venue if self.runs[team] * venue > 0 else venue
+            rests.append(rest)
+            out.append({"Rest Days":None if rest is None else float(rest), "Back To Back":float(rest == 1),
+                        "Games Last 7":float(last_week), "Venue Run":float(run)})
+        both = rests[HOME] is not None and rests[AWAY] is not None
+        out[HOME]["Rest Differential"] = float(rests[HOME] - rests[AWAY]) if both else None
+        out[AWAY]["Rest Differential"] = float(rests[AWAY] - rests[HOME]) if both else None
+        return out[HOME], out[AWAY]
+    def add(self, store:GameStore, row:int)->None:
+        """Add the game in the row of the store."""
+        ordinal = int(store._ordinals[row])
+        teams = store._teams[row]
+        self._grow(int(teams.max()) + 1)
+        for side, team in enumerate(teams.tolist()):
+            venue = 1 if side == HOME else -1
+            self.runs[team] = self.runs[team] + venue if self.runs[team] * venue > 0 else venue
+            bisect.insort(self.dates[team], ordinal)
+    def reset(self, store:GameStore)->None:
+        """Rebuild from the games in the store, e.g. after it was truncated, the venue runs come from schedule_features."""
+        self.dates, self.runs = [], []
+        self._grow(len(store.team_ids))
+        if not store.size:
+            return
+        values, _ = schedule_features(store.ordinals, store.teams)
+        teams = store.teams.reshape(-1).astype(np.int64)
+        ordinals = np.repeat(store.ordinals, 2)
+        runs = values[..., FEATURES.index("Venue Run")].reshape(-1)
+        order = np.lexsort((np.arange(len(teams)), teams)) # Per team, in game order
+        teams, ordinals, runs = teams[order], ordinals[order], runs[order]
+        bounds = np.flatnonzero(teams[1:] != teams[:-1]) + 1
+        for start, stop in zip([0] + bounds.tolist(), bounds.tolist() + [len(teams)]):
+            team = int(teams[start])
+            self.dates[team] = ordinals[start:stop].tolist()
+            self.runs[team] = int(runs[stop - 1])
@@ -1,39 +1,96 @@
 from dataclasses import dataclass
-from typing import List, Union, Tuple, Optional, TypeVar
+from typing import List, Dict, Union, Tuple, Optional, TypeVar, Iterable
 import numpy as np
-import pandas as pd
 import os
+import io
+import bisect
+import queue
+import threading
 import sys
 import re
 import datetime as dt
-import matplotlib.pyplot as plt
-from .Representations import Record, SeasonID, TeamID,Game,Date,Stats,GameResult
+from .Representations import Record, SeasonID, TeamID,Game,GameStats,Date,DateList,Stats,StatList,GameResult
 from .Teams import Team, TeamList
-from tqdm import tqdm
+from .Storage import GameStore, GameList, HOME, AWAY, date_to_ordinal
+from .Profiling import Profiler, instrument, profiled
+from .Derived import REGISTRY, DerivedState
+from .Normalization import LeagueNormalizer
+from .Tables import SeasonTables
+from .Standings import Standings, COLUMNS as STANDINGS_COLUMNS
+from .Query import GameIndex, GameQuery, query as query_store
+from .Schedule import ScheduleState, BLOCK as SCHEDULE_BLOCK
+from .Lazy import lazy_import
+# Only imported when a plot, a DataFrame or a progress bar is made.
+pd = lazy_import("pandas")
+plt = lazy_import("matplotlib.pyplot")
+_tqdm = lazy_import("tqdm")
+def index_desc_for(average:bool, home:bool, away:bool, total:bool, windows:List[int], derived:bool, schedule:bool=False)->List[str]:
+    """The block names of a Season configuration, in the order of the blocks."""
+    index_to_stat_type = []
+    for enabled, block, prefix in ((average, "TD", ""), (home, "H", "H-"), (away, "A", "A-"), (total, "Tot", "Tot-")):
+        if enabled:
+            index_to_stat_type.append(block)
+            index_to_stat_type.extend(f"{prefix}Last{n}" for n in windows)
+    if derived:
+        index_to_stat_type.append("Derived")
+    if schedule:
+        index_to_stat_type.append(SCHEDULE_BLOCK)
+    return index_to_stat_type
+
+def _at_date(game:Game, date:Date)->Game:
+    """The game played at the date, the same game if it already is."""
+    if game.date == date:
+        return game
+    home, away = game.home_stats, game.away_stats
+    return Game(game.season, GameStats(home.team, date, home.stats, True), GameStats(away.team, date, away.stats, False))
+
 @dataclass
 class ConfusionMatrix:
     """A confusion matrix for a team list.\n
     The matrix is a square matrix of size len(team_list) x len(team_list).\n
-    The matrix is indexed by the team_list's team ids.
+    The matrix is indexed by the team_list's order, the teams are looked up through their registry index.
     The i,j entry is the number of games won by team i against team j.\n"""
     team_list:TeamList
     matrix:np.ndarray
     def __init__(self, team_list:TeamList, matrix:np.ndarray=None) -> None:
         self.team_list = team_list
-        self.team_to_index = {team.id: i for i, team in enumerate(team_list)}
-        self.index_to_team = {i: team.id for i, team in enumerate(team_list)}
+        self.registry = team_list.registry
+        indices = team_list.indices
+        # Registry index -> row of the matrix.
+        self._offsets = np.full(int(indices.max()) + 1 if len(indices) else 0, -1, dtype=np.int64)
+        self._offsets[indices] = np.arange(len(indices))
         self.matrix = matrix if matrix is not None else np.zeros((len(team_list), len(team_list)))
+    def index(self, team:Union[Team,TeamID,str])->int:
+        """The row/column of the team."""
+        index = self.registry.index(team.id if isinstance(team, Team) else team)
+        offset = self._offsets[index] if index < len(self._offsets) else -1
+        if offset < 0:
+            raise KeyError(f"{team} is not in the team list of the matrix")
+        return int(offset)
+    @property
+    def team_to_index(self)->Dict[TeamID,int]:
+        return {team.id: i for i, team in enumerate(self.team_list)}
+    @property
+    def index_to_team(self)->Dict[int,TeamID]:
+        return {i: team.id for i, team in enumerate(self.team_list)}
     def add_game(self, team_win:TeamID, team_loss:TeamID)->None:
         if isinstance(team_win, Team):
             team_win = team_win.id
         if isinstance(team_loss, Team):
             team_loss = team_loss.id
         if team_win is not None:
-            self.matrix[self.team_to_index[team_win], self.team_to_index[team_loss]] += 1 if team_win != team_loss else 0
-            
+            self.matrix[self.index(team_win), self.index(team_loss)] += 1 if team_win != team_loss else 0
+    def remove_game(self, team_win:TeamID, team_loss:TeamID)->None:
+        """Undo add_game, used when games are replayed."""
+        if isinstance(team_win, Team):
+            team_win = team_win.id
+        if isinstance(team_loss, Team):
+            team_loss = team_loss.id
+        if team_win is not None and team_win != team_loss:
+            self.matrix[self.index(team_win), self.index(team_loss)] -= 1
     def get_entry(self, team1:TeamID, team2:TeamID,percentage:bool=False)->Union[Tuple[int,int],Tuple[float,float]]:
-        won = self.matrix[self.team_to_index[team1], self.team_to_index[team2]]
-        lost = self.matrix[self.team_to_index[team2], self.team_to_index[team1]]
+        won = self.matrix[self.index(team1), self.index(team2)]
+        lost = self.matrix[self.index(team2), self.index(team1)]
         if percentage:
             p = won/(won+lost)
             return p, 1.0-p
@@ -51,7 +108,7 @@ class ConfusionMatrix:
         return f"ConfusionMatrix({self.team_list.team_names})"
     def __str__(self):
         return f"ConfusionMatrix({self.team_list.team_names})"
-    def plot(self, ax:plt.Axes=None, title:str="Confusion Matrix", cmap:str="Blues", show:bool=True)->plt.Axes:
+    def plot(self, ax:"plt.Axes"=None, title:str="Confusion Matrix", cmap:str="Blues", show:bool=True)->"plt.Axes":
         if ax is None:
             fig, ax = plt.subplots(figsize=(10,10))
         ax.set_title(title)
@@ -82,7 +139,6 @@ class ConfusionMatrix:
 class Season:
     season_id:SeasonID
     team_list:TeamList
-    games:List[Tuple[Date, List[Stats],Record, List[Stats],Record, GameResult]]
     def __init__(self, 
                 team_list:TeamList,
                 season_id:SeasonID=None,
@@ -91,29 +147,159 @@ class Season:
                 away:bool=False,
                 total:bool=False,
                 last_n:int=None,
+                derived:Union[bool,List[str]]=None,
+                normalize:str=None,
+                schedule:bool=False,
                 ) -> None:
+        """
+        derived:   names of derived features (see Derived.REGISTRY) computed before every game into a "Derived" block,
+                   True for the whole catalogue.
+        normalize: "z" or "rank", also keep the features normalised against the league as of each date (Season.normalizer).
+        schedule:  add a "Schedule" block with the rest, back to back, busy week and venue run features (see Schedule.py).
+        """
         # self.season_id:SeasonID = season_id if season_id is not None else 
         if season_id is not None:
             assert season_id == team_list.season_id, f"SeasonID and TeamList's SeasonID must be the same, but got as argument - SeasonID: {season_id}, TeamList's SeasonID: {team_list.season_id}."
         self.season_id = team_list.season_id
         self.team_list:TeamList = team_list
         self.confusion_matrix = ConfusionMatrix(team_list)
-        # The games list should contain the date, stats leading up to the game for both teams, and the result of the game.
-        self.games = [] 
         self.average:bool = average
         self.home:bool = home
         self.away:bool = away
         self.total:bool = total
         self.last_n:int = last_n
+        self.derived:List[str] = (REGISTRY.names if derived is True else list(derived)) if derived else []
+        self.schedule:bool = schedule
+        # The games contain the date, stats leading up to the game for both teams, and the result of the game.
+        # They are stored columnar in the GameStore, Season.games gives the tuple view of them.
+        self.store = GameStore(self.index_desc, registry=self.team_list.registry)
+        self._derived = DerivedState(REGISTRY.compile(self.derived), self.store, [team.id for team in team_list]) if self.derived else None
+        self._schedule = ScheduleState() if schedule else None
+        self.normalizer = LeagueNormalizer(len(self.store.blocks), normalize) if normalize else None
+        self._raw_games:List[Game] = [] # The added games in the same order as the store, used to replay from a date.
         self._init = True
-        self._played_dates = None
+        self._played_dates:List[Date] = [] # Kept sorted as games are added.
+        # Every change bumps the version, rewinds are logged as (version, first changed row) so that
+        # dependents (e.g. SeasonExporter.update) only redo the rows from that point.
+        self.version = 0
+        self._rewinds:List[Tuple[int,int]] = []
+        # Receives the timings of the hot paths while this season is built, only when HOCKEYPRED_PROFILE is set.
+        self.profiler = Profiler(str(self.season_id))
+        self._tables:SeasonTables = None
+        self._standings:Standings = None
+        self.index = GameIndex() # Rows of every team, see Season.query
+    @profiled
+    @instrument("Season.add_game")
     def add_game(self, game:Game,date:Date=None)->GameResult:
+        """Add a game. Games before the last added date are inserted and the games after it are replayed."""
+        date = game.date if date is None else date
+        game = _at_date(game, date) # The season keeps the game at the date it was added at, replays use it.
+        if self.store.size and date_to_ordinal(date) < self.store._ordinals[self.store.size-1]:
+            self._replay_from(date, [game])
+            return game.result
+        return self._add_game(game, date)
+    @profiled
+    @instrument("Season.add_games")
+    def add_games(self, games:Iterable[Game])->List[GameResult]:
+        """Add the games of e.g. a new game day. Only the games on or after the earliest date are (re)computed."""
+        games = sorted(games, key=lambda game: game.date)
+        if not games:
+            return []
+        if self.store.size and date_to_ordinal(games[0].date) < self.store._ordinals[self.store.size-1]:
+            self._replay_from(games[0].date, games)
+        else:
+            for game in games:
+                self._add_game(game, game.date)
+        return [game.result for game in games]
+    def replace_game(self, game:Game)->GameResult:
+        """Correct an already added game, matched by date and teams. The games from its date are replayed."""
+        row = self._find_game(game)
+        if row is None:
+            raise ValueError(f"No game {game} on {game.date} in the season")
+        start = self.store.first_row(game.date)
+        replay = self._rewind(start)
+        replay[row - start] = game
+        self._replay(replay)
+        return game.result
+    def _find_game(self, game:Game)->Optional[int]:
+        self.sort_games()
+        rows = self.store.date_range(game.date, game.date)
+        for row in range(rows.start, rows.stop):
+            if self._raw_games[row].teams == game.teams:
+                return row
+        return None
+    def _rewind(self, row:int)->List[Game]:
+        """Remove the games from row and on from the teams, the confusion matrix and the store. Returns the removed games."""
+        assert len(self._raw_games) == self.store.size, "Only seasons built with add_game can be replayed"
+        removed = self._raw_games[row:]
+        if not removed:
+            return []
+        date = removed[0].date
+        for game in removed:
+            self.confusion_matrix.remove_game(game.result.winner, game.result.loser)
+        for team in self.team_list:
+            team.truncate(date)
+        self.store.truncate(row)
+        self.index.truncate(row)
+        if self._derived is not None:
+            self._derived.reset(self.store)
+        if self._schedule is not None:
+            self._schedule.reset(self.store)
+        if self.normalizer is not None:
+            self.normalizer.truncate(row)
+        del self._raw_games[row:]
+        del self._played_dates[bisect.bisect_left(self._played_dates, date):]
+        self.version += 1
+        self._rewinds.append((self.version, row))
+        return removed
+    def _replay(self, games:List[Game])->None:
+        for game in sorted(games, key=lambda game: game.date): # Stable, so same day games keep their order.
+            self._add_game(game, game.date)
+    def _replay_from(self, date:Date, games:List[Game])->None:
+        self._replay(self._rewind(self.store.first_row(date)) + list(games))
+    def query(self, team:Union[Team,TeamID,str]=None,
+              opponent:Union[Team,TeamID,str,Iterable[Union[Team,TeamID,str]]]=None,
+              start:Date=None, end:Date=None, venue:str=None)->GameQuery:
+        """
+        The games matching every given filter, from the per team index (see Query.py).\n
+        team:     the team whose games are wanted, the result is from its point of view (GameQuery.features() etc.).
+        opponent: a team or several teams, e.g. the division rivals.
+        start/end: inclusive date range. venue: "home" or "away", where the team played.
+        """
+        if self.index.size != self.store.size or not self.store.sorted:
+            self.index.rebuild(self.store)
+        def find(team)->int:
+            index = self.store.find_team(team.id if isinstance(team, Team) else team)
+            return -1 if index is None else index # -1 matches no row
+        opponents = None
+        if opponent is not None:
+            opponent = [opponent] if isinstance(opponent, (Team, TeamID, str)) else list(opponent)
+            opponents = [find(team) for team in opponent]
+        return query_store(self.index, self.store, None if team is None else find(team), opponents, start, end, venue)
+    def snapshot(self, path:str)->None:
+        """Save the whole season to a binary file, see Snapshot.py."""
+        from .Snapshot import save_snapshot
+        save_snapshot(self, path)
+    @classmethod
+    def restore(cls, path:str)->"Season":
+        """Load a season saved with snapshot, adding games continues where the saved season left off."""
+        from .Snapshot import load_snapshot
+        return load_snapshot(path)
+    def changed_since(self, version:int, size:int)->int:
+        """The first row that differs from what a dependent saw at (version, number of games)."""
+        row = min(size, self.store.size)
+        for rewind_version, rewind_row in self._rewinds:
+            if rewind_version > version:
+                row = min(row, rewind_row)
+        return row
+    def _add_game(self, game:Game,date:Date)->GameResult:
         # Retrieve the stats of the teams at the date of the game.
         # Get the result of the game.
         # Add the game to the games list.
         # Add the game to the confusion matrix.
         # Add the game to the team's records.
         date = game.date if date is None else date
+        game = _at_date(game, date)
         home_team_id, away_team_id = game.teams
         # stats_home = []
         # stats_away = []
@@ -125,51 +311,78 @@ class Season:
         record_away = away_team.record.record_by_date(away_prev_date)
         # This is quite ugly, but it works.
         stats_home,stats_away = self._get_stats(home_team, away_team, date)
+        if self._derived is not None:
+            derived_home, derived_away = self._derived.features(date_to_ordinal(date), (self.store.team_index(home_team_id), self.store.team_index(away_team_id)))
+            stats_home.append(Stats(derived_home, date, True))
+            stats_away.append(Stats(derived_away, date, False))
+        if self._schedule is not None:
+            schedule_home, schedule_away = self._schedule.features(date_to_ordinal(date), (self.store.team_index(home_team_id), self.store.team_index(away_team_id)))
+            stats_home.append(Stats(schedule_home, date, True))
+            stats_away.append(Stats(schedule_away, date, False))
         result = game.result
         # print(f"Adding game: {game} - score {result.one_hot} to {self.season_id}.")
-        self.games.append((date, stats_home,record_home, stats_away, record_away, result))
+        if self.index.size != self.store.size: # The store was filled without add_game (restore, extend)
+            self.index.rebuild(self.store)
+        row = self.store.append(date, stats_home, record_home, stats_away, record_away, game)
+        self.index.add(row, self.store._teams[row])
+        if self._derived is not None:
+            self._derived.add(self.store, row)
+        if self._schedule is not None:
+            self._schedule.add(self.store, row)
+        if self.normalizer is not None:
+            self.normalizer.add_row(self.store, row)
+        self._raw_games.append(game)
+        index = bisect.bisect_left(self._played_dates, date)
+        if index == len(self._played_dates) or self._played_dates[index] != date:
+            self._played_dates.insert(index, date)
+        self.version += 1
         self.confusion_matrix.add_game(result.winner, result.loser)
         # Add the game to the team's records.
         self.team_list[home_team_id].add_game(game)
         self.team_list[away_team_id].add_game(game)
         return result
+    @instrument("Season._get_stats")
     def _get_stats(self, home_team:Team, away_team:Team, date:Date)->Tuple[List[Stats],List[Stats]]:
         # Get the stats of the teams at the date of the game.
         stats_home = []
         stats_away = []
-        if self.last_n:
-            # Get all the dates of the last n games
-            dates_home = home_team.played_dates.get_n_closest_dates(date, self.last_n)
-            dates_home_home = home_team.played_dates_home.get_n_closest_dates(date, self.last_n)
-            dates_home_away = home_team.played_dates_home.get_n_closest_dates(date, self.last_n)
+        windows = self.windows
+        if windows:
+            # Get all the dates of the last n games, the dates of a smaller window are the first ones of the largest.
+            n = max(windows)
+            dates_home = home_team.played_dates.get_n_closest_dates(date, n)
+            dates_home_home = home_team.played_dates_home.get_n_closest_dates(date, n)
+            dates_home_away = home_team.played_dates_away.get_n_closest_dates(date, n)
             # The same for the away team
-            dates_away_home = away_team.played_dates_away.get_n_closest_dates(date, self.last_n)
-            dates_away_away = away_team.played_dates_away.get_n_closest_dates(date, self.last_n)
-            dates_away = away_team.played_dates.get_n_closest_dates(date, self.last_n) 
+            dates_away_home = away_team.played_dates_home.get_n_closest_dates(date, n)
+            dates_away_away = away_team.played_dates_away.get_n_closest_dates(date, n)
+            dates_away = away_team.played_dates.get_n_closest_dates(date, n)
+        def last(team:Team, dates:DateList, n:int)->StatList:
+            return team.team_stats.dates_to_statlist(DateList(dates[:n]))
         if self.average:
             stats_home.append(home_team.average_to_date(date))
             stats_away.append(away_team.average_to_date(date))
-            if self.last_n:
-                stats_home.append(home_team.team_stats.dates_to_statlist(dates_home).average())
-                stats_away.append(away_team.team_stats.dates_to_statlist(dates_away).average())
+            for n in windows:
+                stats_home.append(last(home_team, dates_home, n).average())
+                stats_away.append(last(away_team, dates_away, n).average())
         if self.home:
             stats_home.append(home_team.home_average_to_date(date)) 
             stats_away.append(away_team.home_average_to_date(date))
-            if self.last_n: # Find the last n games played at home
-                stats_home.append(home_team.team_stats.dates_to_statlist(dates_home_home).average())
-                stats_away.append(away_team.team_stats.dates_to_statlist(dates_away_home).average())
+            for n in windows: # Find the last n games played at home
+                stats_home.append(last(home_team, dates_home_home, n).average())
+                stats_away.append(last(away_team, dates_away_home, n).average())
         if self.away:
-            stats_home.append(home_team.home_average_to_date(date))
+            stats_home.append(home_team.away_average_to_date(date))
             stats_away.append(away_team.away_average_to_date(date))
-            if self.last_n: # Find the last n games played away
-                stats_home.append(home_team.team_stats.dates_to_statlist(dates_home_away).average())
-                stats_away.append(away_team.team_stats.dates_to_statlist(dates_away_away).average())
+            for n in windows: # Find the last n games played away
+                stats_home.append(last(home_team, dates_home_away, n).average())
+                stats_away.append(last(away_team, dates_away_away, n).average())
         if self.total:
             stats_home.append(home_team.total_to_date(date))
             stats_away.append(away_team.total_to_date(date))
-            if self.last_n:
-                stats_home.append(home_team.team_stats.dates_to_statlist(dates_home).total())
-                stats_away.append(away_team.team_stats.dates_to_statlist(dates_away).total())
+            for n in windows:
+                stats_home.append(last(home_team, dates_home, n).total())
+                stats_away.append(last(away_team, dates_away, n).total())
         return stats_home, stats_away
     def print_games(self,n:int=None)->None:
         # Print the games in the season.
@@ -205,147 +418,176 @@ class Season:
         return date, stats_home, record_home, stats_away, record_away, result
     @property
     def index_desc(self)->list[str]:
-        index_to_stat_type = []
-        if self.average:
-            index_to_stat_type.append("TD")
-        if self.last_n:
-            index_to_stat_type.append(f"Last{self.last_n}")
-        if self.home:
-            index_to_stat_type.append("H")
-            if self.last_n:
-                index_to_stat_type.append(f"H-Last{self.last_n}")
-        if self.away:
-            index_to_stat_type.append("A")
-            if self.last_n:
-                index_to_stat_type.append(f"A-Last{self.last_n}")
-        if self.total:
-            index_to_stat_type.append("Tot")
-            if self.last_n:
-                index_to_stat_type.append(f"Tot-Last{self.last_n}")
-        return index_to_stat_type
+        return index_desc_for(self.average, self.home, self.away, self.total, self.windows, bool(self.derived), self.schedule)
+    @property
+    def windows(self)->List[int]:
+        """The last n windows, one block per window after each of TD, H, A and Tot."""
+        return [self.last_n] if self.last_n else []
 
-    def sort_games(self)->None:
-        # Sort the games in the season.
-        self.games.sort(key=lambda x: x[0]) # Sort by date
+    @property
+    def games(self)->GameList:
+        """Lazy view of the games as (date, [Stats...], record, [Stats...], record, result) tuples."""
+        return GameList(self.store)
+    def games_between(self, start:Date=None, end:Date=None)->GameList:
+        """The games from start up to and including end, the array properties of the view are zero-copy."""
+        self.sort_games()
+        return GameList(self.store, self.store.date_range(start, end))
+    def sort_games(self)->GameList:
+        # Sort the games in the season by date, only reorders if a game was added out of order.
+        self.store.sort()
         return self.games
-    def stats_to_pandas(self,stat:str)->pd.DataFrame:
-        """Store the stat for each team at each date in a pandas dataframe.
-        Structre of the dataframe:
+    @property
+    def tables(self)->SeasonTables:
+        """Cumulative per date tables of the season, cached until the season changes."""
+        if self._tables is None:
+            self._tables = SeasonTables(self)
+        return self._tables
+    @property
+    def standings(self)->Standings:
+        """Points, standings columns and ranks as of every played date (2-1-0 points), cached until the season changes."""
+        if self._standings is None:
+            self._standings = Standings(self)
+        return self._standings
+    def stats_to_pandas(self,stat:Union[str,List[str]],per_game:bool=False,split:str="total",layout:str="wide")->"pd.DataFrame":
+        """Store the stats for each team at each date in a pandas dataframe.
+        Structre of the dataframe for a single stat (see SeasonTables.frame for several stats and the tidy layout):
 
         Header: | Date | Team | Team | Team | ... |
         Row:    | Date | Stat | Stat | Stat | ... |
+
+        Stats are any game stat or Games, Wins, Losses, Ties, Win% and Streak, as of each played date.
         """
-        self.sort_games()
-        # Create the header.
-        header = ["Date"]
-        for team in self.team_list:
-            header.append(team.name)
-        # Create the rows.
-        rows = []
-        for date in self.played_dates:
-            row = [str(date)]
-            for team in self.team_list:
-                if stat.lower() not in ["win%","win percentage"]:
-                    row.append(team.get_stat_to_date(date,stat))
-                else:
-                    row.append(team.record.win_percentage)
-                # row.append(team.get_stat_per_game(date,stat))
-            rows.append(row)
-        # Create the dataframe.
-        df = pd.DataFrame(rows,columns=header)
-        return df
+        return self.tables.frame(stat, split=split, per_game=per_game, layout=layout)
+    def stat_frames(self, stat:str, per_game:bool=True)->Tuple[np.ndarray,np.ndarray]:
+        """
+        The stat of every team up to and including every played date.\n
+        Returns the date ordinals (dates,) and the values (dates, teams) with the teams in the order of team_list.
+        per_game gives the stat per game played instead of the total, "Win%" is always the share of games won.
+        The standings columns (Points, Points%, Rank, ...) are taken from Season.standings unless a game stat has the name.
+        """
+        if stat in STANDINGS_COLUMNS and stat not in self.store._key_index:
+            return self.standings.ordinals, self.standings.values(stat, per_game=per_game)
+        values = self.tables.values(stat, per_game=per_game)
+        return self.tables.ordinals, values
     def last_date(self)->Date:
         # Find the maximum date in the season.
-        return max(self.games,key=lambda x: x[0])[0]
+        return self.store.date(self.store.ordinals.max())
     def first_date(self)->Date:
         # Find the minimum date in the season.
-        return min(self.games,key=lambda x: x[0])[0]
+        return self.store.date(self.store.ordinals.min())
     @property
     def played_dates(self)->list[Date]:
-        if not self._played_dates:
-            self._all_played_dates()
+        if len(self._played_dates) == 0 and self.store.size:
+            self._all_played_dates() # Stores filled in bulk, e.g. from the schedule table.
         return self._played_dates
+    def team_positions(self)->np.ndarray:
+        """(games, side) position in the team list of the teams of every game of the store."""
+        return self.store.positions(team.id for team in self.team_list)
     @property
     def number_of_teams(self)->int:
         return len(self.team_list)
     def _all_played_dates(self)->list[Date]:
         # Find all the dates in the season.
-        self._played_dates = []
-        for game in self.games:
-            date, stats_home, record_home, stats_away, record_away, result = game
-            if date not in self._played_dates:
-                self._played_dates.append(date)
-        self._played_dates.sort()
+        self._played_dates = [self.store.date(ordinal) for ordinal in np.unique(self.store.ordinals)]
         return self._played_dates
 
 
 
-from matplotlib.animation import FuncAnimation
 class SeasonVisualizer:
     """
     Class to help visualize a season.
     The visualizable for any given Date will be:    
         - The confusion matrix.
-        - The team records, sorted by win percentage.
+        - The standings as of the date, points and tiebreakers (Season.standings).
         - The team stats, sorted by the given stat.
         - Animation of the confusion matrix through time.
         - Animation of the team rankings through time.
         - Animation of the team stats through time.
     Animations are handled by matplotlib.animation.FuncAnimation.
+    All the frames of an animation are computed up front with Season.stat_frames, the bars are created once
+    and only moved/resized per frame (blitted when shown). Saving renders in a background process.
     """
     def __init__(self,season:Season):
         self._season = season
         self._season.sort_games()
         self._last_date = season.last_date()
         self._first_date = season.first_date()
-    def _nice_axes(self,ax:plt.Axes):
+    @staticmethod
+    def _nice_axes(ax:"plt.Axes"):
         ax.set_facecolor('.8')
         ax.tick_params(labelsize=8, length=0)
         ax.grid(True, axis='x', color='white')
         ax.set_axisbelow(True)
         [spine.set_visible(False) for spine in ax.spines.values()]
         return ax
-    def animate(self,stat:str='Win%',save:bool=False,figsize:tuple=(10,10),interval:int=100):
+    def frames(self, stat:str='Win%')->Tuple[List[str],np.ndarray]:
+        """The date labels and the (dates, teams) values of the stat per game, the same values as TeamList.team_stat_list."""
+        ordinals, values = self._season.stat_frames(stat, per_game=True)
+        return [str(self._season.store.date(ordinal)) for ordinal in ordinals], values
+    def standings(self, date:Date=None)->"pd.DataFrame":
+        """The standings table as of the date, by default the last played date."""
+        return self._season.standings.table(date)
+    def animate(self,stat:str='Win%',save:bool=False,figsize:tuple=(10,10),interval:int=100,filename:str=None,background:bool=True):
         """
-        Animate the season based on the given stat.
+        Animate the season based on the given stat.\n
+        Without save the FuncAnimation is returned (keep a reference to it while it is shown).
+        With save it is written to filename (.gif or .mp4, by default Season_{stat}.gif), in a background process
+        which is returned unless background is False, then the path is returned.
+        The process is spawned, so scripts calling this need the usual `if __name__ == "__main__":` guard.
         """
-        import bar_chart_race as bcr
-        self._season.sort_games()
-        played_dates = self._season.played_dates
-        df = self._season.stats_to_pandas(stat)
-        # print(f"df: {df}")
-        # html = bcr.bar_chart_race(df=df,filename="test.gif",figsize=figsize,period_length=len(played_dates))
-        # print(f"Played dates: {played_dates}")
-        # exit()
-        fig = plt.figure(figsize=figsize)
-        ax = fig.add_subplot()
-        colors = plt.cm.Dark2(range(self._season.number_of_teams))
-        def init():
-            print(f"Initalizing animation for stat: {stat}")
-            ax.clear()
-            self._nice_axes(ax)
-            # Set the y axis to be the team names.
-            ax.set_yticks(range(self._season.number_of_teams))
-            ax.set_yticklabels(self._season.team_list.team_names)
-        def update(i):
-            for bar in ax.containers:
-                bar.remove()
-            name_value_list = self._season.team_list.team_stat_list(stat,date=self._season.played_dates[i])
-            name_value_list.sort(key=lambda x: x[1],reverse=False)
-            print(f"Name value list: {name_value_list}")
-            names = [name for name,value in name_value_list]
-            values = [value for name,value in name_value_list]
-            # The x axis will be the stat value.
-            # The y axis will be the team names, should be sorted by the stat value.
-            ax.barh(range(self._season.number_of_teams),values,color=colors)
-            ax.set_title(f"Season {stat} on {self._season.played_dates[i]}")
-        # anim = FuncAnimation(fig=fig, func=update, init_func=init, frames=len(self._season.played_dates), interval=200, repeat=False,blit=False)
-        # # View the animation.
-        # if save:
-        #     anim.save(f"Season_{stat}.gif", writer='imagemagick')
-        # plt.show()
-    
-        # return anim
+        labels, values = self.frames(stat)
+        names = list(self._season.team_list.team_names)
+        if not save:
+            return _build_animation(names, labels, values, stat, figsize, interval, blit=True)[1]
+        filename = filename if filename is not None else f"Season_{stat.replace('%','')}.gif"
+        if not background:
+            _render_animation(names, labels, values, stat, figsize, interval, filename)
+            return filename
+        import multiprocessing
+        # Spawned so the child starts without the parent's figures/GUI state.
+        process = multiprocessing.get_context("spawn").Process(target=_render_animation, args=(names, labels, values, stat, figsize, interval, filename), daemon=False)
+        process.start()
+        return process
+
+def _build_animation(names:List[str], labels:List[str], values:np.ndarray, stat:str, figsize:tuple, interval:int, blit:bool):
+    from matplotlib.animation import FuncAnimation
+    n_frames, n_teams = values.shape
+    fig = plt.figure(figsize=figsize)
+    ax = SeasonVisualizer._nice_axes(fig.add_subplot())
+    # Fixed limits, the axes never have to be redrawn so only the artists below are blitted.
+    high = float(np.nanmax(values)) if values.size else 1.0
+    ax.set_xlim(0, high * 1.15 if high > 0 else 1.0)
+    ax.set_ylim(-0.6, n_teams - 0.4)
+    ax.set_yticks([])
+    colors = plt.cm.Dark2(np.arange(n_teams) % 8)
+    bars = ax.barh(np.arange(n_teams), np.zeros(n_teams), height=0.8, color=colors).patches
+    texts = [ax.text(0, i, name, va="center", ha="left", fontsize=8) for i, name in enumerate(names)]
+    title = ax.text(0.5, 1.01, "", transform=ax.transAxes, ha="center", va="bottom", fontsize=12)
+    # Rank of every team per frame, the highest value on top.
+    ranks = np.empty_like(values, dtype=int)
+    order = np.argsort(values, axis=1, kind="stable")
+    np.put_along_axis(ranks, order, np.arange(n_teams)[None, :].repeat(n_frames, axis=0), axis=1)
+    artists = bars + texts + [title]
+    def init():
+        return artists
+    def update(i):
+        for bar, text, value, rank in zip(bars, texts, values[i].tolist(), ranks[i].tolist()):
+            bar.set_width(value)
+            bar.set_y(rank - 0.4)
+            text.set_position((value, rank))
+        title.set_text(f"Season {stat} on {labels[i]}")
+        return artists
+    anim = FuncAnimation(fig=fig, func=update, init_func=init, frames=n_frames, interval=interval, repeat=False, blit=blit)
+    return fig, anim
+
+def _render_animation(names:List[str], labels:List[str], values:np.ndarray, stat:str, figsize:tuple, interval:int, filename:str)->None:
+    # Runs in the background process, only needs the precomputed frames.
+    import matplotlib
+    matplotlib.use("Agg")
+    fig, anim = _build_animation(names, labels, values, stat, figsize, interval, blit=False)
+    writer = "ffmpeg" if filename.lower().endswith(".mp4") else "pillow"
+    anim.save(filename, writer=writer, fps=max(1, round(1000 / interval)))
+    plt.close(fig)
 
 
 class SeasonExporter:
@@ -368,14 +610,26 @@ class SeasonExporter:
                 export_dir:str=None,
                 export_file:str=None,
                 export_format:str="csv",
+                chunk_size:int=512,
+                max_pending_chunks:int=4,
+                progress:bool=True,
+                normalized:bool=False,
                 ):
+        assert not normalized or season.normalizer is not None, "The season must be built with normalize='z' or 'rank' to export normalised features"
         self.season = season
         self.export_dir = export_dir
         self.export_file = export_file
         self.export_format = export_format.split(".")[-1]
         self.export_path = None
+        self.chunk_size = chunk_size # Number of games formatted before handed to the writer thread.
+        self.max_pending_chunks = max_pending_chunks # Bounds the memory used by chunks waiting to be written.
+        self.progress = progress
+        self.normalized = normalized # Write the features normalised against the league instead of the raw values.
         self._build_export_path()
         self._game_id = 0
+        self._prefixes = {} # (block name, stat keys) -> list of "block_key," row prefixes
+        self._offsets:List[int] = [] # Byte offset of every exported game
+        self._version:int = None # Season.version at the last export
     def _build_export_path(self)->None:
         # Build the export path.
         if not self.export_dir:
@@ -385,57 +639,163 @@ class SeasonExporter:
         if not self.export_file:
             self.export_file = f"{self.season.season_id}.{self.export_format}"
         self.export_path = os.path.join(self.export_dir, self.export_file)
-    def export(self)->None:
+    def export(self, games:Iterable[Tuple[Date, List[Stats],Record, List[Stats],Record, GameResult]]=None)->None:
+        """
+        Export the games of the season, games can be any iterable (e.g. a generator) of season game tuples.\n
+        The games are written with the same text as the pandas writer (ints as "3", floats as "3.0", missing as "").
+        Without games the rows are read from the GameStore, which keeps which stats were ints.
+        """
         if self.export_format == "csv":
-            self._export_csv()
+            self._export_csv(games)
         else:
             raise NotImplementedError(f"Export format {self.export_format} not implemented yet.")
-    def _export_csv(self)->None:
+    def _row_prefixes(self, block:str, keys:Tuple[str,...])->List[str]:
+        # The row prefixes are the same for every game, so they are only built once per block.
+        prefixes = self._prefixes.get((block, keys))
+        if prefixes is None:
+            prefixes = [f"{block}_{key}," for key in keys]
+            self._prefixes[(block, keys)] = prefixes
+        return prefixes
+    def _write_stats(self, buffer:io.StringIO, stats:List[Stats], index_to_stat_type:List[str])->None:
+        for i,stat in enumerate(stats):
+            keys = tuple(stat.stats.keys())
+            prefixes = self._row_prefixes(index_to_stat_type[i], keys)
+            buffer.write("".join([prefix + value + "\n" for prefix, value in zip(prefixes, _format_values(list(stat.stats.values())))]))
+            # New line after each stat.
+            buffer.write("\n")
+    def _write_game(self, buffer:io.StringIO, game:Tuple, index_to_stat_type:List[str])->None:
+        date, stats_home, record_home, stats_away, record_away, result = game # Extract the game data.
+        home_team_id = result.home_team
+        away_team_id = result.away_team
+        buffer.write(f"Game_{self._game_id},{home_team_id.name},{away_team_id.name},{date}\n")
+        self._game_id += 1
+        buffer.write(f"TeamIDHome,{home_team_id.id},{home_team_id.name},\n")
+        self._write_stats(buffer, stats_home, index_to_stat_type)
+        buffer.write(f"TeamIDAway,{away_team_id.id},{away_team_id.name},\n")
+        self._write_stats(buffer, stats_away, index_to_stat_type)
+        # Last row is the result.
+        buffer.write(f"Result,{result.home_win},{result.away_win},{result.tie}\n\n")
+    def _write_store_game(self, buffer:io.StringIO, row:int, index_to_stat_type:List[str])->None:
+        # Same text as _write_game but read straight from the season's arrays, no Stats objects are built.
+        # A block with stats writes every key of the store, the missing ones empty, a block without stats writes nothing.
+        store = self.season.store
+        features = self.season.normalizer.normalized if self.normalized else store._features
+        prefixes = [self._row_prefixes(block, tuple(store.keys)) for block in index_to_stat_type]
+        home, away = store._teams[row]
+        home_team_id, away_team_id = store.team_ids[home], store.team_ids[away]
+        buffer.write(f"Game_{self._game_id},{home_team_id.name},{away_team_id.name},{store.date(store._ordinals[row])}\n")
+        self._game_id += 1
+        for side, label, team_id in ((HOME, "TeamIDHome", home_team_id), (AWAY, "TeamIDAway", away_team_id)):
+            buffer.write(f"{label},{team_id.id},{team_id.name},\n")
+            for block in range(len(index_to_stat_type)):
+                present = store._present[row, side, block].tolist()
+                if any(present):
+                    integral = [False] * len(present) if self.normalized else store._integral[row, side, block].tolist()
+                    values = [(int(value) if whole else value) if ok else None for value, ok, whole in zip(features[row, side, block].tolist(), present, integral)]
+                    buffer.write("".join([prefix + value + "\n" for prefix, value in zip(prefixes[block], _format_values(values))]))
+                buffer.write("\n")
+        result = int(store._results[row])
+        buffer.write(f"Result,{result == 1},{result == -1},{result == 0}\n\n")
+    def update(self)->None:
+        """
+        Bring an earlier export of the season up to date.\n
+        Only the games added or changed (e.g. by Season.replace_game) since the last export are written,
+        the file is truncated at the first changed game and the rest is appended.
+        """
+        if self.export_format != "csv":
+            raise NotImplementedError(f"Export format {self.export_format} not implemented yet.")
+        if self._version is None or not os.path.exists(self.export_path):
+            return self._export_csv()
+        row = self.season.changed_since(self._version, len(self._offsets))
+        if row == len(self._offsets) == self.season.store.size:
+            self._version = self.season.version
+            return
+        self._export_csv(start_row=row)
+    def _export_csv(self, games:Iterable=None, start_row:int=0)->None:
         # Export the games to a csv file.
-        games = self.season.games
+        # Games are formatted in chunks into a reused buffer and the chunks are written by a worker thread,
+        # the bounded queue keeps the memory flat no matter how many games are streamed through.
+        # Without explicit games the rows are read directly from the season's arrays.
+        from_store = games is None
+        games = range(start_row, len(self.season.store)) if from_store else games
+        write_game = self._write_store_game if from_store else self._write_game
         index_to_stat_type = self.season.index_desc
-        with open(self.export_path, "w") as f:
+        if start_row == 0:
+            self._offsets = []
+            mode = "wb"
+        else:
+            mode = "r+b"
+        self._game_id = start_row
+        chunks = queue.Queue(maxsize=self.max_pending_chunks)
+        errors = []
+        with open(self.export_path, mode) as f:
+            if start_row < len(self._offsets):
+                # Drop everything from the first changed game and continue from there.
+                f.seek(self._offsets[start_row])
+                f.truncate()
+                del self._offsets[start_row:]
+            elif start_row:
+                f.seek(0, os.SEEK_END) # Only new games, appended after the last one
+            position = f.tell()
+            def writer():
+                while True:
+                    chunk = chunks.get()
+                    if chunk is None:
+                        break
+                    try:
+                        f.write(chunk)
+                    except Exception as e: # Keep draining so the producer never blocks.
+                        errors.append(e)
+            def flush(text:str, starts:List[int], position:int)->int:
+                # Encode once, the byte offset of every game is kept so update() can truncate at any game.
+                data = text.encode()
+                ascii_only = len(data) == len(text)
+                self._offsets.extend([position + (start if ascii_only else len(text[:start].encode())) for start in starts])
+                chunks.put(data)
+                return position + len(data)
+            thread = threading.Thread(target=writer, daemon=True)
+            thread.start()
             # Initialize Progression bar:
-            pbar = tqdm(total=len(games),desc="Exporting games!")
-            # Comment out the following line if you don't want the header.
-            f.write("Game ID,Home Team ID,Away Team ID,Date\n")
-            for game in games:
-                pbar.update(1)
-                date, stats_home, record_home, stats_away, record_away, result = game # Extract the game data.
-                home_team_id = result.home_team
-                away_team_id = result.away_team
-                f.write(f"Game_{self._game_id},{home_team_id.name},{away_team_id.name},{date}\n")
-                self._game_id += 1
-                f.write(f"TeamIDHome,{home_team_id.id},{home_team_id.name},\n")
-                for i,stat in enumerate(stats_home):
-                    stat = stat.to_pandas(index_to_stat_type[i])
-                    # Write using the pandas to_csv method.
-                    stat.to_csv(f, mode="a", header=False)
-                    # New line after each stat.
-                    f.write("\n")
-                f.write(f"TeamIDAway,{away_team_id.id},{away_team_id.name},\n")
-                for i,stat in enumerate(stats_away):
-                    stat = stat.to_pandas(index_to_stat_type[i])
-                    # Write using the pandas to_csv method.
-                    stat.to_csv(f, mode="a", header=False)
-                    # New line after each stat.
-                    f.write("\n")
-                # Last row is the result.
-                f.write(f"Result,{result.home_win},{result.away_win},{result.tie}\n\n")
-                # if self._game_id > 10:
-                #     break # Temporarily only write one game.
-                    
-                
-
-
-
-
-
-
-
-
-            
-
+            total = len(games) if hasattr(games, "__len__") else None
+            pbar = _tqdm.tqdm(total=total,desc="Exporting games!",disable=not self.progress)
+            buffer = io.StringIO()
+            starts = []
+            try:
+                if start_row == 0:
+                    # Comment out the following line if you don't want the header.
+                    buffer.write("Game ID,Home Team ID,Away Team ID,Date\n")
+                for game in games:
+                    starts.append(buffer.tell())
+                    write_game(buffer, game, index_to_stat_type)
+                    if len(starts) == self.chunk_size:
+                        position = flush(buffer.getvalue(), starts, position)
+                        buffer.seek(0)
+                        buffer.truncate(0)
+                        pbar.update(len(starts))
+                        starts = []
+                position = flush(buffer.getvalue(), starts, position)
+                pbar.update(len(starts))
+            finally:
+                chunks.put(None)
+                thread.join()
+                pbar.close()
+        if errors:
+            raise errors[0]
+        # Only exports of the season's own games can be updated later on.
+        self._version = self.season.version if from_store else None
 
+def _missing(value)->bool:
+    return value is None or (isinstance(value, (float, np.floating)) and value != value)
 
-       
\ No newline at end of file
+def _format_values(values:list)->List[str]:
+    # The same text as pandas writes for pd.Series(stats): the dtype is inferred from all the values of the stat,
+    # ints stay ints ("3"), a float or a missing value among numbers makes all of them floats ("3.0", ""),
+    # anything else is written as objects. Missing values are left empty.
+    if all(isinstance(value, (bool, np.bool_)) for value in values):
+        return [str(bool(value)) for value in values]
+    numbers = [value for value in values if not _missing(value)]
+    if numbers and all(isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, (bool, np.bool_)) for value in numbers):
+        if len(numbers) == len(values) and all(isinstance(value, (int, np.integer)) for value in numbers):
+            return [str(int(value)) for value in values]
+        return ["" if _missing(value) else repr(float(value)) for value in values]
+    return ["" if _missing(value) else str(value) for value in values]
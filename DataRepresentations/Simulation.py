@@ -0,0 +1,223 @@
+# This file contains the Monte Carlo simulation of the rest of a season.
+# Path: DataRepresentations\Simulation.py
+# From the games played so far and the remaining schedule, every remaining game is played n times at once as NumPy arrays:
+# one uniform draw per (simulation, game) is turned into a home win, tie or away win with the probabilities of a model.
+# Wins, losses and ties per team are counted with (games, teams) incidence matrices, the standings are ranked by points.
+# Only counts are kept (points histograms, finishing positions, playoff spots), so chunks of simulations can be spread over
+# a process pool and added up.
+#   model = RatingModel.fit(season)
+#   result = simulate(season, remaining, model, n=100_000, playoff_spots=8)
+#   result.to_pandas()
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Tuple, Union, Optional, Iterable, NamedTuple, Sequence
+import numpy as np
+from .Representations import TeamID, Game
+from .Teams import Team
+from .Storage import HOME, AWAY
+from .Lazy import lazy_import
+pd = lazy_import("pandas")
+
+CHUNK = 10_000 # Simulations per chunk, (CHUNK, games) draws are in memory at once.
+TeamLike = Union[Team, TeamID, str]
+
+def _played(season)->Tuple[List[str],np.ndarray,np.ndarray,np.ndarray]:
+    """The team names (team list order), (teams, 3) w-l-t so far and the played games as team list positions and results."""
+    store = season.store
+    teams = season.team_positions() # (games, side)
+    results = store.results.astype(int)
+    records = np.zeros((len(season.team_list), 3), dtype=np.int64)
+    for side, sign in ((HOME, 1), (AWAY, -1)):
+        np.add.at(records[:, 0], teams[:, side], results * sign > 0)
+        np.add.at(records[:, 1], teams[:, side], results * sign < 0)
+        np.add.at(records[:, 2], teams[:, side], results == 0)
+    return list(season.team_list.team_names), records, teams, results
+
+def _logit(p:np.ndarray)->np.ndarray:
+    p = np.clip(p, 1e-6, 1 - 1e-6)
+    return np.log(p / (1 - p))
+
+class RecordModel:
+    """
+    Probabilities from the records so far: log5 of the (smoothed) win percentages, shifted by the league's home advantage.\n
+    Ties happen at the league's tie rate. prior is the number of virtual .500 games added to every record.
+    """
+    def __init__(self, records:np.ndarray, home_advantage:float=0.0, tie_rate:float=0.0, prior:float=5.0) -> None:
+        wins, losses, ties = records.T
+        self.strength = (wins + 0.5 * ties + prior / 2) / (wins + losses + ties + prior)
+        self.home_advantage = home_advantage
+        self.tie_rate = tie_rate
+    @classmethod
+    def fit(cls, season, prior:float=5.0)->"RecordModel":
+        _, records, _, results = _played(season)
+        decided = results[results != 0]
+        home_rate = (decided > 0).mean() if len(decided) else 0.5
+        return cls(records, float(_logit(np.array(home_rate))), float((results == 0).mean()) if len(results) else 0.0, prior)
+    def probabilities(self, home:np.ndarray, away:np.ndarray)->Tuple[np.ndarray,np.ndarray]:
+        """(p home win, p tie) of the games."""
+        a, b = self.strength[home], self.strength[away]
+        log5 = (a - a * b) / np.maximum(a + b - 2 * a * b, 1e-12)
+        p = 1 / (1 + np.exp(-(_logit(log5) + self.home_advantage)))
+        return (1 - self.tie_rate) * p, np.full(len(home), self.tie_rate)
+
+class RatingModel:
+    """
+    Bradley-Terry ratings: P(home wins a decided game) = sigmoid(r_home - r_away + home_advantage), ties at the league's rate.\n
+    fit() maximises the likelihood of the decided games played so far, with an L2 penalty pulling the ratings to 0.
+    """
+    def __init__(self, ratings:np.ndarray, home_advantage:float=0.0, tie_rate:float=0.0) -> None:
+        self.ratings = np.asarray(ratings, dtype=float)
+        self.home_advantage = home_advantage
+        self.tie_rate = tie_rate
+    @classmethod
+    def fit(cls, season, l2:float=0.1, iterations:int=500, learning_rate:float=1.0)->"RatingModel":
+        names, _, teams, results = _played(season)
+        decided = results != 0
+        home, away, y = teams[decided, HOME], teams[decided, AWAY], (results[decided] > 0).astype(float)
+        ratings, advantage = np.zeros(len(names)), 0.0
+        n = max(len(y), 1)
+        for _ in range(iterations): # Gradient ascent, the log likelihood is concave
+            p = 1 / (1 + np.exp(-(ratings[home] - ratings[away] + advantage)))
+            error = y - p
+            gradient = np.bincount(home, error, len(names)) - np.bincount(away, error, len(names)) - l2 * ratings
+            ratings += learning_rate * gradient / n * len(names)
+            advantage += learning_rate * error.mean() if len(y) else 0.0
+            ratings -= ratings.mean()
+        return cls(ratings, advantage, float((results == 0).mean()) if len(results) else 0.0)
+    def probabilities(self, home:np.ndarray, away:np.ndarray)->Tuple[np.ndarray,np.ndarray]:
+        p = 1 / (1 + np.exp(-(self.ratings[home] - self.ratings[away] + self.home_advantage)))
+        return (1 - self.tie_rate) * p, np.full(len(home), self.tie_rate)
+
+class SimulationResult(NamedTuple):
+    """
+    Counts over all the simulations, teams in team list order.\n
+    wins/losses/ties/points: (teams,) means of the final records.
+    points_histogram: (teams, points) number of simulations ending with that many points.
+    positions: (teams, teams) number of simulations finishing in that place (0 is first).
+    playoffs: (teams,) share of the simulations in which the team made the playoffs.
+    """
+    team_names:List[str]
+    n:int
+    wins:np.ndarray
+    losses:np.ndarray
+    ties:np.ndarray
+    points:np.ndarray
+    points_histogram:np.ndarray
+    positions:np.ndarray
+    playoffs:np.ndarray
+    @property
+    def position_probabilities(self)->np.ndarray:
+        return self.positions / max(self.n, 1)
+    def points_quantile(self, q:Union[float,Sequence[float]])->np.ndarray:
+        """(teams,) or (quantiles, teams) points from the histograms."""
+        cumulative = np.cumsum(self.points_histogram, axis=1) / max(self.n, 1)
+        q = np.atleast_1d(q)
+        out = np.stack([np.argmax(cumulative >= value - 1e-12, axis=1) for value in q])
+        return out[0] if out.shape[0] == 1 else out
+    def to_pandas(self)->"pd.DataFrame":
+        low, median, high = self.points_quantile([0.05, 0.5, 0.95])
+        df = pd.DataFrame({"Team":self.team_names, "Wins":self.wins, "Losses":self.losses, "Ties":self.ties, "Points":self.points,
+                           "Points 5%":low, "Points 50%":median, "Points 95%":high,
+                           "Expected Position":self.position_probabilities @ np.arange(1, len(self.team_names) + 1),
+                           "Playoffs":self.playoffs})
+        return df.sort_values("Points", ascending=False, ignore_index=True)
+
+class _Setup(NamedTuple):
+    # Everything a worker needs, plain arrays.
+    records:np.ndarray   # (teams, 3) so far
+    home:np.ndarray      # (games,) team list positions of the remaining games
+    away:np.ndarray
+    p_home:np.ndarray    # (games,)
+    p_tie:np.ndarray
+    win_points:int
+    tie_points:int
+    groups:np.ndarray    # (teams,) group of every team
+    spots:np.ndarray     # (groups,) playoff spots per group
+
+def _simulate_chunk(setup:_Setup, n:int, seed)->Tuple[np.ndarray,...]:
+    rng = np.random.default_rng(seed)
+    n_teams, n_games = len(setup.records), len(setup.home)
+    home_incidence = np.zeros((n_games, n_teams), dtype=np.float32)
+    away_incidence = np.zeros((n_games, n_teams), dtype=np.float32)
+    home_incidence[np.arange(n_games), setup.home] = 1
+    away_incidence[np.arange(n_games), setup.away] = 1
+    draws = rng.random((n, n_games), dtype=np.float32)
+    home_win = draws < setup.p_home.astype(np.float32)
+    tie = ~home_win & (draws < (setup.p_home + setup.p_tie).astype(np.float32))
+    away_win = ~home_win & ~tie
+    home_win, tie, away_win = (x.astype(np.float32) for x in (home_win, tie, away_win))
+    wins = setup.records[:, 0] + (home_win @ home_incidence + away_win @ away_incidence).astype(np.int64)
+    losses = setup.records[:, 1] + (away_win @ home_incidence + home_win @ away_incidence).astype(np.int64)
+    ties = setup.records[:, 2] + (tie @ (home_incidence + away_incidence)).astype(np.int64)
+    points = setup.win_points * wins + setup.tie_points * ties # (n, teams)
+    # Standings: points, then wins, then a coin flip.
+    key = points * (n_games + int(setup.records.sum()) + 2) + wins + rng.random(points.shape)
+    order = np.argsort(-key, axis=1)
+    place = np.empty_like(order)
+    np.put_along_axis(place, order, np.arange(n_teams)[None, :], axis=1)
+    positions = np.zeros((n_teams, n_teams), dtype=np.int64)
+    np.add.at(positions, (np.broadcast_to(np.arange(n_teams), place.shape), place), 1)
+    # Playoffs: the best teams of every group by the same order.
+    playoffs = np.zeros(n_teams, dtype=np.int64)
+    for group, spots in enumerate(setup.spots.tolist()):
+        members = np.flatnonzero(setup.groups == group)
+        group_place = np.argsort(np.argsort(place[:, members], axis=1), axis=1)
+        playoffs[members] += (group_place < spots).sum(axis=0)
+    max_points = max(setup.win_points, setup.tie_points) * (int(setup.records.sum(axis=1).max()) + n_games) + 1
+    histogram = np.zeros((n_teams, max_points), dtype=np.int64)
+    np.add.at(histogram, (np.broadcast_to(np.arange(n_teams), points.shape), points), 1)
+    return wins.sum(axis=0), losses.sum(axis=0), ties.sum(axis=0), points.sum(axis=0), histogram, positions, playoffs
+
+def _run(args:Tuple[_Setup, int, np.random.SeedSequence])->Tuple[np.ndarray,...]:
+    return _simulate_chunk(*args)
+
+def remaining_games(games:Iterable[Union[Game,Tuple[TeamLike,TeamLike]]])->List[Tuple[TeamLike,TeamLike]]:
+    """(home, away) pairs of Games or pairs."""
+    return [game.teams if isinstance(game, Game) else tuple(game) for game in games]
+
+def simulate(season, remaining:Iterable[Union[Game,Tuple[TeamLike,TeamLike]]], model=None,
+             n:int=100_000, playoff_spots:Union[int,Dict[str,int]]=8, groups:Dict[str,List[TeamLike]]=None,
+             win_points:int=2, tie_points:int=1, seed:int=None, processes:int=1)->SimulationResult:
+    """
+    Simulate the remaining games of the season n times.\n
+    remaining: Games or (home, away) pairs, teams as Team, TeamID or name. model: RatingModel (default, fitted on the season)
+    or RecordModel or anything with probabilities(home, away). playoff_spots: spots in the league, or per group
+    with groups mapping a group name to its teams. processes > 1 spreads the chunks of simulations over a process pool.
+    """
+    if n < 1:
+        raise ValueError(f"At least one simulation is needed, not {n}")
+    names, records, _, _ = _played(season)
+    position = {name: i for i, name in enumerate(names)}
+    def index(team:TeamLike)->int:
+        name = team.name if isinstance(team, (Team, TeamID)) else team
+        if name not in position:
+            raise ValueError(f"{name} is not a team of the season")
+        return position[name]
+    pairs = remaining_games(remaining)
+    home = np.array([index(h) for h, _ in pairs], dtype=np.int64)
+    away = np.array([index(a) for _, a in pairs], dtype=np.int64)
+    model = model if model is not None else RatingModel.fit(season)
+    p_home, p_tie = model.probabilities(home, away)
+    if groups is None:
+        group_of, spots = np.zeros(len(names), dtype=np.int64), np.array([playoff_spots])
+    else:
+        group_names = list(groups)
+        group_of = np.full(len(names), -1, dtype=np.int64)
+        for g, members in enumerate(group_names):
+            group_of[[index(team) for team in groups[members]]] = g
+        spots = np.array([playoff_spots[g] if isinstance(playoff_spots, dict) else playoff_spots for g in group_names])
+    setup = _Setup(records, home, away, np.asarray(p_home, dtype=float), np.asarray(p_tie, dtype=float), win_points, tie_points, group_of, spots)
+    sizes = [CHUNK] * (n // CHUNK) + ([n % CHUNK] if n % CHUNK else [])
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes)) # Independent streams, the same result for any number of processes
+    work = [(setup, size, s) for size, s in zip(sizes, seeds)]
+    if processes is None or processes > 1:
+        with ProcessPoolExecutor(max_workers=processes or os.cpu_count()) as pool:
+            parts = list(pool.map(_run, work))
+    else:
+        parts = [_run(item) for item in work]
+    wins, losses, ties, points = (sum(part[i] for part in parts) / n for i in range(4))
+    width = max(part[4].shape[1] for part in parts)
+    histogram = sum(np.pad(part[4], [(0, 0), (0, width - part[4].shape[1])]) for part in parts)
+    positions = sum(part[5] for part in parts)
+    playoffs = sum(part[6] for part in parts) / n
+    return SimulationResult(names, n, wins, losses, ties, points, histogram, positions, playoffs)
@@ -0,0 +1,193 @@
+# This file contains the snapshot of a whole Season in a versioned binary file, for warm starts.
+# Path: DataRepresentations\Snapshot.py
+# Layout: MAGIC, (format version, header length) as little endian uint16/uint32, a json header and the array sections,
+# each one aligned to ALIGN bytes. The header has the configuration, the teams, the keys and the dtype/shape/offset of
+# every section. Nothing is pickled.
+# The GameStore, the confusion matrix and the normaliser are restored from their arrays. The games themselves are
+# rebuilt from the game stats section and only added to the teams (records, stats and dates), which is a small part of
+# the cost of Season.add_game. After restore the season continues exactly like the one that was saved.
+#   season.snapshot("season.hps")
+#   season = Season.restore("season.hps")
+import os
+import json
+import struct
+import datetime as dt
+from typing import List, Dict, Tuple, Union, Optional, Any
+import numpy as np
+from .Representations import SeasonID, TeamID, Game, GameStats, Date
+from .Teams import Team, TeamList
+from .Storage import date_to_ordinal
+from .Season import Season
+from .Sweep import FeatureSweep
+from .Cache import FEATURE_VERSION
+
+MAGIC = b"HPSNAP\x00\x00"
+SNAPSHOT_VERSION = 2 # 2: teams saved by name only
+ALIGN = 64
+CLASSES = {"Season": Season, "FeatureSweep": FeatureSweep}
+# The kind of every game stat, so the stat dictionaries of the games are rebuilt with the same keys and types.
+MISSING, NONE, FLOAT, INT = 0, 1, 2, 3
+STORE_ARRAYS = ["ordinals", "teams", "features", "present", "records", "results", "game_stats", "game_present", "integral"]
+NORMALIZER_ARRAYS = ["count", "mean", "m2", "values", "present"]
+NORMALIZER_HISTORY = ["previous", "previous_present", "teams", "ordinals"] # Per game, used to truncate after a rewind
+NORMALIZER_DATES = ["dates", "date_moments", "date_quantiles"] # The league at the start of every date
+
+def _config(season:Season)->Dict[str,Any]:
+    config = {"average":season.average, "home":season.home, "away":season.away, "total":season.total,
+              "last_n":season.last_n, "derived":list(season.derived) or None,
+              "normalize":season.normalizer.method if season.normalizer is not None else None, "schedule":season.schedule}
+    if isinstance(season, FeatureSweep):
+        config = {"windows":season.windows, "derived":config["derived"], "schedule":season.schedule}
+    return config
+
+def _game_kinds(season:Season)->np.ndarray:
+    store = season.store
+    kinds = np.zeros((store.size, 2, len(store.keys)), dtype=np.int8)
+    for row, game in enumerate(season._raw_games):
+        for side, stats in enumerate((game.home_stats.stats, game.away_stats.stats)):
+            for key, value in stats.items():
+                kinds[row, side, store._key_index[key]] = NONE if value is None else INT if isinstance(value, (int, np.integer)) and not isinstance(value, bool) else FLOAT
+    return kinds
+
+def save_snapshot(season:Season, path:str)->None:
+    """Write the season to path, atomically (written next to it and renamed)."""
+    if len(season._raw_games) != season.store.size:
+        raise ValueError("Only seasons built with add_game can be snapshotted")
+    if not all(team.id.named for team in season.team_list):
+        raise ValueError("Only seasons of named teams can be snapshotted")
+    store = season.store
+    sections:Dict[str,np.ndarray] = {f"store.{name}": getattr(store, name) for name in STORE_ARRAYS}
+    sections["game_kinds"] = _game_kinds(season)
+    sections["confusion_matrix"] = season.confusion_matrix.matrix
+    if season.normalizer is not None:
+        for name in NORMALIZER_ARRAYS:
+            sections[f"normalizer.{name}"] = getattr(season.normalizer, name)
+        sections["normalizer.normalized"] = season.normalizer.normalized
+        for name in NORMALIZER_HISTORY:
+            sections[f"normalizer.{name}"] = getattr(season.normalizer, f"_{name}")[:season.normalizer.size]
+        normalizer = season.normalizer
+        sections["normalizer.dates"] = np.array(normalizer._dates, dtype=np.int64)
+        for name, n in (("date_moments", 3), ("date_quantiles", len(normalizer.quantiles))):
+            arrays = [normalizer._pad(a) for a in getattr(normalizer, f"_{name}")]
+            sections[f"normalizer.{name}"] = np.stack(arrays) if arrays else np.zeros((0, n) + normalizer.mean.shape)
+    season_id = season.season_id
+    header = {
+        "class":type(season).__name__,
+        "feature_version":FEATURE_VERSION,
+        "config":_config(season),
+        "season_id":{"season_id":season_id.season_id, "number_of_teams":season_id.number_of_teams,
+                     "start_date":date_to_ordinal(season_id.start_date) if season_id.start_date is not None else None},
+        # By name, the registry indices (TeamID.id) are local to the process and interned again when loading.
+        "teams":[[team.id._team_name, team.id._team_abbreviation, team.id._team_city] for team in season.team_list],
+        "store_teams":[season.team_list.teams.index(season.team_list[team]) for team in store.team_ids], # Store index -> team list position
+        "blocks":store.blocks,
+        "keys":store.keys,
+        "version":season.version,
+        "sections":{},
+    }
+    offset = 0
+    for name, array in sections.items():
+        array = np.ascontiguousarray(array)
+        sections[name] = array
+        header["sections"][name] = {"dtype":array.dtype.str, "shape":list(array.shape), "offset":offset}
+        offset += -(-array.nbytes // ALIGN) * ALIGN
+    header_bytes = json.dumps(header).encode("utf-8")
+    start = -(-(len(MAGIC) + 6 + len(header_bytes)) // ALIGN) * ALIGN
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<HI", SNAPSHOT_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in sections.items():
+            f.seek(start + header["sections"][name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(start + offset)
+    os.replace(tmp, path)
+
+def read_snapshot(path:str)->Tuple[Dict[str,Any],Dict[str,np.ndarray]]:
+    """The header and the sections (read only views of the file's bytes) of a snapshot."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a season snapshot")
+    version, length = struct.unpack_from("<HI", data, len(MAGIC))
+    if version > SNAPSHOT_VERSION:
+        raise ValueError(f"{path} is a version {version} snapshot, only versions up to {SNAPSHOT_VERSION} can be read")
+    begin = len(MAGIC) + 6
+    header = json.loads(data[begin:begin + length].decode("utf-8"))
+    start = -(-(begin + length) // ALIGN) * ALIGN
+    sections = {}
+    for name, section in header["sections"].items():
+        dtype, shape = np.dtype(section["dtype"]), tuple(section["shape"])
+        sections[name] = np.frombuffer(data, dtype, int(np.prod(shape)), start + section["offset"]).reshape(shape)
+    return header, sections
+
+def _games(header:Dict[str,Any], sections:Dict[str,np.ndarray], season:Season, store_teams:List[TeamID])->List[Game]:
+    store = season.store
+    keys = header["keys"]
+    game_stats, kinds = sections["store.game_stats"].tolist(), sections["game_kinds"].tolist()
+    games = []
+    for row, (ordinal, teams) in enumerate(zip(sections["store.ordinals"].tolist(), sections["store.teams"].tolist())):
+        date = store.date(ordinal)
+        stats = []
+        for side in range(2):
+            values = {}
+            for key, kind, value in zip(keys, kinds[row][side], game_stats[row][side]):
+                if kind != MISSING:
+                    values[key] = None if kind == NONE else int(value) if kind == INT else value
+            stats.append(GameStats(store_teams[teams[side]], date, values, side == 0))
+        games.append(Game(season.season_id, *stats))
+    return games
+
+def load_snapshot(path:str)->Season:
+    """Restore a season saved with save_snapshot."""
+    header, sections = read_snapshot(path)
+    if header["feature_version"] != FEATURE_VERSION:
+        raise ValueError(f"The snapshot was made with feature version {header['feature_version']}, this is {FEATURE_VERSION}, rebuild the season")
+    info = header["season_id"]
+    start_date = info["start_date"]
+    if start_date is not None:
+        day = dt.date.fromordinal(start_date)
+        start_date = Date(day.year, day.month, day.day)
+    season_id = SeasonID(info["season_id"], start_date, info["number_of_teams"])
+    team_list = TeamList(season_id=season_id)
+    for name, abbreviation, city in header["teams"]:
+        team_list.add_team(Team(team_list.registry.intern(name, abbreviation, city), season_id))
+    season = CLASSES[header["class"]](team_list, **header["config"])
+    store = season.store
+    assert store.blocks == header["blocks"], f"The blocks {store.blocks} of the configuration do not match the snapshot {header['blocks']}"
+    # The store teams in the saved order, the rows index into them.
+    store_teams = [team_list.teams[position].id for position in header["store_teams"]]
+    for team in store_teams:
+        store.team_index(team)
+    assert [store.team_index(team) for team in store_teams] == list(range(len(store_teams))), "The store teams must be registered in the saved order"
+    store.add_keys(header["keys"])
+    store.extend(*(sections[f"store.{name}"] for name in STORE_ARRAYS[:-1]), integral=sections.get("store.integral")) # Older snapshots have no integral
+    games = _games(header, sections, season, store_teams)
+    for game in games:
+        team_list[game.home_team_id].add_game(game)
+        team_list[game.away_team_id].add_game(game)
+    season._raw_games = games
+    season._played_dates = [store.date(ordinal) for ordinal in np.unique(sections["store.ordinals"]).tolist()]
+    season.confusion_matrix.matrix = sections["confusion_matrix"].copy()
+    if season._derived is not None:
+        season._derived.reset(store)
+    if season._schedule is not None:
+        season._schedule.reset(store)
+    if season.normalizer is not None and all(f"normalizer.{name}" in sections for name in NORMALIZER_HISTORY + NORMALIZER_DATES):
+        normalizer = season.normalizer
+        for name in NORMALIZER_ARRAYS:
+            setattr(normalizer, name, sections[f"normalizer.{name}"].copy())
+        normalized = sections["normalizer.normalized"]
+        for name, saved in [("normalized", normalized)] + [(name, sections[f"normalizer.{name}"]) for name in NORMALIZER_HISTORY]:
+            array = np.zeros((max(len(saved), 1),) + saved.shape[1:], dtype=saved.dtype)
+            array[:len(saved)] = saved
+            setattr(normalizer, f"_{name}", array)
+        normalizer.size = len(normalized)
+        normalizer._dates = sections["normalizer.dates"].tolist()
+        normalizer._date_moments = list(sections["normalizer.date_moments"])
+        normalizer._date_quantiles = list(sections["normalizer.date_quantiles"])
+    elif season.normalizer is not None: # Saved without the history, normalise the games again
+        season.normalizer.reset(store)
+    season.version = header["version"]
+    return season
@@ -0,0 +1,186 @@
+# This file contains the standings of a Season: points, the standings columns and the ranks with tiebreakers, as of every played date.
+# Path: DataRepresentations\Standings.py
+# Like SeasonTables everything is computed from the columnar GameStore at once: the columns of every game are bucketed per
+# (date, team) and summed cumulatively over the dates. Losses in overtime/shootout (the "OT" game stat of the schedule table)
+# are OTL, the other decided games are in regulation. The ranks of every date come from one lexsort over (date, tiebreakers).
+# Head to head (H2H) is the points a team took from the other teams tied with it on all the previous tiebreakers.
+#   standings = season.standings
+#   standings.table()                        # DataFrame of the last played date, in standings order
+#   standings.values("Points")               # (dates, teams)
+#   standings.features(["Points%", "Rank"])  # (games, side, columns) of both teams before every game, for models
+from typing import List, Dict, Tuple, Union, Optional, NamedTuple
+import datetime as dt
+import numpy as np
+from .Representations import Date
+from .Storage import HOME, AWAY, date_to_ordinal
+from .Lazy import lazy_import
+pd = lazy_import("pandas")
+
+OVERTIME_KEY = "OT"
+SHOOTOUT = 2 # Value of the OT game stat after a shootout
+GOALS_KEY = "Goals"
+COUNTS = ["GP", "W", "L", "OTL", "T", "RW", "ROW", "GF", "GA", "Points"] # Summed over the games
+COLUMNS = COUNTS + ["GD", "Points%", "Rank"]
+TIEBREAKERS = ["Points", "Points%", "RW", "ROW", "W", "H2H", "GD", "GF"] # Higher is better for all of them
+
+class PointsSystem(NamedTuple):
+    """Points for every outcome, ot_win defaults to win (2-1-0 hockey), e.g. PointsSystem(3, 1, 1, 0, ot_win=2) for 3-2-1-0."""
+    win:int=2
+    ot_loss:int=1
+    tie:int=1
+    loss:int=0
+    ot_win:Optional[int]=None
+
+class Standings:
+    def __init__(self, season, points:PointsSystem=PointsSystem(), tiebreakers:List[str]=None, groups:Dict[str,List[str]]=None) -> None:
+        """
+        season: the Season, points: the points of every outcome, tiebreakers: names of TIEBREAKERS in order.\n
+        groups: e.g. divisions, group name -> team names, then "Group Rank" is the rank within the group.
+        """
+        tiebreakers = list(TIEBREAKERS if tiebreakers is None else tiebreakers)
+        for tiebreaker in tiebreakers:
+            if tiebreaker not in TIEBREAKERS:
+                raise ValueError(f"Unknown tiebreaker {tiebreaker}, must be one of {TIEBREAKERS}")
+        self.season = season
+        self.points = points
+        self.tiebreakers = tiebreakers
+        self.groups = groups
+        self._key = None
+    def _refresh(self)->None:
+        store = self.season.store
+        key = (self.season.version, store.size, len(store.keys))
+        if key == self._key:
+            return
+        self.season.sort_games()
+        ordinals, day = np.unique(store.ordinals, return_inverse=True)
+        teams = self.season.team_positions() # (games, side)
+        self._ordinals = ordinals
+        self._teams = teams
+        self._team_names = list(self.season.team_list.team_names)
+        n_dates, n_teams = len(ordinals), len(self._team_names)
+        # The columns of every game from both sides' point of view.
+        results = store.results.astype(int)[:, None] * np.array([1, -1]) # (games, side)
+        overtime = shootout = np.zeros((store.size, 2), dtype=bool)
+        if OVERTIME_KEY in store._key_index: # 1 for overtime, 2 for a shootout, see DataScraping.schedule
+            key = store._key_index[OVERTIME_KEY]
+            overtime = store.game_present[..., key] & (store.game_stats[..., key] > 0)
+            shootout = store.game_present[..., key] & (store.game_stats[..., key] >= SHOOTOUT)
+        goals = np.zeros((store.size, 2))
+        if GOALS_KEY in store._key_index:
+            key = store._key_index[GOALS_KEY]
+            goals = np.where(store.game_present[..., key], store.game_stats[..., key], 0.0)
+        win, loss, tie = results > 0, results < 0, results == 0
+        ot_win = self.points.win if self.points.ot_win is None else self.points.ot_win
+        points = np.select([win & ~overtime, win & overtime, loss & overtime, tie], [self.points.win, ot_win, self.points.ot_loss, self.points.tie], self.points.loss)
+        per_side = np.stack([np.ones_like(win), win, loss & ~overtime, loss & overtime, tie, win & ~overtime, win & ~shootout,
+                             goals, goals[:, ::-1], points], axis=-1).astype(float) # (games, side, COUNTS)
+        increments = np.zeros((n_dates, n_teams, len(COUNTS)))
+        head_to_head = np.zeros((n_dates, n_teams, n_teams))
+        for side in (HOME, AWAY):
+            np.add.at(increments, (day, teams[:, side]), per_side[:, side])
+            np.add.at(head_to_head, (day, teams[:, side], teams[:, 1 - side]), points[:, side])
+        counts = np.cumsum(increments, axis=0)
+        self._columns = {column: counts[..., i] for i, column in enumerate(COUNTS)}
+        self._columns["GD"] = self._columns["GF"] - self._columns["GA"]
+        games = self._columns["GP"]
+        possible = games * max(self.points.win, ot_win)
+        self._columns["Points%"] = np.divide(self._columns["Points"], possible, out=np.zeros_like(games), where=possible > 0)
+        self._head_to_head = np.cumsum(head_to_head, axis=0)
+        self._columns["Rank"] = self._rank(np.zeros(n_teams, dtype=np.int64))
+        if self.groups is not None:
+            group = np.full(n_teams, -1, dtype=np.int64)
+            for g, members in enumerate(self.groups.values()):
+                group[[self._team_names.index(str(name)) for name in members]] = g
+            self._columns["Group Rank"] = self._rank(group)
+        self._key = key
+    def _rank(self, group:np.ndarray)->np.ndarray:
+        """1 based rank of every team within its group as of every date, (dates, teams)."""
+        n_dates, n_teams = len(self._ordinals), len(self._team_names)
+        keys = []
+        for tiebreaker in self.tiebreakers:
+            if tiebreaker == "H2H": # Points against the teams tied on every previous tiebreaker (and in the same group)
+                previous = np.stack(keys + [np.broadcast_to(group, (n_dates, n_teams)).astype(float)], axis=-1)
+                tied = (previous[:, :, None, :] == previous[:, None, :, :]).all(axis=-1)
+                keys.append((self._head_to_head * tied).sum(axis=-1))
+            else:
+                keys.append(self._columns[tiebreaker])
+        name_order = np.argsort(np.argsort(self._team_names))
+        dates = np.repeat(np.arange(n_dates), n_teams)
+        groups = np.tile(group, n_dates)
+        # lexsort sorts by the last key first: date, group, the tiebreakers (descending) and finally the name.
+        order = np.lexsort([np.tile(name_order, n_dates)] + [-key.ravel() for key in reversed(keys)] + [groups, dates])
+        rank = np.empty(n_dates * n_teams, dtype=np.int64)
+        # Position within the (date, group) block.
+        block = dates[order] * (n_teams + 1) + groups[order]
+        start = np.ones(len(order), dtype=bool)
+        start[1:] = block[1:] != block[:-1]
+        first = np.maximum.accumulate(np.where(start, np.arange(len(order)), 0))
+        rank[order] = np.arange(len(order)) - first + 1
+        return rank.reshape(n_dates, n_teams).astype(float)
+    @property
+    def columns(self)->List[str]:
+        return COLUMNS + (["Group Rank"] if self.groups is not None else [])
+    @property
+    def ordinals(self)->np.ndarray:
+        """The played dates as ordinals, the first axis of every table."""
+        self._refresh()
+        return self._ordinals
+    @property
+    def team_names(self)->List[str]:
+        self._refresh()
+        return self._team_names
+    def values(self, column:str, per_game:bool=False)->np.ndarray:
+        """The column of every team (team_list order) up to and including every played date, (dates, teams)."""
+        self._refresh()
+        if column not in self._columns:
+            raise ValueError(f"Unknown standings column {column}, must be one of {self.columns}")
+        values = self._columns[column]
+        if per_game and column in COUNTS + ["GD"]:
+            games = self._columns["GP"]
+            return np.divide(values, games, out=np.zeros_like(values), where=games > 0)
+        return values
+    def _date_index(self, date:Union[Date,dt.date,int]=None)->int:
+        # The last played date on or before the date.
+        ordinals = self.ordinals
+        if date is None:
+            return len(ordinals) - 1
+        ordinal = date_to_ordinal(date) if isinstance(date, Date) else date.toordinal() if isinstance(date, dt.date) else int(date)
+        index = int(np.searchsorted(ordinals, ordinal, side="right")) - 1
+        if index < 0:
+            raise ValueError(f"No games were played on or before {date}")
+        return index
+    def table(self, date:Union[Date,dt.date,int]=None, columns:List[str]=None)->"pd.DataFrame":
+        """The standings as of the date (by default the last played date), in standings order."""
+        columns = self.columns if columns is None else list(columns)
+        index = self._date_index(date)
+        df = pd.DataFrame({column: self.values(column)[index] for column in columns})
+        df.insert(0, "Team", self._team_names)
+        order = np.argsort(self.values("Rank")[index], kind="stable")
+        df = df.iloc[order].reset_index(drop=True)
+        counts = [column for column in columns if column in COUNTS + ["GD", "Rank", "Group Rank"]]
+        return df.astype({column: int for column in counts})
+    def frame(self, columns:List[str]=None)->"pd.DataFrame":
+        """One row per played date and team with "Date", "Team" and the columns."""
+        columns = self.columns if columns is None else list(columns)
+        cube = np.stack([self.values(column) for column in columns], axis=-1)
+        n_dates, n_teams = cube.shape[:2]
+        df = pd.DataFrame(cube.reshape(n_dates * n_teams, len(columns)), columns=columns)
+        df.insert(0, "Team", np.tile(np.array(self._team_names, dtype=object), n_dates))
+        df.insert(0, "Date", np.repeat(np.array([str(self.season.store.date(o)) for o in self._ordinals.tolist()], dtype=object), n_teams))
+        return df
+    def features(self, columns:List[str]=None, per_game:bool=False)->np.ndarray:
+        """
+        The standings of both teams before every game of the store (as of the previous played date), (games, side, columns).\n
+        Zero before a team's first game day. Only known before the game, so safe as model features.
+        """
+        columns = ["Points%", "Rank"] if columns is None else list(columns)
+        self._refresh()
+        store = self.season.store
+        cube = np.stack([self.values(column, per_game) for column in columns], axis=-1) # (dates, teams, columns)
+        previous = np.searchsorted(self._ordinals, store.ordinals, side="left") - 1 # (games,)
+        teams = self._teams
+        out = np.zeros((store.size, 2, len(columns)))
+        valid = previous >= 0
+        for side in (HOME, AWAY):
+            out[valid, side] = cube[previous[valid], teams[valid, side]]
+        return out
@@ -0,0 +1,315 @@
+# This file contains the columnar storage of the games of a Season.
+# Path: DataRepresentations\Storage.py
+# Instead of keeping a tuple of Stats objects per game (with a dictionary and its key strings per block),
+# the games are stored in preallocated NumPy blocks which grow by doubling.
+# The stat keys are only stored once and the old tuple view is built lazily when a game is accessed.
+import datetime as dt
+from typing import List, Dict, Tuple, Union, Optional, Sequence, Iterable
+import numpy as np
+from .Representations import TeamID, TeamRegistry, LEAGUE, Date, Stats, GameStats, GameResult, Game
+
+HOME = 0
+AWAY = 1
+NO_RECORD = -1 # Used in the record arrays when a team had not played before the game.
+
+def date_to_ordinal(date:Date)->int:
+    return date.date.toordinal()
+
+class GameStore:
+    """
+    Columnar storage of the games in a season.\n
+    features:  (games, side, block, stat) the stats leading up to the game, side 0 is home and 1 is away.
+    present:   (games, side, block, stat) False where the stat was missing (None) or the block had no stats.
+    integral:  (games, side, block, stat) True where the stat was an int, so the games are built with the same types.
+    records:   (games, side, 3) the w-l-t record before the game, NO_RECORD if there was none.
+    results:   (games,) 1 if the home team won, -1 if the away team won and 0 for a tie.
+    teams:     (games, side) index into GameStore.team_ids, league_teams has the registry indices instead.
+    dates:     (games,) proleptic Gregorian ordinal of the game date.
+    game_stats:(games, side, stat) the stats of the game itself, game_present marks the stats that were not None.
+    """
+    def __init__(self, blocks:List[str], keys:List[str]=None, capacity:int=256, registry:TeamRegistry=None) -> None:
+        self.blocks:List[str] = list(blocks)
+        self.keys:List[str] = []
+        self._key_index:Dict[str,int] = {}
+        self.registry = registry if registry is not None else LEAGUE
+        self.team_ids:List[TeamID] = []
+        self.registry_indices = np.zeros(0, dtype=np.int32) # Store team index -> registry index
+        self._local = np.zeros(0, dtype=np.int32)           # Registry index -> store team index, -1 if not in the store
+        self._dates:Dict[int,Date] = {} # Ordinal -> Date, every Date object is only created once.
+        self.size = 0
+        self.sorted = True
+        self._allocate(max(capacity,1), 0)
+        if keys is not None:
+            self.add_keys(keys)
+    def _allocate(self, capacity:int, n_stats:int)->None:
+        n_blocks = len(self.blocks)
+        self.capacity = capacity
+        self._features = np.zeros((capacity, 2, n_blocks, n_stats))
+        self._present = np.zeros((capacity, 2, n_blocks, n_stats), dtype=bool)
+        self._integral = np.zeros((capacity, 2, n_blocks, n_stats), dtype=bool)
+        self._records = np.full((capacity, 2, 3), NO_RECORD, dtype=np.int32)
+        self._results = np.zeros(capacity, dtype=np.int8)
+        self._teams = np.zeros((capacity, 2), dtype=np.int32)
+        self._ordinals = np.zeros(capacity, dtype=np.int32)
+        self._game_stats = np.zeros((capacity, 2, n_stats))
+        self._game_present = np.zeros((capacity, 2, n_stats), dtype=bool)
+    def _resize(self, capacity:int, n_stats:int)->None:
+        # Copy the used part into new arrays, either for more games or more stat keys.
+        old = (self._features, self._present, self._records, self._results, self._teams, self._ordinals, self._game_stats, self._game_present, self._integral)
+        old_stats = old[0].shape[-1]
+        self._allocate(capacity, n_stats)
+        n = self.size
+        self._features[:n,...,:old_stats] = old[0][:n]
+        self._present[:n,...,:old_stats] = old[1][:n]
+        self._records[:n] = old[2][:n]
+        self._results[:n] = old[3][:n]
+        self._teams[:n] = old[4][:n]
+        self._ordinals[:n] = old[5][:n]
+        self._game_stats[:n,...,:old_stats] = old[6][:n]
+        self._game_present[:n,...,:old_stats] = old[7][:n]
+        self._integral[:n,...,:old_stats] = old[8][:n]
+    def reserve(self, n:int)->None:
+        """Make room for n more games."""
+        if self.size + n > self.capacity:
+            capacity = self.capacity
+            while capacity < self.size + n:
+                capacity *= 2
+            self._resize(capacity, len(self.keys))
+    def add_keys(self, keys)->None:
+        size = len(self.keys)
+        for key in keys:
+            if key not in self._key_index:
+                self._key_index[key] = len(self.keys)
+                self.keys.append(key)
+        if len(self.keys) != size:
+            self._resize(self.capacity, len(self.keys))
+    def team_index(self, team:TeamID)->int:
+        league = self.registry.index(team)
+        if league >= len(self._local):
+            self._local = np.concatenate([self._local, np.full(max(league + 1 - len(self._local), len(self._local)), -1, dtype=np.int32)])
+        index = int(self._local[league])
+        if index < 0:
+            index = len(self.team_ids)
+            self._local[league] = index
+            self.team_ids.append(team)
+            self.registry_indices = np.append(self.registry_indices, np.int32(league))
+        return index
+    def find_team(self, team:Union[TeamID,str])->Optional[int]:
+        """The store index of the team without registering it, None if it has no games in the store."""
+        league = self.registry.find(team)
+        if league is None or league >= len(self._local) or self._local[league] < 0:
+            return None
+        return int(self._local[league])
+    def positions(self, teams:Iterable[Union[TeamID,str]])->np.ndarray:
+        """(games, side) position of the teams of every game in teams, e.g. the team list. KeyError if a team of the store is not in it."""
+        position = np.full(len(self.team_ids), -1, dtype=np.int64)
+        for i, team in enumerate(teams):
+            index = self.find_team(team)
+            if index is not None:
+                position[index] = i
+        positions = position[self.teams]
+        if (positions < 0).any():
+            missing = np.unique(self.teams[positions < 0]).tolist()
+            raise KeyError(f"Teams with games in the store are missing from the teams: {[str(self.team_ids[i]) for i in missing]}")
+        return positions
+    @property
+    def league_teams(self)->np.ndarray:
+        """(games, side) registry indices of the teams, comparable between seasons."""
+        return self.registry_indices[self.teams]
+    def date(self, ordinal:int)->Date:
+        date = self._dates.get(ordinal)
+        if date is None:
+            d = dt.date.fromordinal(int(ordinal))
+            date = Date(d.year, d.month, d.day)
+            self._dates[ordinal] = date
+        return date
+    def _fill(self, values:np.ndarray, present:np.ndarray, stats:Dict[str,Union[int,float]], integral:np.ndarray=None)->None:
+        for key, value in stats.items():
+            if value is not None:
+                index = self._key_index[key]
+                values[index] = value
+                present[index] = True
+                if integral is not None:
+                    integral[index] = isinstance(value, (int, np.integer)) and not isinstance(value, (bool, np.bool_))
+    def append(self, date:Date,
+               stats_home:List[Stats], record_home:Optional[Tuple[int,int,int]],
+               stats_away:List[Stats], record_away:Optional[Tuple[int,int,int]],
+               game:Game)->int:
+        """Append a game and return its row."""
+        # New keys resize the arrays, so they have to be known before any row views are taken.
+        for stat in stats_home + stats_away + [game.home_stats, game.away_stats]:
+            self.add_keys(stat.stats.keys())
+        self.reserve(1)
+        i = self.size
+        ordinal = date_to_ordinal(date)
+        self._dates.setdefault(ordinal, date)
+        if i and ordinal < self._ordinals[i-1]:
+            self.sorted = False
+        self._ordinals[i] = ordinal
+        self._teams[i] = (self.team_index(game.home_team_id), self.team_index(game.away_team_id))
+        self._results[i] = game.result.result
+        for side, (stats, record) in enumerate(((stats_home, record_home), (stats_away, record_away))):
+            for block, stat in enumerate(stats):
+                self._fill(self._features[i, side, block], self._present[i, side, block], stat.stats, self._integral[i, side, block])
+            if record is not None:
+                self._records[i, side] = record
+        self._fill(self._game_stats[i, HOME], self._game_present[i, HOME], game.home_stats.stats)
+        self._fill(self._game_stats[i, AWAY], self._game_present[i, AWAY], game.away_stats.stats)
+        self.size += 1
+        return i
+    def extend(self, ordinals:np.ndarray, teams:np.ndarray, features:np.ndarray, present:np.ndarray,
+               records:np.ndarray, results:np.ndarray, game_stats:np.ndarray, game_present:np.ndarray, integral:np.ndarray=None)->slice:
+        """Bulk append of already computed games, the arrays follow the layout of the store and
+        teams index into team_ids, the stats are in the order of keys. Returns the new rows.
+        Without integral every feature is a float."""
+        n = len(ordinals)
+        assert features.shape[1:] == (2, len(self.blocks), len(self.keys)), f"Features must have shape (games, 2, {len(self.blocks)}, {len(self.keys)}), got {features.shape}"
+        assert game_stats.shape[1:] == (2, len(self.keys)), f"Game stats must have shape (games, 2, {len(self.keys)}), got {game_stats.shape}"
+        assert teams.size == 0 or teams.max() < len(self.team_ids), "All teams must be registered with team_index first"
+        self.reserve(n)
+        rows = slice(self.size, self.size + n)
+        self._ordinals[rows] = ordinals
+        self._teams[rows] = teams
+        self._features[rows] = features
+        self._present[rows] = present
+        self._integral[rows] = False if integral is None else integral
+        self._records[rows] = records
+        self._results[rows] = results
+        self._game_stats[rows] = game_stats
+        self._game_present[rows] = game_present
+        previous = self._ordinals[self.size-1:self.size+n] if self.size else self._ordinals[rows]
+        if np.any(np.diff(previous) < 0):
+            self.sorted = False
+        self.size += n
+        return rows
+    def truncate(self, row:int)->None:
+        """Drop all the games from row and on, the arrays are kept for reuse."""
+        assert 0 <= row <= self.size, f"Cannot truncate to row {row} of {self.size} games"
+        self._features[row:self.size] = 0
+        self._present[row:self.size] = False
+        self._integral[row:self.size] = False
+        self._records[row:self.size] = NO_RECORD
+        self._game_stats[row:self.size] = 0
+        self._game_present[row:self.size] = False
+        self.size = row
+    def first_row(self, date:Date)->int:
+        """The first row played on or after the date, the store must be sorted."""
+        assert self.sorted, "The games must be sorted, call sort() first"
+        return int(np.searchsorted(self._ordinals[:self.size], date_to_ordinal(date), side="left"))
+    def sort(self)->None:
+        """Sort the games by date, stable so games on the same date keep their order."""
+        if self.sorted:
+            return
+        n = self.size
+        order = np.argsort(self._ordinals[:n], kind="stable")
+        for name in ("_features", "_present", "_integral", "_records", "_results", "_teams", "_ordinals", "_game_stats", "_game_present"):
+            array = getattr(self, name)
+            array[:n] = array[:n][order]
+        self.sorted = True
+    def date_range(self, start:Date=None, end:Date=None)->slice:
+        """The rows of the games played from start up to and including end, the store must be sorted."""
+        assert self.sorted, "The games must be sorted to slice a date range, call sort() first"
+        ordinals = self._ordinals[:self.size]
+        lo = 0 if start is None else int(np.searchsorted(ordinals, date_to_ordinal(start), side="left"))
+        hi = self.size if end is None else int(np.searchsorted(ordinals, date_to_ordinal(end), side="right"))
+        return slice(lo, hi)
+    # Views of the used part of the arrays, no copies are made.
+    @property
+    def features(self)->np.ndarray:
+        return self._features[:self.size]
+    @property
+    def present(self)->np.ndarray:
+        return self._present[:self.size]
+    @property
+    def integral(self)->np.ndarray:
+        return self._integral[:self.size]
+    @property
+    def records(self)->np.ndarray:
+        return self._records[:self.size]
+    @property
+    def results(self)->np.ndarray:
+        return self._results[:self.size]
+    @property
+    def teams(self)->np.ndarray:
+        return self._teams[:self.size]
+    @property
+    def ordinals(self)->np.ndarray:
+        return self._ordinals[:self.size]
+    @property
+    def game_stats(self)->np.ndarray:
+        return self._game_stats[:self.size]
+    @property
+    def game_present(self)->np.ndarray:
+        return self._game_present[:self.size]
+    @property
+    def nbytes(self)->int:
+        return sum(getattr(self, name).nbytes for name in ("features", "present", "integral", "records", "results", "teams", "ordinals", "game_stats", "game_present"))
+    def _stats_dict(self, values:np.ndarray, present:np.ndarray, integral:np.ndarray=None)->Dict[str,Union[int,float]]:
+        if integral is None:
+            return {key: float(values[i]) for i, key in enumerate(self.keys) if present[i]}
+        return {key: int(values[i]) if integral[i] else float(values[i]) for i, key in enumerate(self.keys) if present[i]}
+    def game(self, i:int)->Tuple[Date, List[Stats], Optional[Tuple[int,int,int]], List[Stats], Optional[Tuple[int,int,int]], GameResult]:
+        """Build the (date, [Stats...], record, [Stats...], record, result) tuple of a single game."""
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError(f"Game index {i} out of range for {self.size} games")
+        date = self.date(self._ordinals[i])
+        home_team, away_team = (self.team_ids[t] for t in self._teams[i])
+        out = [date]
+        for side in (HOME, AWAY):
+            stats = [Stats(self._stats_dict(self._features[i, side, block], self._present[i, side, block], self._integral[i, side, block]), date, side == HOME) for block in range(len(self.blocks))]
+            record = self._records[i, side]
+            out.append(stats)
+            out.append(None if record[0] == NO_RECORD else tuple(int(r) for r in record))
+        home_stats = GameStats(home_team, date, self._stats_dict(self._game_stats[i, HOME], self._game_present[i, HOME]), True)
+        away_stats = GameStats(away_team, date, self._stats_dict(self._game_stats[i, AWAY], self._game_present[i, AWAY]), False)
+        out.append(GameResult(home_stats, away_stats))
+        return tuple(out)
+    def __len__(self)->int:
+        return self.size
+
+class GameList(Sequence):
+    """
+    Lazy tuple view over a GameStore.\n
+    Behaves like the old list of (date, [Stats...], record, [Stats...], record, result) tuples,
+    the tuples are only built when accessed. Slicing returns another view and the array properties
+    are zero-copy views of the store.
+    """
+    def __init__(self, store:GameStore, rows:slice=None) -> None:
+        self.store = store
+        self.rows = slice(*(slice(None) if rows is None else rows).indices(store.size))
+    def __len__(self)->int:
+        return len(range(self.rows.start, self.rows.stop, self.rows.step))
+    def __getitem__(self, index:Union[int,slice]):
+        rows = range(self.rows.start, self.rows.stop, self.rows.step)
+        if isinstance(index, slice):
+            sub = rows[index]
+            return GameList(self.store, slice(sub.start, sub.stop, sub.step))
+        return self.store.game(rows[index])
+    def __iter__(self):
+        for i in range(self.rows.start, self.rows.stop, self.rows.step):
+            yield self.store.game(i)
+    def __repr__(self)->str:
+        return f"GameList({len(self)} games)"
+    @property
+    def features(self)->np.ndarray:
+        return self.store._features[self.rows]
+    @property
+    def present(self)->np.ndarray:
+        return self.store._present[self.rows]
+    @property
+    def records(self)->np.ndarray:
+        return self.store._records[self.rows]
+    @property
+    def results(self)->np.ndarray:
+        return self.store._results[self.rows]
+    @property
+    def teams(self)->np.ndarray:
+        return self.store._teams[self.rows]
+    @property
+    def ordinals(self)->np.ndarray:
+        return self.store._ordinals[self.rows]
+    @property
+    def game_stats(self)->np.ndarray:
+        return self.store._game_stats[self.rows]
@@ -0,0 +1,138 @@
+# This file contains the config sweep of the Season features: build the superset of blocks once, project any configuration.
+# Path: DataRepresentations\Sweep.py
+# A Season(average, home, away, total, last_n) only differs from another configuration by which blocks it computes,
+# every block is computed the same way whatever else is enabled. FeatureSweep computes TD, H, A, Tot and a last n
+# block per window and per split in one pass over the games, project() selects the blocks (and keys) of a configuration.
+# The selection is a view when the selected blocks are evenly spaced (e.g. a single block or TD..Tot-LastN),
+# otherwise the blocks are gathered into a new array.
+#   sweep = FeatureSweep(team_list, windows=[3, 5, 10])
+#   sweep.add_games(games)
+#   features = sweep.project(SeasonConfig(home=True, last_n=5)).features # Same as Season(team_list, home=True, last_n=5)
+from typing import List, Dict, Tuple, Union, Optional, NamedTuple, Iterable
+import numpy as np
+from .Representations import SeasonID
+from .Teams import TeamList
+from .Season import Season, index_desc_for
+from .Derived import REGISTRY
+from .Schedule import FEATURES as SCHEDULE_FEATURES
+
+class SeasonConfig(NamedTuple):
+    """The feature arguments of Season, with the same defaults."""
+    average:bool = True
+    home:bool = False
+    away:bool = False
+    total:bool = False
+    last_n:int = None
+    derived:Union[bool,List[str]] = None
+    schedule:bool = False
+    @property
+    def derived_names(self)->List[str]:
+        return (REGISTRY.names if self.derived is True else list(self.derived)) if self.derived else []
+    @property
+    def index_desc(self)->List[str]:
+        return index_desc_for(self.average, self.home, self.away, self.total, [self.last_n] if self.last_n else [], bool(self.derived), self.schedule)
+
+class Projection(NamedTuple):
+    """The arrays a Season of the configuration would have in its GameStore, views where possible."""
+    config:SeasonConfig
+    index_desc:List[str]
+    keys:List[str]
+    features:np.ndarray
+    present:np.ndarray
+    records:np.ndarray
+    results:np.ndarray
+    teams:np.ndarray
+    ordinals:np.ndarray
+    game_stats:np.ndarray
+    game_present:np.ndarray
+
+def _selector(indices:List[int])->Union[slice,np.ndarray]:
+    # Evenly spaced indices are a slice, so indexing with them gives a view.
+    if len(indices) == 1:
+        return slice(indices[0], indices[0] + 1)
+    steps = np.diff(indices)
+    if len(indices) and np.all(steps == steps[0]) and steps[0] > 0:
+        return slice(indices[0], indices[-1] + 1, int(steps[0]))
+    return np.array(indices, dtype=np.intp)
+
+def select(blocks:List[str], keys:List[str], config:SeasonConfig)->Tuple[Union[slice,np.ndarray],Union[slice,np.ndarray],List[str],List[str]]:
+    """
+    The block and key selectors of a configuration in a superset with the given blocks and keys.\n
+    Returns (block selector, key selector, index_desc, keys of the configuration).
+    """
+    index_desc = config.index_desc
+    missing = [block for block in index_desc if block not in blocks]
+    if missing:
+        raise ValueError(f"The blocks {missing} of {config} are not in the sweep, it has {blocks}")
+    # The derived and schedule features which were not asked for are the only keys a Season of the configuration would not have.
+    dropped = (set(REGISTRY.names) - set(config.derived_names)) | (set() if config.schedule else set(SCHEDULE_FEATURES))
+    wanted = [i for i, key in enumerate(keys) if key not in dropped]
+    missing = [name for name in config.derived_names if name not in keys]
+    if missing:
+        raise ValueError(f"The derived features {missing} of {config} are not in the sweep")
+    key_selector = slice(None) if len(wanted) == len(keys) else _selector(wanted)
+    return _selector([blocks.index(block) for block in index_desc]), key_selector, index_desc, [keys[i] for i in wanted]
+
+def project_arrays(blocks:List[str], keys:List[str], config:SeasonConfig, features:np.ndarray, present:np.ndarray,
+                   game_stats:np.ndarray, game_present:np.ndarray, **columns:np.ndarray)->Projection:
+    """Project arrays in the GameStore layout (e.g. a Parallel.SeasonDataset built with windows) onto a configuration."""
+    block_selector, key_selector, index_desc, config_keys = select(blocks, keys, config)
+    def take(array:np.ndarray, block_axis:bool)->np.ndarray:
+        if block_axis:
+            array = array[:, :, block_selector]
+        return array[..., key_selector]
+    return Projection(
+        config=config,
+        index_desc=index_desc,
+        keys=config_keys,
+        features=take(features, True),
+        present=take(present, True),
+        game_stats=take(game_stats, False),
+        game_present=take(game_present, False),
+        records=columns.get("records"),
+        results=columns.get("results"),
+        teams=columns.get("teams"),
+        ordinals=columns.get("ordinals"),
+    )
+
+class FeatureSweep(Season):
+    """
+    A Season with every block: TD, H, A and Tot, each followed by one last n block per window, the derived and the schedule features.\n
+    It is built like a Season (add_game, add_games, replace_game, ...), project() gives any configuration with
+    a last_n among the windows (or None) and derived features among the swept ones.
+    """
+    def __init__(self, team_list:TeamList,
+                 windows:Iterable[int]=(5,),
+                 derived:Union[bool,List[str]]=None,
+                 season_id:SeasonID=None,
+                 schedule:bool=False,
+                 ) -> None:
+        self._windows = sorted(set(int(n) for n in windows if n))
+        super().__init__(team_list, season_id, average=True, home=True, away=True, total=True,
+                         last_n=self._windows[-1] if self._windows else None, derived=derived, schedule=schedule)
+    @property
+    def windows(self)->List[int]:
+        return self._windows
+    def configs(self)->List[SeasonConfig]:
+        """Every configuration (without derived features) the sweep can project."""
+        flags = [(a, h, w, t) for a in (True, False) for h in (True, False) for w in (True, False) for t in (True, False) if a or h or w or t]
+        return [SeasonConfig(a, h, w, t, n) for a, h, w, t in flags for n in [None] + self._windows]
+    def project(self, config:Union[SeasonConfig,Dict]=None, **kwargs)->Projection:
+        """The arrays of a Season with the configuration, either a SeasonConfig, a dict or the Season keyword arguments."""
+        if config is None:
+            config = SeasonConfig(**kwargs)
+        elif isinstance(config, dict):
+            config = SeasonConfig(**config)
+        if isinstance(config.derived, list):
+            config = config._replace(derived=tuple(config.derived)) # Hashable, used as the key of sweep()
+        store = self.store
+        store.sort()
+        return project_arrays(store.blocks, store.keys, config, store.features, store.present, store.game_stats, store.game_present,
+                              records=store.records, results=store.results, teams=store.teams, ordinals=store.ordinals)
+    def sweep(self, configs:Iterable[Union[SeasonConfig,Dict]]=None)->Dict[SeasonConfig,Projection]:
+        """Project every configuration, all of them by default."""
+        projections = {}
+        for config in (configs if configs is not None else self.configs()):
+            projection = self.project(config)
+            projections[projection.config] = projection
+        return projections
@@ -0,0 +1,208 @@
+# This file contains a vectorised generator of synthetic leagues, used for load testing.
+# Path: DataRepresentations\Synthetic.py
+# Whole leagues are generated at once with NumPy: a round robin schedule with balanced home/away games
+# and stats drawn from each team's latent attack/defence strength. The stats of the two teams are
+# mirrored the same way as testingfunctions.rand_game (shots <-> shots against, PP <-> BP, ...).
+import datetime as dt
+from typing import List, Dict, Tuple, Union, Optional, Iterator
+import numpy as np
+from .Representations import SeasonID, TeamID, Date, Game, GameStats
+from .Teams import Team, TeamList
+
+# Same keys (and spelling) as testingfunctions.rand_team_stats
+STAT_KEYS = [
+    "Goals",
+    "Goals Against",
+    "Shots",
+    "Shots againts",
+    "Hits",
+    "Blocks",
+    "Faceoffs Won",
+    "Faceoffs Lost",
+    "Powerplay Goals",
+    "Powerplay Goals Against",
+    "Boxplay Goals",
+    "Boxplay Goals Against",
+    "Powerplay Opportunities",
+    "Boxplay Opportunities",
+    "Penalty Minutes",
+    "Penalty Minutes Drawn",
+]
+# key -> the key of the opponent holding the same value
+MIRRORED = {
+    "Goals": "Goals Against",
+    "Shots": "Shots againts",
+    "Faceoffs Won": "Faceoffs Lost",
+    "Powerplay Goals": "Boxplay Goals Against",
+    "Powerplay Goals Against": "Boxplay Goals",
+    "Powerplay Opportunities": "Boxplay Opportunities",
+    "Penalty Minutes": "Penalty Minutes Drawn",
+}
+MIRRORED.update({value: key for key, value in list(MIRRORED.items())})
+ALWAYS_PRESENT = ["Goals", "Goals Against"] # Never removed by the missing value injection
+_KEY = {key: i for i, key in enumerate(STAT_KEYS)}
+
+def round_robin(n_teams:int)->np.ndarray:
+    """
+    Double round robin with the circle method, shape (rounds, n_teams//2, 2) as (home, away).\n
+    Every team plays once per round, every pair meets once at home and once away.
+    With an odd number of teams the bye is dropped, so those rounds have one game less.
+    """
+    n = n_teams + (n_teams % 2)
+    teams = np.arange(n)
+    rounds = []
+    for r in range(n - 1):
+        rotation = np.concatenate([teams[:1], np.roll(teams[1:], r)])
+        first, second = rotation[:n//2], rotation[n//2:][::-1]
+        # Alternate who is at home so the first half is balanced as well.
+        flip = (np.arange(n//2) + r) % 2 == 1
+        rounds.append(np.where(flip[:, None], np.column_stack([second, first]), np.column_stack([first, second])))
+    first_half = np.stack(rounds)
+    schedule = np.concatenate([first_half, first_half[..., ::-1]])
+    if n != n_teams:
+        # Mark the games against the bye, they are removed when the schedule is flattened.
+        schedule = np.where(schedule == n_teams, -1, schedule)
+    return schedule
+
+class SyntheticLeague:
+    """
+    A generated league.\n
+    home, away:  (games,) team index of the home and away team.
+    ordinals:    (games,) date ordinal of every game, one round robin round per day.
+    stats:       (games, 2, stats) stats of the home (0) and away (1) team in the order of keys, NaN if missing.
+    """
+    def __init__(self, team_names:List[str], home:np.ndarray, away:np.ndarray, ordinals:np.ndarray,
+                 stats:np.ndarray, keys:List[str]=STAT_KEYS, season_id:SeasonID=None) -> None:
+        self.team_names = list(team_names)
+        self.home = home
+        self.away = away
+        self.ordinals = ordinals
+        self.stats = stats
+        self.keys = list(keys)
+        self.season_id = season_id if season_id is not None else SeasonID(number_of_teams=len(team_names))
+        self._team_list = None
+        self._dates:Dict[int,Date] = {}
+    def __len__(self)->int:
+        return len(self.home)
+    @property
+    def team_list(self)->TeamList:
+        """The TeamList with one Team per generated team, created once."""
+        if self._team_list is None:
+            self._team_list = TeamList(season_id=self.season_id)
+            for name in self.team_names:
+                self._team_list.add_team(Team(TeamID(name), self.season_id)) # Interned, the id is the league registry index
+        return self._team_list
+    def _date(self, ordinal:int)->Date:
+        date = self._dates.get(ordinal)
+        if date is None:
+            d = dt.date.fromordinal(int(ordinal))
+            date = self._dates[ordinal] = Date(d.year, d.month, d.day)
+        return date
+    def _stats_dict(self, values:np.ndarray)->Dict[str,Optional[float]]:
+        return {key: (None if value != value else value) for key, value in zip(self.keys, values.tolist())}
+    def games(self, start:int=0, stop:int=None)->Iterator[Game]:
+        """Lazily build Game objects for the games in [start, stop), the teams come from team_list."""
+        teams = self.team_list
+        for i in range(start, len(self) if stop is None else stop):
+            date = self._date(self.ordinals[i])
+            home_stats = GameStats(teams[int(self.home[i])].id, date, self._stats_dict(self.stats[i, 0]), True)
+            away_stats = GameStats(teams[int(self.away[i])].id, date, self._stats_dict(self.stats[i, 1]), False)
+            yield Game(self.season_id, home_stats, away_stats)
+    def results(self)->np.ndarray:
+        """1 for a home win, -1 for an away win and 0 for a tie."""
+        return np.sign(self.stats[:, 0, _KEY["Goals"]] - self.stats[:, 1, _KEY["Goals"]]).astype(np.int8)
+
+def generate_league(n_teams:int=32,
+                    n_games:int=None,
+                    rounds:int=None,
+                    seed:int=None,
+                    start_date:Date=None,
+                    strength_spread:float=0.15,
+                    home_advantage:float=0.05,
+                    missing:float=0.0,
+                    team_names:List[str]=None,
+                    ) -> SyntheticLeague:
+    """
+    Generate a whole league at once.\n
+    Either n_games (cut from repeated double round robins) or rounds (number of round robin rounds) can be given,
+    by default one double round robin is played. missing is the probability that a stat, other than goals,
+    is removed (NaN) like testingfunctions.very_rand_team_stats does.
+    """
+    rng = np.random.default_rng(seed)
+    schedule = round_robin(n_teams)
+    per_cycle = schedule.shape[0]
+    if n_games is not None:
+        games_per_cycle = n_teams * (n_teams - 1)
+        rounds = per_cycle * int(np.ceil(n_games / games_per_cycle))
+    elif rounds is None:
+        rounds = per_cycle
+    cycles = int(np.ceil(rounds / per_cycle))
+    # Shuffle the order of the rounds within every cycle, so the schedule does not repeat exactly.
+    order = np.argsort(rng.random((cycles, per_cycle)), axis=1) + (np.arange(cycles) * per_cycle)[:, None]
+    round_index = order.ravel()[:rounds]
+    games = np.tile(schedule, (cycles, 1, 1))[round_index] # (rounds, games per round, 2)
+    day = np.repeat(np.arange(rounds), games.shape[1])
+    games = games.reshape(-1, 2)
+    keep = games[:, 0] >= 0
+    if n_teams % 2:
+        keep &= games[:, 1] >= 0
+    games, day = games[keep], day[keep]
+    if n_games is not None:
+        games, day = games[:n_games], day[:n_games]
+    home, away = games[:, 0], games[:, 1]
+    start = (start_date.date.date() if start_date is not None else dt.date(2019, 10, 1)).toordinal()
+    ordinals = (start + day).astype(np.int32)
+    # Latent team strength, both teams of a game are drawn from the same model.
+    attack = rng.normal(0.0, strength_spread, n_teams)
+    defence = rng.normal(0.0, strength_spread, n_teams)
+    stats = _draw_stats(rng, attack, defence, home, away, home_advantage)
+    if missing > 0:
+        drop = rng.random(stats.shape) < missing
+        drop[..., [_KEY[key] for key in ALWAYS_PRESENT]] = False
+        # Keep the mirrored fields consistent, a missing stat is missing for both teams.
+        for key, other in MIRRORED.items():
+            both = drop[:, 0, _KEY[key]] | drop[:, 1, _KEY[other]]
+            drop[:, 0, _KEY[key]] = both
+            drop[:, 1, _KEY[other]] = both
+        stats[drop] = np.nan
+    names = team_names if team_names is not None else [f"Team {i}" for i in range(n_teams)]
+    return SyntheticLeague(names, home, away, ordinals, stats)
+
+def _draw_stats(rng:np.random.Generator, attack:np.ndarray, defence:np.ndarray,
+                home:np.ndarray, away:np.ndarray, home_advantage:float)->np.ndarray:
+    n = len(home)
+    # Side 0 is the home team, side 1 the away team. "own" is the team, "opp" the opponent.
+    own = np.stack([home, away], axis=1)
+    opp = own[:, ::-1]
+    edge = attack[own] - defence[opp]
+    edge[:, 0] += home_advantage
+    # Powerplays drawn by the team, the opponent is the one taking the penalty.
+    pp_opportunities = rng.poisson(3.2 * np.exp(0.5 * edge))
+    pp_goals = rng.binomial(pp_opportunities, np.clip(0.19 * np.exp(edge), 0.05, 0.5))
+    # Short handed goals are scored during the opponent's powerplays.
+    sh_goals = rng.binomial(pp_opportunities[:, ::-1], 0.02)
+    shots = rng.poisson(30.0 * np.exp(edge))
+    even_strength = rng.binomial(np.maximum(shots - pp_opportunities, 0), np.clip(0.075 * np.exp(edge), 0.01, 0.3))
+    goals = even_strength + pp_goals + sh_goals
+    faceoffs = rng.poisson(58.0, n)
+    faceoffs_won_home = rng.binomial(faceoffs, np.clip(0.5 + 0.5 * (edge[:, 0] - edge[:, 1]), 0.2, 0.8))
+    faceoffs_won = np.column_stack([faceoffs_won_home, faceoffs - faceoffs_won_home])
+    penalty_minutes = 2 * pp_opportunities[:, ::-1] + 2 * rng.poisson(0.3, (n, 2)) # Matching minors add minutes without powerplays
+    stats = np.empty((n, 2, len(STAT_KEYS)))
+    stats[..., _KEY["Goals"]] = goals
+    stats[..., _KEY["Goals Against"]] = goals[:, ::-1]
+    stats[..., _KEY["Shots"]] = shots
+    stats[..., _KEY["Shots againts"]] = shots[:, ::-1]
+    stats[..., _KEY["Hits"]] = rng.poisson(22.0 * np.exp(-0.5 * edge))
+    stats[..., _KEY["Blocks"]] = rng.poisson(14.0 * np.exp(-0.5 * edge))
+    stats[..., _KEY["Faceoffs Won"]] = faceoffs_won
+    stats[..., _KEY["Faceoffs Lost"]] = faceoffs_won[:, ::-1]
+    stats[..., _KEY["Powerplay Goals"]] = pp_goals
+    stats[..., _KEY["Powerplay Goals Against"]] = sh_goals[:, ::-1]
+    stats[..., _KEY["Boxplay Goals"]] = sh_goals
+    stats[..., _KEY["Boxplay Goals Against"]] = pp_goals[:, ::-1]
+    stats[..., _KEY["Powerplay Opportunities"]] = pp_opportunities
+    stats[..., _KEY["Boxplay Opportunities"]] = pp_opportunities[:, ::-1]
+    stats[..., _KEY["Penalty Minutes"]] = penalty_minutes
+    stats[..., _KEY["Penalty Minutes Drawn"]] = penalty_minutes[:, ::-1]
+    return stats
@@ -0,0 +1,150 @@
+# This file contains the cumulative per date tables of a Season, shared by stats_to_pandas, the SeasonVisualizer and notebooks.
+# Path: DataRepresentations\Tables.py
+# Everything is computed from the columnar GameStore: the games are bucketed per (date, team, split) once and
+# cumulative sums over the dates give every stat as of every played date. The arrays are cached until the
+# season changes (Season.version or the number of games).
+#   tables = season.tables
+#   tables.values("Goals", per_game=True)                    # (dates, teams)
+#   tables.frame(["Goals", "Win%", "Streak"], layout="tidy")  # One row per date and team
+from typing import List, Dict, Tuple, Union, Optional
+import numpy as np
+from .Storage import HOME, AWAY
+from .Lazy import lazy_import
+pd = lazy_import("pandas")
+
+SPLITS = ["total", "home", "away"]
+RECORD_STATS = ["Games", "Wins", "Losses", "Ties"] # Counted from the results
+RATIO_STATS = ["Win%"]                             # Wins per game, whatever per_game is
+STREAK = "Streak"                                  # Same convention as Record.streak, only for the total split
+
+class SeasonTables:
+    def __init__(self, season) -> None:
+        self.season = season
+        self._key = None
+        self._stats:Dict[str,np.ndarray] = {} # Stat -> cumulative (dates, teams, split)
+    def _refresh(self)->None:
+        store = self.season.store
+        key = (self.season.version, store.size, len(store.keys))
+        if key == self._key:
+            return
+        self.season.sort_games()
+        ordinals, day = np.unique(store.ordinals, return_inverse=True)
+        self._ordinals = ordinals
+        self._team_names = list(self.season.team_list.team_names)
+        self._day = day
+        self._positions = self.season.team_positions() # (games, side)
+        self._stats = {}
+        self._streak = None
+        self._key = key
+    def _cumulate(self, per_side:np.ndarray)->np.ndarray:
+        """per_side (games, side) values -> cumulative (dates, teams, split)."""
+        increments = np.zeros((len(self._ordinals), len(self._team_names), len(SPLITS)))
+        for side, split in ((HOME, 1), (AWAY, 2)):
+            np.add.at(increments, (self._day, self._positions[:, side], 0), per_side[:, side])
+            np.add.at(increments, (self._day, self._positions[:, side], split), per_side[:, side])
+        return np.cumsum(increments, axis=0)
+    def _base(self, stat:str)->np.ndarray:
+        cumulative = self._stats.get(stat)
+        if cumulative is not None:
+            return cumulative
+        store = self.season.store
+        results = store.results.astype(int)[:, None] * np.array([1, -1])
+        if stat == "Games":
+            per_side = np.ones((store.size, 2))
+        elif stat == "Wins":
+            per_side = results > 0
+        elif stat == "Losses":
+            per_side = results < 0
+        elif stat == "Ties":
+            per_side = results == 0
+        elif stat in store._key_index:
+            key = store._key_index[stat]
+            per_side = np.where(store.game_present[..., key], store.game_stats[..., key], 0.0)
+        else:
+            raise ValueError(f"Unknown stat {stat}, the season has {store.keys + RECORD_STATS + RATIO_STATS + [STREAK]}")
+        cumulative = self._cumulate(per_side.astype(float))
+        self._stats[stat] = cumulative
+        return cumulative
+    def _streaks(self)->np.ndarray:
+        # Streak after every game of every team, then carried forward to the dates without a game.
+        if self._streak is not None:
+            return self._streak
+        store = self.season.store
+        n_dates, n_teams = len(self._ordinals), len(self._team_names)
+        outcome = (store.results.astype(int)[:, None] * np.array([1, -1])).ravel()
+        teams = self._positions.ravel()
+        days = np.repeat(self._day, 2)
+        order = np.lexsort((np.arange(len(teams)), teams)) # Per team, in game order
+        teams, days, outcome = teams[order], days[order], outcome[order]
+        # A new run starts at every new team or change of outcome, the streak is the signed position in the run.
+        start = np.ones(len(teams), dtype=bool)
+        start[1:] = (teams[1:] != teams[:-1]) | (outcome[1:] != outcome[:-1])
+        run_start = np.maximum.accumulate(np.where(start, np.arange(len(teams)), 0))
+        streak = outcome * (np.arange(len(teams)) - run_start + 1)
+        grid = np.zeros((n_dates, n_teams))
+        played = np.zeros((n_dates, n_teams), dtype=bool)
+        valid = teams >= 0
+        grid[days[valid], teams[valid]] = streak[valid]
+        played[days[valid], teams[valid]] = True
+        # Forward fill the last played date of every team.
+        last = np.maximum.accumulate(np.where(played, np.arange(n_dates)[:, None], -1), axis=0)
+        self._streak = np.where(last >= 0, np.take_along_axis(grid, np.maximum(last, 0), axis=0), 0.0)
+        return self._streak
+    def values(self, stat:str, split:str="total", per_game:bool=False)->np.ndarray:
+        """The stat of every team (team_list order) up to and including every played date, (dates, teams)."""
+        assert split in SPLITS, f"Split must be one of {SPLITS}, not {split}"
+        self._refresh()
+        if stat.lower() in ["win%","win percentage"]:
+            stat = "Win%"
+        if stat == STREAK:
+            assert split == "total", "The streak is only kept over all games"
+            return self._streaks()
+        s = SPLITS.index(split)
+        if stat in RATIO_STATS:
+            totals, per_game = self._base("Wins")[..., s], True
+        else:
+            totals = self._base(stat)[..., s]
+        if per_game:
+            games = self._base("Games")[..., s]
+            return np.divide(totals, games, out=np.zeros_like(totals), where=games > 0)
+        return totals
+    def cube(self, stats:List[str], split:str="total", per_game:bool=False)->np.ndarray:
+        """(dates, teams, stats)"""
+        return np.stack([self.values(stat, split, per_game) for stat in stats], axis=-1)
+    @property
+    def ordinals(self)->np.ndarray:
+        """The played dates as ordinals, the first axis of every table."""
+        self._refresh()
+        return self._ordinals
+    @property
+    def team_names(self)->List[str]:
+        """The teams in the order of the second axis of every table."""
+        self._refresh()
+        return self._team_names
+    @property
+    def dates(self)->List[str]:
+        return [str(self.season.store.date(ordinal)) for ordinal in self.ordinals]
+    def frame(self, stats:Union[str,List[str]], split:str="total", per_game:bool=False, layout:str="wide")->"pd.DataFrame":
+        """
+        The stats of every team as of every played date.\n
+        wide: one row per date, a "Date" column and one column per team for a single stat,
+              otherwise indexed by date with (stat, team) columns.
+        tidy: one row per date and team with "Date", "Team" and one column per stat.
+        """
+        assert layout in ["wide", "tidy"], f"Layout must be 'wide' or 'tidy', not {layout}"
+        single = isinstance(stats, str)
+        stats = [stats] if single else list(stats)
+        cube = self.cube(stats, split, per_game)
+        dates, teams = self.dates, self._team_names
+        if layout == "tidy":
+            n_dates, n_teams = cube.shape[:2]
+            df = pd.DataFrame(cube.reshape(n_dates * n_teams, len(stats)), columns=stats)
+            df.insert(0, "Team", np.tile(np.array(teams, dtype=object), n_dates))
+            df.insert(0, "Date", np.repeat(np.array(dates, dtype=object), n_teams))
+            return df
+        if single:
+            df = pd.DataFrame(cube[..., 0], columns=teams)
+            df.insert(0, "Date", dates)
+            return df
+        columns = pd.MultiIndex.from_product([stats, teams], names=["Stat", "Team"])
+        return pd.DataFrame(cube.transpose(0, 2, 1).reshape(len(dates), -1), index=pd.Index(dates, name="Date"), columns=columns)
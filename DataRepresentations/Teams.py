@@ -7,13 +7,15 @@
 from dataclasses import dataclass
 from typing import List,Dict, Union, Tuple, Optional, TypeVar
 import numpy as np
-import pandas as pd
 import os
 import sys
 import re
 import datetime as dt
-import matplotlib.pyplot as plt
-from .Representations import Record, SeasonID, TeamID,Game, GameStats,TeamStats,Date,Stats,DateList,GameResult
+from .Lazy import lazy_import
+pd = lazy_import("pandas")
+plt = lazy_import("matplotlib.pyplot")
+from .Representations import Record, SeasonID, TeamID,Game, GameStats,TeamStats,Date,Stats,DateList,GameResult, TeamRegistry, LEAGUE
+from .Profiling import instrument
 """
 Team specific features:
 * Powerplay precentage up to that point in the season (PP%)
@@ -131,6 +133,7 @@ class Team:
             self.played_dates_home.add_date(date)
         else:
             self.played_dates_away.add_date(date)
+    @instrument("Team.add_game")
     def add_game(self, game:Game)->GameResult:
         """ Adds a game to the team. Returns the result of the game, 1 for win, 0 for tie and -1 for loss."""
         assert self.id in game.teams, f"{self.id} is not in {game.teams}"
@@ -139,6 +142,13 @@ class Team:
         result = self.record.add_game(game.date, game) # Counts the wins, losses and ties.
         self.team_stats.add_game(game, home) # Adds the stats of the game to the team.
         return result
+    def truncate(self, date:Date)->None:
+        """ Removes all the games on or after the date, used when a Season replays its games from that date."""
+        self.played_dates.truncate(date)
+        self.played_dates_home.truncate(date)
+        self.played_dates_away.truncate(date)
+        self.record.truncate(date)
+        self.team_stats.truncate(date)
     def get_game_stats(self, occasion:Union[Date,Game])->GameStats:
         if isinstance(occasion, Date):
             date = occasion
@@ -192,21 +202,44 @@ class Team:
         return f"{self.name} ({self.id}) - {self.season_id} - {self.record}"
     def __repr__(self) -> str:
         return f"Team({self.id}, {self.season_id})"
-    def plot(self, metric="Total",title:str=None, xlabel:str=None, ylabel:str=None, **kwargs)->Tuple[plt.Figure,plt.Axes]:
+    def plot(self, metric="Total",title:str=None, xlabel:str=None, ylabel:str=None, **kwargs)->Tuple["plt.Figure","plt.Axes"]:
         fig,axs= self.team_stats.plot(metric=metric,title=title, xlabel=xlabel, ylabel=ylabel, **kwargs)        
         plt.show()
         return fig,axs
 class TeamList:
     TL = TypeVar("TL", bound="TeamList")
-    def __init__(self,teams:Optional[List[Team]]=None,season_id:SeasonID=None) -> None:
-        self.teams = teams if teams is not None else []
+    def __init__(self,teams:Optional[List[Team]]=None,season_id:SeasonID=None,registry:TeamRegistry=None) -> None:
+        self.registry = registry if registry is not None else LEAGUE
+        self.teams = []
         self.team_dict = OrderedDict()
-        self.season_id = season_id if season_id is not None else SeasonID(number_of_teams=len(self.teams))
+        self._members = np.zeros(0, dtype=bool) # Registry index -> in the list
+        self._nameless = set() # ids of the nameless teams, which are not in the registry
+        self.season_id = season_id if season_id is not None else SeasonID(number_of_teams=len(teams or []))
+        for team in teams or []:
+            self.add_team(team)
     def add_team(self, team:Team):
-        if team not in self.teams:
+        if not team.id.named: # Kept in the list but with no league index, so it can not be used in a Season.
+            if team.id.id not in self._nameless:
+                self._nameless.add(team.id.id)
+                self.teams.append(team)
+                self.team_dict[team.id] = team
+                self.season_id.number_of_teams = len(self.teams)
+            return
+        index = self.registry.index(team.id)
+        if index >= len(self._members):
+            self._members = np.concatenate([self._members, np.zeros(max(index + 1 - len(self._members), len(self._members)), dtype=bool)])
+        if not self._members[index]:
+            self._members[index] = True
             self.teams.append(team)
             self.team_dict[team.id] = team
             self.season_id.number_of_teams = len(self.teams)
+    def index(self, team:Union[Team,TeamID,str])->int:
+        """The registry index of the team, the same in every season of the league."""
+        return self.registry.index(team.id if isinstance(team, Team) else team)
+    @property
+    def indices(self)->np.ndarray:
+        """The registry indices of the teams, in list order."""
+        return self.registry.indices([team.id for team in self.teams])
     def sort_by_id(self,in_place:bool=False)->Union[List[Team],None]:
         # return self.teams.sort(key=lambda x: x.id) # Inplace sort
         if in_place:
@@ -287,8 +320,12 @@ class TeamList:
         return len(self.teams)
     def __iter__(self):
         return iter(self.teams)
-    def __contains__(self, item):
-        return item in self.teams
+    def __contains__(self, item:Union[Team,TeamID,str]):
+        team = item.id if isinstance(item, Team) else item
+        if isinstance(team, TeamID) and not team.named:
+            return team.id in self._nameless
+        index = self.registry.find(team)
+        return index is not None and index < len(self._members) and bool(self._members[index])
     def __eq__(self, __o: object) -> bool:
         raise NotImplementedError("Not implemented yet.")
     def __repr__(self):
@@ -0,0 +1,240 @@
+# This is a file which contains the cache of the parsed boxscores, so scraped history is only ever parsed once.
+# Path: DataScraping/boxscores.py
+#
+#   The html cache (telemetry.fetch) saves the downloads, this cache saves the BeautifulSoup/pd.read_html work.
+#   An entry is the home and away stats of one boxscore, keyed by the sha256 of the page's html.
+#   The entries of a season are stored columnar, every flush appends one shard file per parser tag:
+#       <root>/<season>-<parser tag>.<shard>.npz  with digests (games,), values (games, side, keys), kinds (games, side, keys),
+#                                                  keys, types and objects
+#   kinds is the index of the type of every value in types (e.g. "builtins.int", "numpy.float64"), -1 where the page has
+#   no such stat, so get gives back the values with the types the parser made. Values which are not numbers are kept
+#   as json in objects. Flushing only writes the new entries, compact merges the shards of a season into one.
+#   The parser tag is a hash of the source of the parsing code, see parser_tag, so any change to it starts new files
+#   and the old entries are never used again (prune removes them).
+#   Pending entries are flushed by prefetch, by flush and when the interpreter exits.
+#       cache = BoxscoreCache("boxscores", "NHL_2023", PARSER_TAG)
+#       WebSeason(url, parse_cache_dir="boxscores").prefetch()  # Parses only the pages not seen before
+import os
+import json
+import time
+import atexit
+import hashlib
+import inspect
+import weakref
+import threading
+from typing import List, Dict, Tuple, Union, Optional, Any, Callable
+import numpy as np
+
+MISSING = -1 # Kind of a stat the page does not have
+NUMBERS = (int, float, np.integer, np.floating, np.bool_)
+_open_caches = weakref.WeakSet() # Flushed at exit
+
+def parser_tag(*parts:Union[Callable,str])->str:
+    """Short hash of the source of the parsing functions (and any extra strings, e.g. a version number or constants)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update((part if isinstance(part, str) else inspect.getsource(part)).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+def html_digest(html:str)->str:
+    return hashlib.sha256(html.encode("utf-8")).hexdigest()
+
+def _type_name(value:Any)->str:
+    return f"{type(value).__module__}.{type(value).__qualname__}"
+
+def _is_number(type_name:str)->bool:
+    return type_name.startswith("numpy.") or type_name in ("builtins.int", "builtins.float", "builtins.bool")
+
+def _restore(type_name:str, value:float)->Any:
+    module, name = type_name.split(".", 1)
+    return getattr(np, name)(value) if module == "numpy" else {"int": int, "float": float, "bool": bool}[name](value)
+
+def _cacheable(value:Any)->bool:
+    # Numbers, None and values which come back from json unchanged.
+    if value is None or isinstance(value, NUMBERS):
+        return True
+    try:
+        restored = json.loads(json.dumps(value))
+    except (TypeError, ValueError):
+        return False
+    return type(restored) is type(value) and restored == value
+
+class BoxscoreCache:
+    def __init__(self, root:str, season:str, tag:str) -> None:
+        """
+        The parsed boxscores of a season.
+
+        Parameters
+        ----------
+        root : str
+            Directory of the cache files
+        season : str
+            Name of the season, e.g. NHL_2023, one set of shard files per season
+        tag : str
+            The parser tag, see parser_tag
+        """
+        self.root = root
+        self.season = season
+        self.tag = tag
+        self.prefix = f"{season}-{tag}"
+        self.keys:List[str] = []
+        self._key_index:Dict[str,int] = {}
+        self.types:List[str] = []
+        self._type_index:Dict[str,int] = {}
+        self._rows:Dict[str,int] = {} # digest -> row of the arrays
+        self._values = np.zeros((0, 2, 0))
+        self._kinds = np.full((0, 2, 0), MISSING, dtype=np.int16)
+        self._objects:Dict[Tuple[int,int,str],Any] = {} # (row, side, key) -> value which is not a number
+        self._pending:Dict[str,Tuple[Dict[str,Any],Dict[str,Any]]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        for path in self.shards():
+            self._read(path)
+        _open_caches.add(self)
+    def shards(self)->List[str]:
+        """The shard files of this season and parser tag, oldest first."""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(os.path.join(self.root, name) for name in os.listdir(self.root) if name.startswith(self.prefix + ".") and name.endswith(".npz"))
+    def _read(self, path:str)->None:
+        with np.load(path) as data:
+            self._append(data["digests"].tolist(), json.loads(str(data["keys"])), json.loads(str(data["types"])),
+                         data["values"], data["kinds"], json.loads(str(data["objects"])))
+    def _append(self, digests:List[str], keys:List[str], types:List[str], values:np.ndarray, kinds:np.ndarray,
+                objects:List[Tuple[int,int,str,Any]])->None:
+        # Add the rows of a shard, its keys and types are mapped onto the ones of the cache.
+        for key in keys:
+            if key not in self._key_index:
+                self._key_index[key] = len(self.keys)
+                self.keys.append(key)
+        for type_name in types:
+            if type_name not in self._type_index:
+                self._type_index[type_name] = len(self.types)
+                self.types.append(type_name)
+        new = [i for i, digest in enumerate(digests) if digest not in self._rows] # Another process may have flushed it too
+        start, n_keys = len(self._rows), len(self.keys)
+        columns = [self._key_index[key] for key in keys]
+        type_map = np.array([self._type_index[type_name] for type_name in types] + [MISSING], dtype=np.int16) # -1 stays -1
+        block = np.zeros((len(new), 2, n_keys))
+        block_kinds = np.full((len(new), 2, n_keys), MISSING, dtype=np.int16)
+        block[:, :, columns] = values[new]
+        block_kinds[:, :, columns] = type_map[kinds[new]]
+        pad = [(0, 0), (0, 0), (0, n_keys - self._values.shape[-1])]
+        self._values = np.concatenate([np.pad(self._values, pad), block])
+        self._kinds = np.concatenate([np.pad(self._kinds, pad, constant_values=MISSING), block_kinds])
+        rows = {i: start + j for j, i in enumerate(new)}
+        for i in new:
+            self._rows[digests[i]] = rows[i]
+        for row, side, key, value in objects:
+            if row in rows:
+                self._objects[(rows[row], side, key)] = value
+    def __len__(self)->int:
+        return len(self._rows) + len(self._pending)
+    def __contains__(self, digest:str)->bool:
+        return digest in self._rows or digest in self._pending
+    def get(self, digest:str)->Optional[Tuple[Dict[str,Any],Dict[str,Any]]]:
+        """The (home, away) stats of the page with the digest, with the types they were put with, None if it was not parsed before."""
+        with self._lock:
+            pending = self._pending.get(digest)
+            row = self._rows.get(digest)
+            if pending is None and row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if pending is not None:
+                return dict(pending[0]), dict(pending[1])
+            return self._entry(row)
+    def _entry(self, row:int)->Tuple[Dict[str,Any],Dict[str,Any]]:
+        values, kinds = self._values[row].tolist(), self._kinds[row].tolist()
+        stats = ({}, {})
+        for side in range(2):
+            for key, kind, value in zip(self.keys, kinds[side], values[side]):
+                if kind == MISSING:
+                    continue
+                type_name = self.types[kind]
+                stats[side][key] = None if type_name == "builtins.NoneType" else _restore(type_name, value) if _is_number(type_name) else self._objects[(row, side, key)]
+        return stats
+    def put(self, digest:str, home_stats:Dict[str,Any], away_stats:Dict[str,Any])->bool:
+        """
+        Add the parsed stats of a page, kept in memory until flush.\n
+        Stats which are not numbers are kept if they come back from json unchanged, otherwise the page is not cached.
+        """
+        if digest in self._rows:
+            return True
+        if not all(_cacheable(value) for stats in (home_stats, away_stats) for value in stats.values()):
+            return False
+        with self._lock:
+            self._pending[digest] = (dict(home_stats), dict(away_stats))
+        return True
+    def _write(self, digests:List[str], entries:List[Tuple[Dict[str,Any],Dict[str,Any]]], path:str)->Tuple[List[str],List[str],np.ndarray,np.ndarray,list]:
+        # One shard with the entries, written next to the path and renamed.
+        keys = list(dict.fromkeys(key for entry in entries for stats in entry for key in stats))
+        key_index = {key: i for i, key in enumerate(keys)}
+        types:List[str] = []
+        type_index:Dict[str,int] = {}
+        values = np.zeros((len(entries), 2, len(keys)))
+        kinds = np.full((len(entries), 2, len(keys)), MISSING, dtype=np.int16)
+        objects = []
+        for row, entry in enumerate(entries):
+            for side, stats in enumerate(entry):
+                for key, value in stats.items():
+                    type_name = _type_name(value)
+                    if type_name not in type_index:
+                        type_index[type_name] = len(types)
+                        types.append(type_name)
+                    column = key_index[key]
+                    kinds[row, side, column] = type_index[type_name]
+                    if isinstance(value, NUMBERS):
+                        values[row, side, column] = value
+                    elif value is not None:
+                        objects.append((row, side, key, value))
+        os.makedirs(self.root, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, digests=np.array(digests), values=values, kinds=kinds, keys=np.array(json.dumps(keys)),
+                     types=np.array(json.dumps(types)), objects=np.array(json.dumps(objects)))
+        os.replace(tmp, path)
+        return keys, types, values, kinds, objects
+    def _shard_path(self)->str:
+        return os.path.join(self.root, f"{self.prefix}.{time.time_ns():020d}-{os.getpid()}-{threading.get_ident()}.npz")
+    def flush(self)->None:
+        """Write the new entries to a new shard file, O(new entries), the existing shards are not touched."""
+        with self._lock:
+            if not self._pending:
+                return
+            digests, entries = list(self._pending), list(self._pending.values())
+            keys, types, values, kinds, objects = self._write(digests, entries, self._shard_path())
+            self._append(digests, keys, types, values, kinds, objects)
+            self._pending = {}
+    def compact(self)->None:
+        """Merge the shards of the season into one file, rewriting every entry. Worth it when many small flushes made many shards."""
+        self.flush()
+        with self._lock:
+            old = self.shards()
+            if len(old) < 2:
+                return
+            digests = sorted(self._rows, key=self._rows.get)
+            self._write(digests, [self._entry(self._rows[digest]) for digest in digests], self._shard_path())
+            for path in old:
+                os.remove(path)
+    def arrays(self)->Tuple[List[str],np.ndarray,np.ndarray,List[str]]:
+        """The columnar entries: (digests, values (games, side, keys), present (games, side, keys), keys), pending entries flushed first."""
+        self.flush()
+        numbers = np.array([_is_number(type_name) for type_name in self.types] + [False]) # kinds of -1 index the last
+        return sorted(self._rows, key=self._rows.get), self._values, numbers[self._kinds], self.keys
+    def prune(self)->List[str]:
+        """Remove the files of this season made by other parser tags."""
+        removed = []
+        if not os.path.isdir(self.root):
+            return removed
+        for name in os.listdir(self.root):
+            if name.startswith(f"{self.season}-") and name.endswith(".npz") and not name.startswith(self.prefix + "."):
+                os.remove(os.path.join(self.root, name))
+                removed.append(name)
+        return removed
+
+@atexit.register
+def _flush_open_caches()->None:
+    for cache in list(_open_caches):
+        cache.flush()
@@ -6,18 +6,24 @@
 #   These classes are used to represent the data while the data is being scraped from the web.
 #   Examples of these classes are:
 #   - WebSeason - A class which represents a season of an entire season. Should hold all links to all games of the season.
-#   - WebGame - A class which represents a game of a season. Should hold all the raw data of the game.
+#   - WebGame - A class which represents a game of a season. Should hold all the raw data of the game, fetched and parsed lazily.
+#   - prefetch - Fetch (and parse) the boxscores of many games in a batch.
 #   - WebPlayer - A class which represents a player of a game. Should hold all the raw data of the player.
 import requests
 from bs4 import BeautifulSoup
 import json
 import re
 import os
+import io
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Tuple, Union, Optional, Any
 from bs4 import BeautifulSoup
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from DataScraping.utils import get_soup
+from DataScraping.utils import get_soup, get_html
+from DataScraping.telemetry import ScrapeMetrics, METRICS
+from DataScraping.boxscores import BoxscoreCache, parser_tag, html_digest
 import pandas as pd
 from tqdm import tqdm
 # Constants
@@ -31,9 +37,11 @@ TOI_KEY = "Unnamed: 17_level_0"
 # Advanced stat keys for the advanced stats
 ADVANCED_KEYS = ["ALLAll","ALL5v5","ALLEV","ALLPP","ALLSH","CLAll","CL5v5"]
 class WebGame:
-    def __init__(self,url:str,home_team:str,away_team:str,verbose:bool=False):
+    def __init__(self,url:str,home_team:str,away_team:str,verbose:bool=False,metrics:ScrapeMetrics=None,cache_dir:str=None,parse_cache:BoxscoreCache=None):
         """
         A class which represents a game of a season. Should hold all the raw data of the game.
+        The game is a lazy handle: url, home_team and away_team are available right away, the boxscore is only
+        fetched and parsed when the stats (or the tables/soup) are first accessed, or in a batch with prefetch.
         
         Parameters
         ----------
@@ -41,24 +49,84 @@ class WebGame:
             The url of the game to get the data from. Should be in form of https://www.hockey-reference.com/boxscores/xxxxxxxx.html
         verbose : bool, optional
             If the class should be verbose, by default False
+        metrics : ScrapeMetrics, optional
+            Where the request and parse times are recorded, by default telemetry.METRICS
+        cache_dir : str, optional
+            Directory of the html cache, by default no cache
+        parse_cache : BoxscoreCache, optional
+            Where the parsed stats are looked up (by the hash of the html) before the page is parsed, by default none.
+            New entries are written by prefetch, BoxscoreCache.flush or when the interpreter exits.
         """
         self.url = url   
-        self.game = get_soup(self.url)
+        self.metrics = metrics if metrics is not None else METRICS
+        self.cache_dir = cache_dir
+        self.parse_cache = parse_cache
         self.verbose = verbose
         self.home_team:str = home_team
         self.away_team:str = away_team
-        self.home_stats:Dict[str,Any] = {}
-        self.away_stats:Dict[str,Any] = {}
-        self.regular_tables = None
-        self.advanced_tables = []
-        self._get_tables()
+        self._html:str = None
+        self._game:BeautifulSoup = None
+        self._home_stats:Dict[str,Any] = {}
+        self._away_stats:Dict[str,Any] = {}
+        self._regular_tables = None
+        self._advanced_tables = []
+        self._loaded = False
+        self._lock = threading.Lock() # prefetch may parse the game in another thread
+    def fetch(self)->str:
+        """Get the html of the boxscore (once), without parsing it."""
+        if self._html is None:
+            self._html = get_html(self.url,verbose=self.verbose,metrics=self.metrics,cache_dir=self.cache_dir)
+        return self._html
+    def load(self)->"WebGame":
+        """Fetch and parse the boxscore, only the first call does any work."""
+        with self._lock:
+            if not self._loaded:
+                digest = html_digest(self.fetch()) if self.parse_cache is not None else None
+                cached = self.parse_cache.get(digest) if digest is not None else None
+                if cached is not None:
+                    self._home_stats, self._away_stats = cached
+                else:
+                    self._get_tables()
+                    self._get_game_info()
+                    if digest is not None:
+                        self.parse_cache.put(digest,self._home_stats,self._away_stats)
+                self._loaded = True
+        return self
+    @property
+    def loaded(self)->bool:
+        return self._loaded
+    @property
+    def game(self)->BeautifulSoup:
+        if self._game is None:
+            html = self.fetch()
+            with self.metrics.stage("soup"):
+                self._game = BeautifulSoup(html,'html.parser')
+        return self._game
+    @property
+    def regular_tables(self)->list:
+        with self._lock:
+            if self._regular_tables is None: # Also when the stats came from the parse cache
+                self._get_tables()
+        return self._regular_tables
+    @property
+    def advanced_tables(self)->list:
+        self.regular_tables # Built together
+        return self._advanced_tables
+    @property
+    def home_stats(self)->Dict[str,Any]:
+        return self.load()._home_stats
+    @property
+    def away_stats(self)->Dict[str,Any]:
+        return self.load()._away_stats
     def _get_tables(self):
         """
         Get all the tables of the game, modifies self.tables
         """
-        self.regular_tables = self.game.find_all('table',id=re.compile(r'(\w+)_skaters'))
-        for advanced_key in ADVANCED_KEYS:
-            self.advanced_tables.append((advanced_key,self.game.find_all('table',id=re.compile(r'(\w+)_'+advanced_key))))
+        with self.metrics.stage("get_tables"):
+            self._regular_tables = self.game.find_all('table',id=re.compile(r'(\w+)_skaters'))
+            self._advanced_tables = []
+            for advanced_key in ADVANCED_KEYS:
+                self._advanced_tables.append((advanced_key,self.game.find_all('table',id=re.compile(r'(\w+)_'+advanced_key))))
         
     def _get_game_info(self):
         """
@@ -74,28 +142,35 @@ class WebGame:
         """
         key = "reg"
         # Find all the tables of the form 'xxx_skaters' and 'xxx_goalies'
-        home_stats = self._process_table(key,self.regular_tables[0])
-        away_stats = self._process_table(key,self.regular_tables[1])
-        # Add goals against
+        home_stats = self._process_table(key,self._regular_tables[0])
+        away_stats = self._process_table(key,self._regular_tables[1])
+        # Add goals and goals against
+        home_stats["Goals"] = home_stats[key+"_Goals"]
+        away_stats["Goals"] = away_stats[key+"_Goals"]
         home_stats["Goals Against"] = away_stats["Goals"]
         away_stats["Goals Against"] = home_stats["Goals"]
         # Add shots against
         home_stats[key+"_SA"] = away_stats[key+"_S"]
         away_stats[key+"_SA"] = home_stats[key+"_S"]
+        self._home_stats.update(home_stats)
+        self._away_stats.update(away_stats)
 
     def _get_advanced_stats(self):
-        for advanced_key,advanced_table in self.advanced_tables:
+        for advanced_key,advanced_table in self._advanced_tables:
             home_adv = self._process_table(advanced_key,advanced_table[0])
             away_adv = self._process_table(advanced_key,advanced_table[1])
-            self.home_stats.update(home_adv)
-            self.away_stats.update(away_adv)
+            self._home_stats.update(home_adv)
+            self._away_stats.update(away_adv)
     def _process_table(self,key:str,table_soup:BeautifulSoup)->Dict[str,Any]:
         """
         Process the advanced table of the game.
         """
+        with self.metrics.stage("process_table"):
+            return self._read_totals(key,table_soup)
+    def _read_totals(self,key:str,table_soup:BeautifulSoup)->Dict[str,Any]:
         temp_dict = {}
         # Read the table into a pandas dataframe
-        df = pd.read_html(str(table_soup))[0]
+        df = pd.read_html(io.StringIO(str(table_soup)))[0]
         ### Remove the redundant columns ###
         df.pop("Scoring")
         df.pop("Assists")
@@ -116,11 +191,52 @@ class WebGame:
         return temp_dict
     def __str__(self) -> str:
         return f"WebGame({self.url}) {self.home_team} vs {self.away_team} {self.home_stats['reg_Goals']} - {self.away_stats['reg_Goals']}"
+    def __repr__(self) -> str:
+        return f"WebGame({self.url}, {self.home_team}, {self.away_team}, loaded={self._loaded})" # Never fetches
+
+# Changes whenever the parsing code (or the keys it looks for) changes, so stale parsed boxscores are never used.
+PARSER_TAG = parser_tag(WebGame._get_tables,WebGame._get_game_info,WebGame._get_normal_stats,WebGame._get_advanced_stats,
+                        WebGame._read_totals,repr((PM_KEY,PLAYER_KEY,SHOT_KEY,SHOT_PERCENTAGE_KEY,SHIFT_KEY,TOI_KEY,ADVANCED_KEYS)))
+
+def _try(function)->Optional[Exception]:
+    try:
+        function()
+    except Exception as error: # Reported for the whole batch by prefetch
+        return error
+    return None
+
+def prefetch(games:List[WebGame],max_workers:int=8,parse:bool=True,progress:bool=False)->List[WebGame]:
+    """
+    Fetch the boxscores of the games in a batch, max_workers requests at a time (fetch keeps a session per thread).
+    With parse the games are parsed as well, in the calling thread since parsing is bound by the GIL,
+    and the parse caches of the games are flushed.
+    Games which were already fetched/parsed are skipped, so after a failure calling it again only retries the failed games.
+    A game which fails does not stop the batch: the other games are fetched, parsed and flushed,
+    then a RuntimeError lists the failed urls (chained from the first error).
+    """
+    pending = [game for game in games if game._html is None and not game.loaded]
+    failures:Dict[str,Exception] = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        errors = pool.map(lambda game: _try(game.fetch),pending)
+        for game,error in tqdm(zip(pending,errors),total=len(pending),disable=not progress):
+            if error is not None:
+                failures[game.url] = error
+    if parse:
+        for game in tqdm(games,disable=not progress):
+            if game.url not in failures:
+                error = _try(game.load)
+                if error is not None:
+                    failures[game.url] = error
+        for cache in {id(game.parse_cache):game.parse_cache for game in games if game.parse_cache is not None}.values():
+            cache.flush()
+    if failures:
+        report = "\n".join(f"  {url}: {type(error).__name__}: {error}" for url,error in failures.items())
+        raise RuntimeError(f"{len(failures)} of {len(games)} boxscores failed:\n{report}") from next(iter(failures.values()))
+    return games
 
-        
 
 class WebSeason:
-    def __init__(self,url:str,verbose:bool=False):
+    def __init__(self,url:str,verbose:bool=False,metrics:ScrapeMetrics=None,cache_dir:str=None,parse_cache_dir:str=None):
         """
         A class which represents a season of an entire season. Should hold all links to all games of the season.
         
@@ -130,27 +246,45 @@ class WebSeason:
             The season to get the games from. Should be in form of https://www.hockey-reference.com/leagues/NHL_xxxx.html
             verbose : bool, optional
             If the class should be verbose, by default False
+        metrics : ScrapeMetrics, optional
+            Where the telemetry of the scrape is recorded, by default telemetry.METRICS.
+            Give it an export_path to get snapshots written while the season is scraped.
+        cache_dir : str, optional
+            Directory of the html cache, by default no cache
+        parse_cache_dir : str, optional
+            Directory of the parsed boxscores (see boxscores.BoxscoreCache), by default every boxscore is parsed
         """
         # Check if the url is valid
         assert re.match(r'https://www.hockey-reference.com/leagues/NHL_\d{4}.html',url),f"Season url must be in form of https://www.hockey-reference.com/leagues/NHL_xxxx.html, not {url}"
-        self.season_soup = get_soup(url)
+        self.metrics = metrics if metrics is not None else METRICS
+        self.cache_dir = cache_dir
+        self.season_soup = get_soup(url,metrics=self.metrics,cache_dir=cache_dir)
         # Remove the .html from the url
         self.url = url.split('.html')[0] # https://www.hockey-reference.com/leagues/NHL_xxxx Use this to get various tables/data
         self.verbose = verbose
+        self.parse_cache = BoxscoreCache(parse_cache_dir,os.path.basename(self.url),PARSER_TAG) if parse_cache_dir is not None else None
         self.games = []
         self._get_team_names()
         self._get_games()
         self._get_game_stats()
+        if self.metrics.export_path is not None:
+            self.metrics.export()
+    def _read_html(self,url:str)->str:
+        return get_html(url,metrics=self.metrics,cache_dir=self.cache_dir)
     def _get_team_names(self):
         # Get the expanded standings table https://www.hockey-reference.com/leagues/NHL_xxxx_standings.html#expanded_standings
         standings_link = self.url + '_standings.html#expanded_standings'
-        standings_table = pd.read_html(standings_link)[0]
+        standings_html = self._read_html(standings_link)
+        with self.metrics.stage("read_standings"):
+            standings_table = pd.read_html(io.StringIO(standings_html))[0]
         self.team_names = standings_table.iloc[:,1].values
         self.team_names.sort()
     def _get_games(self):
         # Get the table with all the games. https://www.hockey-reference.com/leagues/NHL_xxxx_games.html#games
         games_table_link = self.url + '_games.html#games'
-        self._game_table = pd.read_html(games_table_link)[0]
+        games_html = self._read_html(games_table_link) # Fetched once, used for both the table and the links
+        with self.metrics.stage("read_games"):
+            self._game_table = pd.read_html(io.StringIO(games_html))[0]
         if self.verbose:
             # Print number of games
             print(f"Found {len(self._game_table)} games")
@@ -158,19 +292,28 @@ class WebSeason:
         # The table contains hyperlinks to the games. We need to get the links to the games.
         # The links are in the form of /boxscores/xxxxxxxx.html
         # Get soup of the games link
-        games_soup = get_soup(games_table_link)
+        games_soup = BeautifulSoup(games_html,'html.parser')
         self._game_links = [self.url+link.get('href') for link in games_soup.find(id='all_games').find_all('a') if "/boxscores/" in link.get('href')]
         # Get all the links
     def _get_game_stats(self):
-        # Get the stats of all the games
-        i = 10
-        for game_link,away_team,home_team in tqdm(zip(self._game_links,self._game_table["Visitor"].values,self._game_table["Home"].values)):
-            self.games.append(WebGame(game_link,home_team,away_team,verbose=self.verbose))
+        # The handles of all the games, nothing is fetched until their stats are used or prefetch is called.
+        for game_link,away_team,home_team in zip(self._game_links,self._game_table["Visitor"].values,self._game_table["Home"].values):
+            self.games.append(WebGame(game_link,home_team,away_team,verbose=self.verbose,metrics=self.metrics,cache_dir=self.cache_dir,parse_cache=self.parse_cache))
             if self.verbose:
                 print(f"Found game {game_link}")
-            i -= 1
-            if i == 0:
-                break
+    def prefetch(self,max_workers:int=8,parse:bool=True)->List[WebGame]:
+        """Fetch (and parse) the boxscores of all the games in a batch, see prefetch."""
+        try:
+            return prefetch(self.games,max_workers=max_workers,parse=parse,progress=True)
+        finally:
+            if self.metrics.export_path is not None:
+                self.metrics.export()
+    def schedule_season(self):
+        """
+        Build a results-only Season (goals, record, win% and head-to-head) from the schedule table, no boxscores are used.
+        """
+        from DataScraping.schedule import schedule_to_season
+        return schedule_to_season(self._game_table)
     def print_games(self):
         for game in self.games:
             print(game)
@@ -0,0 +1,179 @@
+# This is a file which builds a results-only Season straight from the schedule table of a season.
+# Author: Theodor Jonsson
+# Path: DataScraping/schedule.py
+#
+#   The schedule/results table (https://www.hockey-reference.com/leagues/NHL_xxxx_games.html#games)
+#   already holds the teams and the score of every game. The features are computed with vectorised
+#   group operations over the whole table, so no boxscore has to be fetched and no per game objects are built.
+#   Features (pre-game, per team): Goals and Goals Against per game, Win%, and the head-to-head record against the opponent.
+#   The derived (DataRepresentations/Derived.py) and schedule (DataRepresentations/Schedule.py) blocks can be added,
+#   both are computed for all the games at once as well. Only the derived features of the goals and results can be computed.
+import os
+import io
+import sys
+import datetime as dt
+from typing import List, Dict, Tuple, Union, Optional
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from DataRepresentations.Representations import SeasonID
+from DataRepresentations.Teams import Team, TeamList
+from DataRepresentations.Season import Season
+from DataRepresentations.Storage import NO_RECORD
+from DataRepresentations.Derived import REGISTRY
+from DataRepresentations.Schedule import schedule_features, FEATURES as SCHEDULE_FEATURES, BLOCK as SCHEDULE_BLOCK
+from DataScraping.utils import get_html
+from DataScraping.telemetry import ScrapeMetrics
+# Constants
+# These are the column names of the schedule table
+DATE_KEY = "Date"
+VISITOR_KEY = "Visitor"
+VISITOR_GOALS_KEY = "G"
+HOME_KEY = "Home"
+HOME_GOALS_KEY = "G.1"
+# The stat keys of the Season built from the schedule
+FEATURE_KEYS = ["Goals", "Goals Against", "Win%", "H2H Wins", "H2H Losses", "H2H Ties"]
+GAME_KEYS = ["Goals", "Goals Against", "OT"]
+EPOCH_ORDINAL = dt.date(1970, 1, 1).toordinal() # datetime64[D] counts days from 1970-01-01
+
+def get_schedule_table(season_url:str, metrics:ScrapeMetrics=None, cache_dir:str=None)->pd.DataFrame:
+    """
+    Get the schedule/results table of a season.
+
+    Parameters
+    ----------
+    season_url : str
+        The url of the season, https://www.hockey-reference.com/leagues/NHL_xxxx.html
+    metrics : ScrapeMetrics, optional
+        Where the request is recorded, by default telemetry.METRICS
+    cache_dir : str, optional
+        Directory of the html cache, by default no cache
+    """
+    url = season_url.split('.html')[0]
+    return pd.read_html(io.StringIO(get_html(url + '_games.html#games', metrics=metrics, cache_dir=cache_dir)))[0]
+
+def _overtime_column(table:pd.DataFrame)->Optional[str]:
+    # The OT/SO column has no header, it is the first unnamed column after the home goals.
+    for column in table.columns:
+        if str(column).startswith("Unnamed"):
+            return column
+    return None
+
+def schedule_to_season(table:pd.DataFrame, season_id:SeasonID=None, derived:Union[bool,List[str]]=None, schedule:bool=False)->Season:
+    """
+    Build a Season from the schedule/results table of a season.\n
+    Only the played games (with a score) are used. The Season has a "TD" block with the keys in FEATURE_KEYS,
+    the records before each game and the result. The teams of the TeamList hold no per game stats.
+    derived and schedule add the "Derived" and "Schedule" blocks as in Season, computed from the goals and dates of the games.
+    derived=True is every derived feature of GAME_KEYS and the results, ValueError for named features which need other stats.
+    """
+    if derived:
+        supported = REGISTRY.available(GAME_KEYS)
+        derived = supported if derived is True else list(derived)
+        unsupported = [name for name in derived if name in REGISTRY and name not in supported]
+        if unsupported:
+            raise ValueError(f"The derived features {unsupported} need stats which are not in the schedule table, only {supported} can be computed")
+    goals_home = pd.to_numeric(table[HOME_GOALS_KEY], errors="coerce")
+    goals_away = pd.to_numeric(table[VISITOR_GOALS_KEY], errors="coerce")
+    played = goals_home.notna().values & goals_away.notna().values
+    table = table[played]
+    dates = pd.to_datetime(table[DATE_KEY]).values.astype("datetime64[D]")
+    order = np.argsort(dates, kind="stable")
+    dates = dates[order]
+    home_names = table[HOME_KEY].values[order].astype(str)
+    away_names = table[VISITOR_KEY].values[order].astype(str)
+    home_goals = goals_home.values[played][order].astype(float)
+    away_goals = goals_away.values[played][order].astype(float)
+    overtime_column = _overtime_column(table)
+    # 0 in regulation, 1 after overtime and 2 after a shootout.
+    if overtime_column is not None:
+        column = table[overtime_column]
+        overtime = np.where(column.astype(str).str.upper().values == "SO", 2, column.notna().values.astype(int))[order]
+    else:
+        overtime = np.zeros(len(table), dtype=int)
+    names = np.unique(np.concatenate([home_names, away_names]))
+    home = np.searchsorted(names, home_names)
+    away = np.searchsorted(names, away_names)
+    n = len(dates)
+    # Long format, one row per team and game, ordered by game so the cumulative sums follow the schedule.
+    long = pd.DataFrame({
+        "game": np.repeat(np.arange(n), 2),
+        "side": np.tile([0, 1], n),
+        "team": np.column_stack([home, away]).ravel(),
+        "opponent": np.column_stack([away, home]).ravel(),
+        "gf": np.column_stack([home_goals, away_goals]).ravel(),
+        "ga": np.column_stack([away_goals, home_goals]).ravel(),
+    })
+    long["win"] = (long["gf"] > long["ga"]).astype(int)
+    long["loss"] = (long["gf"] < long["ga"]).astype(int)
+    long["tie"] = (long["gf"] == long["ga"]).astype(int)
+    by_team = long.groupby("team", sort=False)
+    # Cumulative sum minus the game itself gives the totals before the game.
+    before = by_team[["gf", "ga", "win", "loss", "tie"]].cumsum() - long[["gf", "ga", "win", "loss", "tie"]]
+    played_before = by_team.cumcount().values
+    h2h = long.groupby(["team", "opponent"], sort=False)[["win", "loss", "tie"]].cumsum() - long[["win", "loss", "tie"]]
+    games = np.maximum(played_before, 1)
+    features = np.column_stack([
+        before["gf"].values / games,
+        before["ga"].values / games,
+        before["win"].values / games,
+        h2h["win"].values,
+        h2h["loss"].values,
+        h2h["tie"].values,
+    ]).reshape(n, 2, 1, len(FEATURE_KEYS))
+    present = np.broadcast_to((played_before > 0).reshape(n, 2, 1, 1), features.shape)
+    records = before[["win", "loss", "tie"]].values.reshape(n, 2, 3).astype(np.int32)
+    records[played_before.reshape(n, 2) == 0] = NO_RECORD
+    game_stats = np.stack([
+        np.column_stack([home_goals, away_goals, overtime]),
+        np.column_stack([away_goals, home_goals, overtime]),
+    ], axis=1).astype(float)
+    # Build the Season around the arrays.
+    season_id = season_id if season_id is not None else SeasonID(number_of_teams=len(names))
+    team_list = TeamList(season_id=season_id)
+    for name in names:
+        team_list.add_team(Team(team_list.registry.intern(name), season_id))
+    season = Season(team_list, derived=derived, schedule=schedule)
+    store = season.store
+    derived_keys = season._derived.compiled.names if season._derived is not None else []
+    store.add_keys(FEATURE_KEYS + GAME_KEYS + derived_keys + (SCHEDULE_FEATURES if schedule else []))
+    # The feature and game keys share the stat axis of the store.
+    stats = len(store.keys)
+    blocks = len(store.blocks)
+    full_features = np.zeros((n, 2, blocks, stats))
+    full_present = np.zeros((n, 2, blocks, stats), dtype=bool)
+    full_game_stats = np.zeros((n, 2, stats))
+    feature_columns = [store.keys.index(key) for key in FEATURE_KEYS]
+    game_columns = [store.keys.index(key) for key in GAME_KEYS]
+    block = store.blocks.index("TD")
+    full_features[:, :, block:block+1, feature_columns] = features
+    full_present[:, :, block:block+1, feature_columns] = present
+    full_game_stats[..., game_columns] = game_stats
+    full_game_present = np.zeros((n, 2, stats), dtype=bool)
+    full_game_present[..., game_columns] = True
+    teams = np.array([store.team_index(team.id) for team in team_list], dtype=np.int32)
+    store.extend(
+        ordinals=(dates.astype(np.int64) + EPOCH_ORDINAL).astype(np.int32),
+        teams=teams[np.column_stack([home, away])],
+        features=full_features,
+        present=full_present,
+        records=records,
+        results=np.sign(home_goals - away_goals).astype(np.int8),
+        game_stats=full_game_stats,
+        game_present=full_game_present,
+    )
+    # The blocks computed from the games in the store, then the running states of Season.add_game are rebuilt from it.
+    if season._derived is not None:
+        block, columns = store.blocks.index("Derived"), [store.keys.index(key) for key in derived_keys]
+        store.features[:, :, block, columns] = season._derived.compiled.pregame(store)
+        store.present[:, :, block, columns] = (played_before > 0).reshape(n, 2, 1)
+        season._derived.reset(store)
+    if season._schedule is not None:
+        block, columns = store.blocks.index(SCHEDULE_BLOCK), [store.keys.index(key) for key in SCHEDULE_FEATURES]
+        store.features[:, :, block, columns], store.present[:, :, block, columns] = schedule_features(store.ordinals, store.teams)
+        season._schedule.reset(store)
+    return season
+
+def load_schedule_season(season_url:str, season_id:SeasonID=None, derived:Union[bool,List[str]]=None, schedule:bool=False)->Season:
+    """Fetch the schedule table of a season and build the results-only Season from it."""
+    return schedule_to_season(get_schedule_table(season_url), season_id, derived=derived, schedule=schedule)
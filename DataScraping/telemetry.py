@@ -0,0 +1,347 @@
+# This is a file which contains the telemetry of the scraping pipeline.
+# Author: Theodor Jonsson
+# Path: DataScraping/telemetry.py
+#
+#   Every request made through fetch is timed per stage of the HTTP layer:
+#   - dns_probe - A separate getaddrinfo of the host, at most once a minute per host. The connection resolves the name
+#                 itself (usually from the resolver cache) and that lookup is part of connect, so this is a probe, not per request.
+#   - connect   - Opening the connection, including TLS. Zero when a kept alive connection is reused.
+#   - ttfb      - From sending the request until the response headers have arrived
+#   - download  - Reading the body
+#   The parsing stages (e.g. get_tables, process_table) are timed with ScrapeMetrics.stage.
+#   Bytes fetched, cache hits/misses, HTTP status codes, retries and failures per url are counted as well.
+#   Unlike the plain requests.get the scraper used before, fetch raises requests.HTTPError when the site still answers
+#   429/5xx after the retries, instead of returning the error page as if it were the content.
+#   The metrics can be written as a JSON snapshot or a Prometheus text file, both during and after a run.
+import os
+import json
+import time
+import socket
+import hashlib
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import List, Dict, Tuple, Union, Optional, Any
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+# Constants
+RETRY_STATUS = (429, 500, 502, 503, 504) # Status codes which are retried, 429 is the site throttling us
+SAMPLES = 1024 # Number of recent samples kept per stage for the quantiles
+
+class StageStats:
+    """Count, sum, min and max of the durations of a stage and a window of the most recent samples."""
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        self.samples = deque(maxlen=SAMPLES)
+    def add(self, seconds:float)->None:
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+    def quantile(self, q:float)->float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+    def to_dict(self)->Dict[str,float]:
+        return {
+            "count": self.count,
+            "sum_s": self.total,
+            "mean_s": self.total / self.count if self.count else 0.0,
+            "min_s": self.min if self.count else 0.0,
+            "max_s": self.max,
+            "p50_s": self.quantile(0.5),
+            "p95_s": self.quantile(0.95),
+        }
+
+class ScrapeMetrics:
+    def __init__(self, export_path:str=None, export_format:str="json", export_interval:float=10.0) -> None:
+        """
+        Thread safe metrics of a scraping run.
+
+        Parameters
+        ----------
+        export_path : str, optional
+            If given, a snapshot is written to this file at most every export_interval seconds while scraping
+            and whenever export is called.
+        export_format : str, optional
+            "json" or "prometheus", by default "json"
+        export_interval : float, optional
+            Minimum number of seconds between two snapshots written during the run, by default 10
+        """
+        assert export_format in ["json", "prometheus"], f"Export format must be 'json' or 'prometheus', not {export_format}"
+        self.export_path = export_path
+        self.export_format = export_format
+        self.export_interval = export_interval
+        self._lock = threading.Lock()
+        self.reset()
+    def reset(self)->None:
+        with self._lock:
+            self.started = time.time()
+            self.stages:Dict[str,StageStats] = {}
+            self.requests = 0
+            self.bytes = 0
+            self.cache_hits = 0
+            self.cache_misses = 0
+            self.status:Dict[int,int] = {}
+            self.retries:Dict[str,int] = {}
+            self.failures:Dict[str,int] = {}
+            self._last_export = 0.0
+    # ---- Recording ----
+    def observe(self, stage:str, seconds:float)->None:
+        with self._lock:
+            if stage not in self.stages:
+                self.stages[stage] = StageStats()
+            self.stages[stage].add(seconds)
+    @contextmanager
+    def stage(self, name:str):
+        """Time the block as the given stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+    def record_response(self, url:str, status:int, n_bytes:int)->None:
+        with self._lock:
+            self.requests += 1
+            self.bytes += n_bytes
+            self.status[status] = self.status.get(status, 0) + 1
+        self.maybe_export()
+    def record_retry(self, url:str)->None:
+        with self._lock:
+            self.retries[url] = self.retries.get(url, 0) + 1
+    def record_failure(self, url:str)->None:
+        with self._lock:
+            self.failures[url] = self.failures.get(url, 0) + 1
+        self.maybe_export()
+    def record_cache(self, hit:bool)->None:
+        with self._lock:
+            if hit:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+    # ---- Exporting ----
+    @property
+    def cache_hit_ratio(self)->float:
+        lookups = self.cache_hits + self.cache_misses
+        return self.cache_hits / lookups if lookups else 0.0
+    def snapshot(self)->Dict[str,Any]:
+        """The current metrics as a dictionary."""
+        with self._lock:
+            elapsed = max(time.time() - self.started, 1e-9)
+            return {
+                "started": self.started,
+                "elapsed_s": elapsed,
+                "requests": self.requests,
+                "requests_per_s": self.requests / elapsed,
+                "bytes": self.bytes,
+                "bytes_per_s": self.bytes / elapsed,
+                "cache": {"hits": self.cache_hits, "misses": self.cache_misses, "hit_ratio": self.cache_hit_ratio},
+                "status": {str(code): n for code, n in sorted(self.status.items())},
+                "stages": {name: stats.to_dict() for name, stats in self.stages.items()},
+                "retries": dict(self.retries),
+                "failures": dict(self.failures),
+            }
+    def to_json(self)->str:
+        return json.dumps(self.snapshot(), indent=2)
+    def to_prometheus(self, prefix:str="hockeypred_scrape")->str:
+        """The metrics in the Prometheus text exposition format. Retries and failures are summed per host to bound the label values."""
+        snapshot = self.snapshot()
+        lines = []
+        def metric(name:str, kind:str, help_text:str, samples:List[Tuple[str,float]])->None:
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{prefix}_{name}{labels} {value}")
+        metric("requests_total", "counter", "Responses received.", [("", snapshot["requests"])])
+        metric("bytes_total", "counter", "Bytes of response bodies fetched.", [("", snapshot["bytes"])])
+        metric("cache_hits_total", "counter", "Pages served from the html cache.", [("", snapshot["cache"]["hits"])])
+        metric("cache_misses_total", "counter", "Pages not in the html cache.", [("", snapshot["cache"]["misses"])])
+        metric("responses_total", "counter", "Responses per HTTP status code.",
+               [(f'{{code="{code}"}}', n) for code, n in snapshot["status"].items()])
+        metric("retries_total", "counter", "Retried requests per host.", [(f'{{host="{host}"}}', n) for host, n in _per_host(snapshot["retries"]).items()])
+        metric("failures_total", "counter", "Requests which failed after all retries per host.", [(f'{{host="{host}"}}', n) for host, n in _per_host(snapshot["failures"]).items()])
+        stage_samples = []
+        for name, stats in snapshot["stages"].items():
+            stage_samples.append((f'{{stage="{name}",quantile="0.5"}}', stats["p50_s"]))
+            stage_samples.append((f'{{stage="{name}",quantile="0.95"}}', stats["p95_s"]))
+            stage_samples.append((f'_sum{{stage="{name}"}}', stats["sum_s"]))
+            stage_samples.append((f'_count{{stage="{name}"}}', stats["count"]))
+        metric("stage_seconds", "summary", "Duration of the stages of the pipeline.", stage_samples)
+        return "\n".join(lines) + "\n"
+    def export(self, path:str=None, export_format:str=None)->None:
+        """Write a snapshot to the file, the file is replaced atomically so readers never see a partial snapshot."""
+        path = path or self.export_path
+        assert path is not None, "No export path given"
+        export_format = export_format or self.export_format
+        text = self.to_prometheus() if export_format == "prometheus" else self.to_json()
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, path)
+        self._last_export = time.time()
+    def maybe_export(self)->None:
+        """Export if an export path is set and export_interval seconds have passed since the last snapshot."""
+        if self.export_path is not None and time.time() - self._last_export >= self.export_interval:
+            self.export()
+    def __str__(self) -> str:
+        return f"ScrapeMetrics({self.requests} requests, {self.bytes} bytes, {sum(self.failures.values())} failures)"
+
+def _per_host(per_url:Dict[str,int])->Dict[str,int]:
+    hosts = {}
+    for url, n in per_url.items():
+        host = urlsplit(url).hostname or url
+        hosts[host] = hosts.get(host, 0) + n
+    return hosts
+
+# The metrics used when none are given
+METRICS = ScrapeMetrics()
+
+# ---- HTTP layer ----
+# The connection classes record how long opening the connection took in a thread local,
+# so the time can be attributed to the request made by the thread.
+_timing = threading.local()
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _timing.connect = getattr(_timing, "connect", 0.0) + time.perf_counter() - start
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _timing.connect = getattr(_timing, "connect", 0.0) + time.perf_counter() - start
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+class TimedAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections record their connect time."""
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _TimedHTTPConnectionPool, "https": _TimedHTTPSConnectionPool}
+
+def timed_session()->requests.Session:
+    session = requests.Session()
+    adapter = TimedAdapter()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+_sessions = threading.local() # requests.Session is not thread safe, one per thread
+_resolved:Dict[str,float] = {} # host -> time of the last measured lookup
+
+def _session()->requests.Session:
+    if not hasattr(_sessions, "session"):
+        _sessions.session = timed_session()
+    return _sessions.session
+
+def _resolve(host:str, port:int, metrics:ScrapeMetrics)->None:
+    # Time the lookup once a minute per host, the connection resolves the name again (from the resolver cache).
+    if time.time() - _resolved.get(host, 0.0) < 60:
+        return
+    with metrics.stage("dns_probe"):
+        try:
+            socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except socket.gaierror:
+            pass # The request itself reports the failure
+    _resolved[host] = time.time()
+
+def cache_path(url:str, cache_dir:str)->str:
+    return os.path.join(cache_dir, hashlib.sha1(url.encode()).hexdigest() + ".html")
+
+def fetch(url:str,
+          metrics:ScrapeMetrics=None,
+          cache_dir:str=None,
+          retries:int=3,
+          backoff:float=2.0,
+          timeout:float=30.0,
+          session:requests.Session=None,
+          )->str:
+    """
+    Get the text of a url, recording the telemetry of the request.
+
+    Parameters
+    ----------
+    url : str
+        The url to fetch
+    metrics : ScrapeMetrics, optional
+        Where to record the telemetry, by default the module wide METRICS
+    cache_dir : str, optional
+        If given, the html is read from/stored in this directory and cache hits are counted
+    retries : int, optional
+        Number of retries on connection errors and throttling/server errors, by default 3
+    backoff : float, optional
+        Seconds to wait before the first retry, doubled for every retry. Retry-After is used when the site sends it.
+    timeout : float, optional
+        Timeout of the connection and of reading, by default 30
+    session : requests.Session, optional
+        The session to use, by default a timed session per thread
+
+    Raises
+    ------
+    requests.HTTPError
+        If the response is still 429/5xx after the retries, the error page is not returned. Other 4xx responses are returned.
+    requests.RequestException
+        If the connection fails on every attempt
+    """
+    metrics = metrics if metrics is not None else METRICS
+    if cache_dir is not None:
+        path = cache_path(url, cache_dir)
+        if os.path.exists(path):
+            metrics.record_cache(True)
+            with open(path, encoding="utf-8") as f:
+                return f.read()
+        metrics.record_cache(False)
+    session = session if session is not None else _session()
+    parts = urlsplit(url)
+    _resolve(parts.hostname, parts.port or (443 if parts.scheme == "https" else 80), metrics)
+    wait = backoff
+    for attempt in range(retries + 1):
+        _timing.connect = 0.0
+        try:
+            start = time.perf_counter()
+            response = session.get(url, stream=True, timeout=timeout)
+            headers = time.perf_counter()
+            content = response.content # Reads the body
+            done = time.perf_counter()
+        except requests.RequestException:
+            if attempt == retries:
+                metrics.record_failure(url)
+                raise
+        else:
+            metrics.observe("connect", _timing.connect)
+            metrics.observe("ttfb", headers - start - _timing.connect)
+            metrics.observe("download", done - headers)
+            metrics.record_response(url, response.status_code, len(content))
+            if response.status_code not in RETRY_STATUS:
+                break
+            if attempt == retries:
+                metrics.record_failure(url)
+                response.raise_for_status()
+            retry_after = response.headers.get("Retry-After")
+            if retry_after is not None and retry_after.isdigit():
+                wait = max(wait, float(retry_after))
+        metrics.record_retry(url)
+        time.sleep(wait)
+        wait *= 2
+    text = response.text
+    if cache_dir is not None and response.ok:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+    return text
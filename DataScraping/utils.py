@@ -27,22 +27,26 @@ import json
 import re
 import os
 import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from DataScraping.telemetry import ScrapeMetrics, fetch
 
-def get_soup(url:str,parser:str='html.parser',verbose:bool=False)->BeautifulSoup:
+def get_soup(url:str,parser:str='html.parser',verbose:bool=False,metrics:ScrapeMetrics=None,cache_dir:str=None)->BeautifulSoup:
     """
-    Get the soup of a url
+    Get the soup of a url, the request is recorded in metrics (see telemetry.fetch)
+    Raises requests.HTTPError if the site answers 429/5xx after the retries, before telemetry the error page was returned.
     """
     if verbose:
         print(f"Getting soup from {url}")
-    return BeautifulSoup(requests.get(url).text,parser)
+    return BeautifulSoup(fetch(url,metrics=metrics,cache_dir=cache_dir),parser)
 
-def get_html(url:str,verbose:bool=False)->str:
+def get_html(url:str,verbose:bool=False,metrics:ScrapeMetrics=None,cache_dir:str=None)->str:
     """
-    Get the html of a url
+    Get the html of a url, the request is recorded in metrics (see telemetry.fetch)
+    Raises requests.HTTPError if the site answers 429/5xx after the retries, before telemetry the error page was returned.
     """
     if verbose:
         print(f"Getting html from {url}")
-    return requests.get(url).text
+    return fetch(url,metrics=metrics,cache_dir=cache_dir)
 
 def get_json(url:str,verbose:bool=False)->dict:
     """
@@ -0,0 +1,320 @@
+# Benchmark suite for the hot paths of DataRepresentations.
+# Usage:
+#   python benchmark.py                                  # Run everything and print a table
+#   python benchmark.py --json bench.json                # Also write the results as json
+#   python benchmark.py --compare bench.json             # Compare against a baseline, exits with 1 on a regression
+#   python benchmark.py --filter add_game --repeat 10    # Only run the matching benchmarks
+#   python benchmark.py --filter startup --import-budget 0.3  # Fails if importing the package is slower than 0.3 s
+# Every benchmark is seeded, the inputs are generated before the clock starts.
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Tuple
+import numpy as np
+from testingfunctions import TEAM_NAMES, all_match_ups, simulate_game, rand_team_stats
+from DataRepresentations.Representations import Date, DateList, Stats, StatList, TeamID
+from DataRepresentations.Teams import Team, TeamList
+from DataRepresentations.Season import Season, SeasonExporter
+from DataRepresentations.Synthetic import generate_league
+from DataRepresentations.Parallel import SeasonJob, build_seasons, synthetic_source
+from DataRepresentations.Simulation import simulate, RatingModel
+
+SEED = 2023
+TEAMS = [2, 8, 32]
+REPS = [1, 10, 100]
+HISTORY_LENGTHS = [10, 100, 1000]
+DATE_LIST_LENGTHS = [100, 1000, 10000]
+STAT_SIZES = [16, 150]
+STARTUP_MODULES = ["DataRepresentations.Season", "DataRepresentations.Predictor"]
+# Modules which must not be imported just by importing the package, only when plotting/converting.
+HEAVY_MODULES = ["pandas", "matplotlib", "matplotlib.pyplot", "bar_chart_race", "tqdm"]
+IMPORT_BUDGET = 0.5 # Seconds, including the interpreter startup
+BACKFILL_SEASONS = 8
+
+def seed(value:int=SEED)->None:
+    random.seed(value)
+    np.random.seed(value)
+
+def team_list(n_teams:int)->TeamList:
+    # Same as testingfunctions.team_list but not limited to the 30 NHL names.
+    tl = TeamList()
+    for i in range(n_teams):
+        tl.add_team(Team(TeamID(TEAM_NAMES[i] if i < len(TEAM_NAMES) else f"Team {i}"), None))
+    return tl
+
+def generate_games(n_teams:int, reps:int)->Tuple:
+    """Returns the team list and the games of a season, each match up is played reps times."""
+    tl = team_list(n_teams)
+    match_ups = all_match_ups(tl)
+    date = Date(2019,1,1)
+    games = []
+    for _ in range(reps):
+        for home, away in match_ups:
+            games.append(simulate_game(home, away, date))
+            date = date.next_date()
+    return tl, games
+
+def build_season(n_teams:int, reps:int, **kwargs)->Season:
+    tl, games = generate_games(n_teams, reps)
+    season = Season(tl, **kwargs)
+    for game in games:
+        season.add_game(game)
+    return season
+
+def measure(setup:Callable[[], object], run:Callable[[object], int], repeat:int)->Dict[str, float]:
+    """Run setup (untimed) and run (timed) repeat times, run returns the number of operations it did."""
+    times = []
+    ops = 1
+    for _ in range(repeat):
+        seed()
+        state = setup()
+        start = time.perf_counter()
+        ops = run(state) or 1
+        times.append(time.perf_counter() - start)
+    times.sort()
+    median = times[len(times)//2]
+    return {"min": times[0], "median": median, "ops": ops, "ops_per_s": ops / median if median else float("inf"), "repeat": repeat}
+
+# ---- Benchmarks ----
+# Each benchmark yields (name, setup, run) triplets.
+def bench_season_add_game(max_games:int):
+    for n_teams in TEAMS:
+        for reps in REPS:
+            n_games = n_teams * (n_teams - 1) * reps
+            if n_games > max_games:
+                continue
+            def setup(n_teams=n_teams, reps=reps):
+                tl, games = generate_games(n_teams, reps)
+                return Season(tl, average=True, home=True, away=True, last_n=5), games
+            def run(state):
+                season, games = state
+                for game in games:
+                    season.add_game(game)
+                return len(games)
+            yield f"season.add_game[teams={n_teams},reps={reps}]", setup, run
+
+def _stat_list(length:int)->StatList:
+    date = Date(2019,1,1)
+    stats = StatList()
+    for _ in range(length):
+        stats.append(Stats(rand_team_stats(), date, True))
+        date = date.next_date()
+    return stats
+
+def bench_total_to_date(max_games:int):
+    for length in HISTORY_LENGTHS:
+        def setup(length=length):
+            stats = _stat_list(length)
+            return stats, list(stats.stats.keys())[-1]
+        def run(state):
+            stats, last = state
+            for _ in range(10):
+                stats.total_to_date(last)
+            return 10
+        yield f"statlist.total_to_date[history={length}]", setup, run
+
+def bench_closest_date(max_games:int):
+    for length in DATE_LIST_LENGTHS:
+        def setup(length=length):
+            dates = DateList()
+            date = Date(2000,1,1)
+            for _ in range(length):
+                dates.add_date(date)
+                date = date.next_date()
+            queries = [dates[random.randrange(length)] for _ in range(100)]
+            return dates, queries
+        def run(state):
+            dates, queries = state
+            for query in queries:
+                dates.get_closest_date(query)
+            return len(queries)
+        yield f"datelist.get_closest_date[dates={length}]", setup, run
+
+def bench_stats_arithmetic(max_games:int):
+    for size in STAT_SIZES:
+        def setup(size=size):
+            date = Date(2019,1,1)
+            a = Stats({f"stat_{i}": random.random() for i in range(size)}, date, True)
+            b = Stats({f"stat_{i}": random.random() for i in range(size)}, date, True)
+            return a, b
+        def run(state):
+            a, b = state
+            for _ in range(1000):
+                (a + b) / 2.0
+            return 1000
+        yield f"stats.add_div[keys={size}]", setup, run
+
+def bench_exporter(max_games:int):
+    directory = tempfile.mkdtemp(prefix="hockeypred_bench_")
+    def setup():
+        season = build_season(8, 10, average=True, home=True, away=True, last_n=5)
+        return SeasonExporter(season, export_dir=directory, export_file="bench.csv", progress=False)
+    def run(exporter):
+        exporter.export()
+        return len(exporter.season.store)
+    yield "season_exporter.export[teams=8,reps=10]", setup, run
+
+def bench_rankings(max_games:int):
+    def setup():
+        season = build_season(8, 10)
+        return season.team_list, season.played_dates[len(season.played_dates)//2]
+    def run(state):
+        teams, date = state
+        teams.sort_by_stat("Goals", date)
+        teams.sort_by_streak(date)
+        teams.sort_by_win_percentage(date)
+        teams.team_stat_list("Goals", date)
+        teams.team_stat_list("Win%", date)
+        return 5
+    yield "teamlist.rankings[teams=8,reps=10]", setup, run
+
+def bench_synthetic(max_games:int):
+    def setup():
+        return None
+    def run(state):
+        return len(generate_league(32, n_games=10**5, seed=SEED, missing=0.1))
+    yield "synthetic.generate_league[teams=32,games=1e5]", setup, run
+
+def bench_parallel(max_games:int):
+    # Same backfill serially and on every core, the ratio of the two is the speedup.
+    jobs = [SeasonJob(f"synthetic-{i}", synthetic_source, (16, None, SEED + i)) for i in range(BACKFILL_SEASONS)]
+    for processes in sorted({1, os.cpu_count() or 1}):
+        def setup():
+            return jobs
+        def run(jobs, processes=processes):
+            return len(build_seasons(jobs, dict(average=True, home=True, last_n=5), processes=processes))
+        yield f"parallel.build_seasons[seasons={BACKFILL_SEASONS},processes={processes}]", setup, run
+
+def bench_standings(max_games:int):
+    # Standings of every date of a full synthetic season, from scratch every time.
+    def setup():
+        league = generate_league(32, n_games=None, seed=SEED)
+        season = Season(league.team_list)
+        season.add_games(league.games())
+        return season
+    def run(season):
+        season._standings = None
+        return len(season.standings.values("Rank"))
+    yield "standings.rank[teams=32,full season]", setup, run
+
+def bench_simulation(max_games:int):
+    # The second half of a synthetic season, 1e5 times.
+    def setup():
+        league = generate_league(32, n_games=None, seed=SEED)
+        games = list(league.games())
+        season = Season(league.team_list)
+        season.add_games(games[:len(games) // 2])
+        return season, games[len(games) // 2:], RatingModel.fit(season)
+    def run(state):
+        season, remaining, model = state
+        return simulate(season, remaining, model, n=10**5, seed=SEED).n
+    yield "simulation.simulate[teams=32,half season,n=1e5]", setup, run
+
+def _import_command(module:str)->List[str]:
+    # A fresh interpreter every time, prints the heavy modules which were imported as a side effect.
+    code = f"import sys; import {module}; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    return [sys.executable, "-c", code]
+
+def bench_startup(max_games:int):
+    for module in STARTUP_MODULES:
+        def setup(module=module):
+            return _import_command(module)
+        def run(command):
+            subprocess.run(command, check=True, capture_output=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            return 1
+        yield f"startup.import[{module}]", setup, run
+
+def heavy_imports(module:str)->List[str]:
+    """The heavy modules which importing the module pulls in."""
+    output = subprocess.run(_import_command(module), check=True, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    return output.split(",") if output else []
+
+def check_startup(results:Dict[str, Dict[str, float]], budget:float)->List[str]:
+    """Returns the startup benchmarks over the budget or importing a heavy module."""
+    failures = []
+    for module in STARTUP_MODULES:
+        name = f"startup.import[{module}]"
+        if name not in results:
+            continue
+        if results[name]["median"] > budget:
+            print(f"{name} took {results[name]['median']:.3f}s, over the budget of {budget:.3f}s")
+            failures.append(name)
+        heavy = heavy_imports(module)
+        if heavy:
+            print(f"{name} imports {', '.join(heavy)} at startup")
+            failures.append(name)
+    return failures
+
+BENCHMARKS = [
+    bench_startup,
+    bench_season_add_game,
+    bench_total_to_date,
+    bench_closest_date,
+    bench_stats_arithmetic,
+    bench_exporter,
+    bench_rankings,
+    bench_synthetic,
+    bench_parallel,
+    bench_standings,
+    bench_simulation,
+]
+
+def run_benchmarks(pattern:str=None, repeat:int=5, max_games:int=1000)->Dict[str, Dict[str, float]]:
+    results = {}
+    for benchmark in BENCHMARKS:
+        for name, setup, run in benchmark(max_games):
+            if pattern and pattern not in name:
+                continue
+            results[name] = measure(setup, run, repeat)
+            print(f"{name:<50} median {results[name]['median']*1e3:10.3f} ms  {results[name]['ops_per_s']:12.1f} ops/s", flush=True)
+    return results
+
+def compare(results:Dict[str, Dict[str, float]], baseline:Dict[str, Dict[str, float]], threshold:float)->List[str]:
+    """Returns the names of the benchmarks whose median got slower than baseline*(1+threshold)."""
+    regressions = []
+    print(f"\n{'benchmark':<50} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]["median"], result["median"]
+        change = after / before - 1 if before else 0.0
+        flag = " REGRESSION" if change > threshold else ""
+        if flag:
+            regressions.append(name)
+        print(f"{name:<50} {before*1e3:10.3f}ms {after*1e3:10.3f}ms {change:+8.1%}{flag}")
+    return regressions
+
+def main(argv:List[str]=None)->int:
+    parser = argparse.ArgumentParser(description="Benchmarks for the DataRepresentations hot paths.")
+    parser.add_argument("--json", help="Write the results to this json file")
+    parser.add_argument("--compare", help="Baseline json file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown before a benchmark counts as a regression")
+    parser.add_argument("--filter", help="Only run benchmarks whose name contains this string")
+    parser.add_argument("--repeat", type=int, default=5)
+    # Season.add_game re-sums the history of both teams, the larger cases take minutes to hours.
+    parser.add_argument("--max-games", type=int, default=1000, help="Skip Season.add_game cases with more games than this")
+    parser.add_argument("--import-budget", type=float, default=IMPORT_BUDGET, help="Hard limit in seconds for importing the package, exits with 1 if exceeded")
+    args = parser.parse_args(argv)
+    results = run_benchmarks(args.filter, args.repeat, args.max_games)
+    failed = bool(check_startup(results, args.import_budget))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "meta": {"python": sys.version, "platform": platform.platform(), "seed": SEED, "time": time.time()},
+                "results": results,
+            }, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -73,6 +73,90 @@ def test_exporting_season(N:int=30,reps:int=10):
     season = simulate_season_weird(reps=reps,average=True,home=True,away=True,last_n=10)
     se = SeasonExporter(season)
     se.export()
+def _pandas_export(games, index_to_stat_type, path:str)->None:
+    # The pandas based writer SeasonExporter used before it was streamed, the reference for test_export_parity.
+    with open(path, "w") as f:
+        f.write("Game ID,Home Team ID,Away Team ID,Date\n")
+        for game_id, (date, stats_home, record_home, stats_away, record_away, result) in enumerate(games):
+            f.write(f"Game_{game_id},{result.home_team.name},{result.away_team.name},{date}\n")
+            for label, team_id, stats in (("TeamIDHome", result.home_team, stats_home), ("TeamIDAway", result.away_team, stats_away)):
+                f.write(f"{label},{team_id.id},{team_id.name},\n")
+                for i, stat in enumerate(stats):
+                    stat.to_pandas(index_to_stat_type[i]).to_csv(f, mode="a", header=False)
+                    f.write("\n")
+            f.write(f"Result,{result.home_win},{result.away_win},{result.tie}\n\n")
+def test_export_parity(N:int=4,reps:int=2):
+    import tempfile
+    season = simulate_season(N_teams=N,reps=reps,average=True,total=True,last_n=3)
+    # Ints, floats, missing values and mixed stats, the way Team totals and averages come out.
+    games = []
+    for date, stats_home, record_home, stats_away, record_away, result in season.games:
+        def mixed(stats):
+            out = []
+            for i, stat in enumerate(stats):
+                values = {key: int(value) if i % 2 else value for key, value in stat.stats.items()}
+                if values:
+                    values[next(iter(values))] = None if i == 0 else values[next(iter(values))]
+                out.append(Stats(values, date, stat.home))
+            return out
+        games.append((date, mixed(stats_home), record_home, mixed(stats_away), record_away, result))
+    directory = tempfile.mkdtemp()
+    reference = os.path.join(directory, "reference.csv")
+    _pandas_export(games, season.index_desc, reference)
+    exporter = SeasonExporter(season, export_dir=directory, export_file="streamed.csv", progress=False)
+    exporter.export(games)
+    with open(reference) as f, open(exporter.export_path) as g:
+        expected, streamed = f.read(), g.read()
+    assert streamed == expected, "export(games) must write the same text as the pandas writer"
+    print("export(games) matches the pandas writer")
+    # Without games the rows come from the store, ints must stay ints.
+    _pandas_export(season.games, season.index_desc, reference)
+    exporter = SeasonExporter(season, export_dir=directory, export_file="store.csv", progress=False)
+    exporter.export()
+    with open(reference) as f, open(exporter.export_path) as g:
+        assert g.read() == f.read(), "export() must write the same text as the pandas writer"
+    print("export() matches the pandas writer")
+def test_export_update(N:int=4,reps:int=2):
+    import tempfile
+    season = simulate_season(N_teams=N,reps=reps,average=True,total=True)
+    directory = tempfile.mkdtemp()
+    exporter = SeasonExporter(season, export_dir=directory, export_file="updated.csv", progress=False)
+    exporter.export()
+    # Only appended games, the common case of a nightly update.
+    game_date = season.last_date().next_date()
+    for home, away in all_match_ups(season.team_list)[:5]:
+        season.add_game(simulate_game(home, away, game_date))
+        game_date = game_date.next_date()
+    exporter.update()
+    full = SeasonExporter(season, export_dir=directory, export_file="full.csv", progress=False)
+    full.export()
+    with open(exporter.export_path) as f, open(full.export_path) as g:
+        assert f.read() == g.read(), "update() after appended games must match a full export"
+    print("update() appends the new games")
+def test_snapshot_registry_order(N:int=4,reps:int=2):
+    # Restore in a fresh process whose league registry has the teams (and others) in another order.
+    import json, subprocess, tempfile
+    from DataRepresentations.Snapshot import save_snapshot
+    season = simulate_season(N_teams=N,reps=reps,average=True,last_n=3)
+    path = os.path.join(tempfile.mkdtemp(), "season.snap")
+    save_snapshot(season, path)
+    expected = [[str(home.name), str(away.name), result.home_win] for (home, away), result in
+                ((game.teams, game.result) for game in season._raw_games)]
+    script = f"""
+import json
+from DataRepresentations.Representations import LEAGUE
+from DataRepresentations.Snapshot import load_snapshot
+for name in ["Other 1", "Other 2"] + {list(reversed(season.team_list.team_names))!r}:
+    LEAGUE.intern(name)
+season = load_snapshot({path!r})
+assert all(team.id == LEAGUE[team.name] for team in season.team_list), "Teams must be interned by name"
+print(json.dumps([[str(home.name), str(away.name), result.home_win] for (home, away), result in
+                  ((game.teams, game.result) for game in season._raw_games)]))
+"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    out = subprocess.run([sys.executable, "-c", script], cwd=root, capture_output=True, text=True, check=True).stdout
+    assert json.loads(out.splitlines()[-1]) == expected, "The restored games must be between the same teams"
+    print("Snapshot restored with another registry order")
 def test_visualizer():
     # season = simulate_season(reps=1,average=True,home=True,away=True,last_n=10)
     season_weird = simulate_season_weird(N_teams=2,reps=100,average=True,home=True,away=True,last_n=10)